@@ -5,10 +5,10 @@ import os
 class AgentABC(metaclass=ABCMeta):
     @abstractmethod
     def __init__(self, state_size, action_size, num_agents, random_seed):
-        self.debug_loss = 0
+        pass
 
     @abstractmethod
-    def step(self, states, actions, rewards, next_states, dones):
+    def step(self, states, actions, rewards, next_states, dones, valid=None, rollout=0):
         """
         agent step. this is called after every step of the environment (in training).
         learning should happen here. takes as arguments the RL tuple (s,a,r,s',d)
@@ -17,6 +17,10 @@ class AgentABC(metaclass=ABCMeta):
         :param rewards: reward vector for the current step (r)
         :param next_states: vector of next states (s')
         :param dones: vector to indicate if this was the terminal step of the episode (d)
+        :param valid: optional boolean vector, False for the cars whose transition is not to be stored (e.g. the
+        step a car starts over on, in a continuous rollout - its s is the terminal state of its previous episode)
+        :param rollout: index of the rollout the cars run in (e.g. the worker of distributed training). the next
+        step of a car continues its previous step of the same rollout
         """
         pass
 
@@ -34,7 +38,16 @@ class AgentABC(metaclass=ABCMeta):
         """
         this method is called after each episode in order to reset the agent's internal state.
         """
-        self.debug_loss = 0
+        pass
+
+    def restart(self, cars=None):
+        """
+        the cars start new episodes: their next observation does not continue the previous ones (e.g. an observation
+        history). this is called when the environment is reset (all the cars), and, in continuous mode, for the
+        cars that start over on their own.
+        :param cars: boolean vector of the cars that start over, all the cars if None
+        """
+        pass
 
     @abstractmethod
     def save_weights(self, directory_path):
@@ -73,6 +86,76 @@ class AgentABC(metaclass=ABCMeta):
         if not (os.path.isdir(directory_path)):
             raise NotADirectoryError
 
+    def episode_stats(self):
+        """
+        learning statistics of the current episode (critic_loss, actor_loss, q_value).
+        the statistics are accumulated on the device and only computed here, so only call it when needed.
+        :return: dictionary of name -> mean over the learning updates of the episode
+        """
+        return {}
+
+    @property
+    def debug_loss(self):
+        """ mean critic loss of the current episode """
+        return self.episode_stats().get('critic_loss', 0)
+
+    def add_experiences(self, states, actions, rewards, next_states, dones, aligned=True):
+        """
+        store many experiences in the replay buffer(s) without learning (e.g. recorded demonstrations).
+        every argument is an array with one row per env step, shaped like the arguments of step():
+        states (steps, num_agents, state_size), rewards (steps, num_agents), ...
+        :param aligned: whether the cars of a row were recorded at the same time (agents that learn from the joint
+        state of all the cars need it)
+        """
+        raise NotImplementedError
+
+    def update(self):
+        """
+        one learning update from the replay buffer, without adding new experience.
+        step() learns the same way after storing the experience - this is used to learn without an environment.
+        """
+        raise NotImplementedError
+
+    def actors(self):
+        """
+        the actor (policy) networks of the agent, one network per policy (in a fixed order).
+        this is used to move the policy between processes without going through save_weights.
+        :return: list of torch modules
+        """
+        raise NotImplementedError
 
+    def networks(self):
+        """
+        every trained network of the agent with its target network.
+        :return: dictionary of unique name -> (local torch module, target torch module)
+        """
+        raise NotImplementedError
 
+    def optimizers(self):
+        """
+        the optimizers of the agent's networks.
+        :return: dictionary of unique name -> torch optimizer
+        """
+        raise NotImplementedError
 
+    def replay_buffers(self):
+        """
+        the replay buffers of the agent.
+        :return: list of ReplayBuffer
+        """
+        raise NotImplementedError
+
+    def training_state(self):
+        """
+        the state of the agent besides its networks, optimizers and replay buffers (step counters, noise processes),
+        for resuming a training exactly where it stopped.
+        :return: picklable dictionary
+        """
+        raise NotImplementedError
+
+    def load_training_state(self, state):
+        """
+        restore the state returned by training_state.
+        :param state: dictionary returned by training_state
+        """
+        raise NotImplementedError
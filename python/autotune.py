@@ -0,0 +1,102 @@
+###################################
+# Throughput autotuner: short timed runs of the training step (act + step with its learning updates) on
+# synthetic data, over batch sizes, torch threads and update cadences. the fastest configuration is written
+# as a hyperparameters file for --hparams.
+import itertools
+import json
+import os
+import time
+from fractions import Fraction
+
+import numpy as np
+import torch
+
+from agent import AgentABC
+from utils.hyperparameters import TORCH_THREADS, apply_hyperparameters, get_hyperparameters
+
+MIN_SYNTHETIC_STEPS = 2000  # synthetic experiences in the replay buffer before timing (maddpg learns after 1000)
+WARMUP_STEPS = 5
+
+
+def update_cadence(updates_per_step):
+    """ :return: (UPDATE_EVERY, NUM_UPDATES) for a number of learning updates per env step, e.g. 0.5 -> (2, 1) """
+    fraction = Fraction(updates_per_step).limit_denominator(16)
+    if fraction <= 0:
+        print('updates per step must be positive')
+        raise ValueError(updates_per_step)
+    return fraction.denominator, fraction.numerator
+
+
+def time_training_step(agent_type, state_size, action_size, num_agents, batch_size, trial_seconds):
+    """
+    time the training step of an agent (the hyperparameters must already be applied).
+    :return: env steps per second
+    """
+    agent: AgentABC = agent_type(state_size=state_size, action_size=action_size, num_agents=num_agents,
+                                 random_seed=0)
+    rng = np.random.RandomState(0)
+    num_steps = max(MIN_SYNTHETIC_STEPS, 2 * batch_size)
+    agent.add_experiences(rng.randn(num_steps, num_agents, state_size).astype(np.float32),
+                          rng.uniform(-1, 1, (num_steps, num_agents, action_size)).astype(np.float32),
+                          rng.randn(num_steps, num_agents).astype(np.float32),
+                          rng.randn(num_steps, num_agents, state_size).astype(np.float32),
+                          np.zeros((num_steps, num_agents), dtype=bool))
+    states = rng.randn(num_agents, state_size).astype(np.float32)
+    rewards = [0.0] * num_agents
+    dones = [False] * num_agents
+
+    def training_step():
+        actions = agent.act(states)
+        agent.step(states, actions, rewards, states, dones)
+
+    for _ in range(WARMUP_STEPS):
+        training_step()
+    steps = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < trial_seconds:
+        training_step()
+        steps += 1
+    return steps / (time.perf_counter() - start)
+
+
+def autotune_wrapper(env_config, wrapper_config):
+    """
+    find the training configuration with the most learned samples per second on this machine.
+    :param env_config: dictionary, the environment parameters (num_agents)
+    :param wrapper_config: dictionary of user defined variables.
+    """
+    agent_type = wrapper_config['agent']
+    if not issubclass(agent_type, AgentABC):
+        print('invalid agent type')
+        raise TypeError
+    num_agents = env_config['num_agents']
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    # the limits of the search
+    batch_sizes = wrapper_config['batch_sizes']
+    threads = wrapper_config['threads'] or [t for t in [1, 2, 4, 8, 16, 32, 64] if t < cores] + [cores]
+    updates_per_step = wrapper_config['updates_per_step']
+    defaults = get_hyperparameters(agent_type, ['BATCH_SIZE', 'UPDATE_EVERY', 'NUM_UPDATES'])
+    print('\nagent defaults: {}, torch threads: {}'.format(defaults, torch.get_num_threads()))
+
+    results = []
+    for batch_size, num_threads, per_step in itertools.product(batch_sizes, threads, updates_per_step):
+        update_every, num_updates = update_cadence(per_step)
+        hparams = {'BATCH_SIZE': batch_size, 'UPDATE_EVERY': update_every, 'NUM_UPDATES': num_updates,
+                   TORCH_THREADS: num_threads}
+        apply_hyperparameters(agent_type, hparams)
+        steps_per_sec = time_training_step(agent_type, wrapper_config['state_size'], wrapper_config['action_size'],
+                                           num_agents, batch_size, wrapper_config['trial_seconds'])
+        # learned samples per second (one batch per learning update)
+        samples_per_sec = steps_per_sec * num_updates / update_every * batch_size
+        results.append((samples_per_sec, steps_per_sec, hparams))
+        print('\n{}\tenv steps/sec: {:.1f}\tsamples/sec: {:.0f}'.format(hparams, steps_per_sec, samples_per_sec),
+              end="")
+
+    results.sort(key=lambda r: r[0], reverse=True)
+    print('\n\nsamples/sec\tenv steps/sec\tconfiguration')
+    for samples_per_sec, steps_per_sec, hparams in results[:10]:
+        print('{:.0f}\t{:.1f}\t{}'.format(samples_per_sec, steps_per_sec, hparams))
+    best = results[0][2]
+    with open(wrapper_config['output'], 'w') as f:
+        json.dump(best, f, indent=4)
+    print('\nsaved {} - use it with: train --hparams {}'.format(wrapper_config['output'], wrapper_config['output']))
@@ -3,7 +3,11 @@ import random
 from agent import AgentABC
 from ddpg.ddpg_model import Actor, Critic
 from utils.replay_buffer import ReplayBuffer
+from utils.frame_history import FrameHistoryBuffer, FrameWindow
+from utils.mixed_precision import learn_autocast
 from utils.noise import OUNoise
+from utils.loss_stats import RunningStats
+from utils.checkpoint import has_bundle, load_bundle, remove_bundle
 
 import torch
 import torch.nn.functional as F
@@ -14,9 +18,13 @@ BUFFER_SIZE = int(1e6)  # replay buffer size
 BATCH_SIZE = 128        # minibatch size
 GAMMA = 0.99            # discount factor
 TAU = 1e-3              # for soft update of target parameters
+UPDATE_EVERY = 1        # learn every # steps
+NUM_UPDATES = 1         # how many learning steps to take each learning phase
 LR_ACTOR = 1e-4         # learning rate of the actor 
 LR_CRITIC = 1e-4        # learning rate of the critic
 WEIGHT_DECAY = 0.0      # L2 weight decay
+FRAME_HISTORY = 1       # number of last observations in the state of a car (the networks see them stacked)
+MIXED_PRECISION = False     # bfloat16 forward / backward passes in learn (float32 weights and soft updates)
 
 an_filename = "ddpgActor_Model.pth"  # default weights file names
 cn_filename = "ddpgCritic_Model.pth"
@@ -37,40 +45,77 @@ class Agent(AgentABC):
         self.action_size = action_size
         self.num_agents = num_agents
         self.seed = random.seed(random_seed)
+        # the networks see the last FRAME_HISTORY observations of a car
+        network_state_size = state_size * FRAME_HISTORY
 
         # Actor Network (w/ Target Network)
-        self.actor_local = Actor(state_size, action_size, random_seed).to(device)
-        self.actor_target = Actor(state_size, action_size, random_seed).to(device)
+        self.actor_local = Actor(network_state_size, action_size, random_seed).to(device)
+        self.actor_target = Actor(network_state_size, action_size, random_seed).to(device)
         self.actor_optimizer = optim.Adam(self.actor_local.parameters(), lr=LR_ACTOR)
 
         # Critic Network (w/ Target Network)
-        self.critic_local = Critic(state_size, action_size, random_seed).to(device)
-        self.critic_target = Critic(state_size, action_size, random_seed).to(device)
+        self.critic_local = Critic(network_state_size, action_size, random_seed).to(device)
+        self.critic_target = Critic(network_state_size, action_size, random_seed).to(device)
         self.critic_optimizer = optim.Adam(self.critic_local.parameters(), lr=LR_CRITIC, weight_decay=WEIGHT_DECAY)
 
         # Noise process for each agent
         self.noise = OUNoise((num_agents, action_size), random_seed)
 
-        # Replay memory
-        self.memory = ReplayBuffer(action_size, BUFFER_SIZE, BATCH_SIZE, random_seed)
+        # Replay memory (with a history, every observation is stored once and the states are stacked when sampled)
+        self.frame_window = None
+        if FRAME_HISTORY > 1:
+            self.memory = FrameHistoryBuffer(action_size, BUFFER_SIZE, BATCH_SIZE, random_seed, state_size,
+                                             num_agents, FRAME_HISTORY)
+            self.frame_window = FrameWindow(num_agents, state_size, FRAME_HISTORY)
+        else:
+            self.memory = ReplayBuffer(action_size, BUFFER_SIZE, BATCH_SIZE, random_seed)
 
-        # debug of the MSE critic loss
-        self.mse_error_list = []
+        # learning statistics of the episode, accumulated on the device
+        self.step_count = 0
+        self.loss_stats = RunningStats()
     
-    def step(self, states, actions, rewards, next_states, dones):
+    def step(self, states, actions, rewards, next_states, dones, valid=None, rollout=0):
         """Save experience in replay memory, and use random sample from buffer to learn."""
+        if self.frame_window is not None:
+            # every car of every rollout has a stream of its own
+            self.memory.add_streams((rollout + 1) * self.num_agents)
         # Save experience / reward
         for agent in range(self.num_agents):
-            self.memory.add(states[agent, :], actions[agent, :], rewards[agent], next_states[agent, :], dones[agent])
+            if valid is not None and not valid[agent]:
+                continue
+            if self.frame_window is not None:
+                # the stream of the car - its next experience continues this one
+                self.memory.add(states[agent, :], actions[agent, :], rewards[agent], next_states[agent, :],
+                                dones[agent], stream=rollout * self.num_agents + agent)
+            else:
+                self.memory.add(states[agent, :], actions[agent, :], rewards[agent], next_states[agent, :],
+                                dones[agent])
+        if valid is not None:
+            # the cars that start over (continuous rollout) begin a new history with their next observation
+            self.restart(~np.asarray(valid, dtype=bool))
 
         # Learn, if enough samples are available in memory
-        if len(self.memory) > BATCH_SIZE:
-            experiences = self.memory.sample()
-            self.learn(experiences)
-            self.debug_loss = np.mean(self.mse_error_list)
+        self.step_count += 1
+        if (self.step_count % UPDATE_EVERY) == 0 and len(self.memory) > BATCH_SIZE:
+            for i in range(NUM_UPDATES):
+                experiences = self.memory.sample()
+                self.learn(experiences)
+
+    def add_experiences(self, states, actions, rewards, next_states, dones, aligned=True):
+        """ see abstract class """
+        # one experience per car, as in step()
+        self.memory.add_batch(states.reshape(-1, self.state_size), actions.reshape(-1, self.action_size),
+                              rewards.reshape(-1), next_states.reshape(-1, self.state_size), dones.reshape(-1))
+
+    def update(self):
+        """ see abstract class """
+        self.learn(self.memory.sample())
 
     def act(self, state, add_noise=True):
         """Returns actions for given state as per current policy."""
+        if self.frame_window is not None:
+            # the last FRAME_HISTORY observations of every car
+            state = self.frame_window.push(state)
         state = torch.from_numpy(state).float().to(device)
         acts = np.zeros((self.num_agents, self.action_size))
         self.actor_local.eval()
@@ -87,7 +132,12 @@ class Agent(AgentABC):
         """ see abstract class """
         super().reset()
         self.noise.reset()
-        self.mse_error_list = []
+        self.loss_stats.reset()
+
+    def restart(self, cars=None):
+        """ see abstract class """
+        if self.frame_window is not None:
+            self.frame_window.restart(cars)
 
     def learn(self, experiences):
         """Update policy and value parameters using given batch of experience tuples.
@@ -104,15 +154,17 @@ class Agent(AgentABC):
         states, actions, rewards, next_states, dones = experiences
 
         # ---------------------------- update critic ---------------------------- #
-        # Get predicted next-state actions and Q values from target models
-        actions_next = self.actor_target(next_states)
-        Q_targets_next = self.critic_target(next_states, actions_next)
-        # Compute Q targets for current states (y_i)
-        Q_targets = rewards.view(BATCH_SIZE, -1) + (GAMMA * Q_targets_next * (1 - dones).view(BATCH_SIZE, -1))
-        # Compute critic loss
-        Q_expected = self.critic_local(states, actions)
-        critic_loss = F.mse_loss(Q_expected, Q_targets)
-        self.mse_error_list.append(critic_loss.detach().cpu().numpy())
+        with learn_autocast(device, MIXED_PRECISION):
+            # Get predicted next-state actions and Q values from target models
+            actions_next = self.actor_target(next_states)
+            Q_targets_next = self.critic_target(next_states, actions_next).float()
+            # Compute Q targets for current states (y_i)
+            Q_targets = rewards.view(BATCH_SIZE, -1) + (GAMMA * Q_targets_next * (1 - dones).view(BATCH_SIZE, -1))
+            # Compute critic loss (in float32)
+            Q_expected = self.critic_local(states, actions).float()
+            critic_loss = F.mse_loss(Q_expected, Q_targets)
+        self.loss_stats.add('critic_loss', critic_loss)
+        self.loss_stats.add('q_value', Q_expected.mean())
         # Minimize the loss
         self.critic_optimizer.zero_grad()
         critic_loss.backward()
@@ -120,8 +172,10 @@ class Agent(AgentABC):
 
         # ---------------------------- update actor ---------------------------- #
         # Compute actor loss
-        actions_pred = self.actor_local(states)
-        actor_loss = -self.critic_local(states, actions_pred).mean()
+        with learn_autocast(device, MIXED_PRECISION):
+            actions_pred = self.actor_local(states)
+            actor_loss = -self.critic_local(states, actions_pred).float().mean()
+        self.loss_stats.add('actor_loss', actor_loss)
         # Minimize the loss
         self.actor_optimizer.zero_grad()
         actor_loss.backward()
@@ -145,17 +199,55 @@ class Agent(AgentABC):
         for target_param, local_param in zip(target_model.parameters(), local_model.parameters()):
             target_param.data.copy_(tau*local_param.data + (1.0-tau)*target_param.data)
 
+    def episode_stats(self):
+        """ see abstract class """
+        return self.loss_stats.means()
+
+    def actors(self):
+        """ see abstract class """
+        return [self.actor_local]
+
+    def networks(self):
+        """ see abstract class """
+        return {'actor': (self.actor_local, self.actor_target),
+                'critic': (self.critic_local, self.critic_target)}
+
+    def optimizers(self):
+        """ see abstract class """
+        return {'actor': self.actor_optimizer, 'critic': self.critic_optimizer}
+
+    def replay_buffers(self):
+        """ see abstract class """
+        return [self.memory]
+
+    def training_state(self):
+        """ see abstract class """
+        return {'step_count': self.step_count, 'noise': self.noise.state_dict()}
+
+    def load_training_state(self, state):
+        """ see abstract class """
+        self.step_count = state['step_count']
+        self.noise.load_state_dict(state['noise'])
+
     def load_weights(self, directory_path):
         """ see abstract class """
         super().load_weights(directory_path)
-        self.actor_target.load_state_dict(torch.load(os.path.join(directory_path, an_filename), map_location=device))
-        self.critic_target.load_state_dict(torch.load(os.path.join(directory_path, cn_filename), map_location=device))
-        self.actor_local.load_state_dict(torch.load(os.path.join(directory_path, an_filename), map_location=device))
-        self.critic_local.load_state_dict(torch.load(os.path.join(directory_path, cn_filename), map_location=device))
+        if has_bundle(directory_path):
+            # memory mapped: the tensors are copied straight from the page cache into the networks
+            load_bundle(self, directory_path, map_location=device, mmap=True)
+            return
+        # each file is read once, and copied into both the local and the target network
+        actor_state = torch.load(os.path.join(directory_path, an_filename), map_location=device)
+        critic_state = torch.load(os.path.join(directory_path, cn_filename), map_location=device)
+        self.actor_target.load_state_dict(actor_state)
+        self.critic_target.load_state_dict(critic_state)
+        self.actor_local.load_state_dict(actor_state)
+        self.critic_local.load_state_dict(critic_state)
 
     def save_weights(self, directory_path):
         """ see abstract class """
         super().save_weights(directory_path)
+        remove_bundle(directory_path)
         torch.save(self.actor_local.state_dict(), os.path.join(directory_path, an_filename))
         torch.save(self.critic_local.state_dict(), os.path.join(directory_path, cn_filename))
 
@@ -0,0 +1,201 @@
+"""
+several independent DDPG agents (one per random seed) trained together in one process.
+the S copies of every network are stacked into one set of parameters with a leading seed dimension and run with
+torch.func.vmap, so acting and learning are one batched computation for all the seeds instead of S small ones.
+one Adam over the stacked parameters is the same as S Adams (its update is element wise). every seed keeps its
+own replay buffer and noise process, and its weights are saved in the ddpg layout (loadable by --agent ddpg).
+the hyperparameters are the constants of ddpg_agent.
+"""
+
+import copy
+
+import numpy as np
+import torch
+import torch.optim as optim
+try:
+    from torch.func import functional_call, stack_module_state, vmap
+except ImportError:
+    # torch < 2.0: every other mode still runs, the ensemble mode refuses to start (see ensemble.py)
+    functional_call = stack_module_state = vmap = None
+
+from ddpg import ddpg_agent
+from ddpg.ddpg_model import Actor, Critic
+from utils.checkpoint import save_checkpoint
+from utils.loss_stats import RunningStats
+from utils.noise import OUNoise
+from utils.replay_buffer import ReplayBuffer
+
+device = ddpg_agent.device
+
+
+class _StackedNetwork:
+    """ S copies of a network: stacked parameters (leaves with a leading seed dimension) and a vmapped forward """
+    def __init__(self, modules):
+        self.params, self.buffers = stack_module_state(modules)
+        base = copy.deepcopy(modules[0]).to('meta')
+
+        def call(params, buffers, *inputs):
+            return functional_call(base, (params, buffers), inputs)
+        self.forward = vmap(call)
+
+    def __call__(self, *inputs):
+        """ :param inputs: tensors (S, batch, ...) :return: (S, batch, ...) """
+        return self.forward(self.params, self.buffers, *inputs)
+
+    def parameters(self):
+        return list(self.params.values())
+
+    def state_dict(self, s):
+        """ :return: state dict of the network of seed index s """
+        return {name: tensor[s].detach().clone() for name, tensor in {**self.params, **self.buffers}.items()}
+
+    def load_state_dict(self, s, state_dict):
+        with torch.no_grad():
+            for name, tensor in {**self.params, **self.buffers}.items():
+                tensor[s].copy_(state_dict[name])
+
+
+class EnsembleAgent:
+    def __init__(self, state_size, action_size, num_agents, seeds):
+        """
+        :param state_size: dimension of each state
+        :param action_size: dimension of each action
+        :param num_agents: number of cars in every environment
+        :param seeds: random seed of every member (a member is initialized as Agent(random_seed=seed) would be)
+        """
+        self.state_size = state_size
+        self.action_size = action_size
+        self.num_agents = num_agents
+        self.seeds = list(seeds)
+        # every network seeds torch itself, so a member starts as Agent(random_seed=seed) does (targets = locals)
+        actors = [Actor(state_size, action_size, seed).to(device) for seed in self.seeds]
+        critics = [Critic(state_size, action_size, seed).to(device) for seed in self.seeds]
+        self.actor_local = _StackedNetwork(actors)
+        self.actor_target = _StackedNetwork(actors)
+        self.critic_local = _StackedNetwork(critics)
+        self.critic_target = _StackedNetwork(critics)
+        for network in [self.actor_target, self.critic_target]:
+            for param in network.parameters():
+                param.requires_grad_(False)
+        self.actor_optimizer = optim.Adam(self.actor_local.parameters(), lr=ddpg_agent.LR_ACTOR)
+        self.critic_optimizer = optim.Adam(self.critic_local.parameters(), lr=ddpg_agent.LR_CRITIC,
+                                           weight_decay=ddpg_agent.WEIGHT_DECAY)
+        self.noises = [OUNoise((num_agents, action_size), seed) for seed in self.seeds]
+        self.memories = [ReplayBuffer(action_size, ddpg_agent.BUFFER_SIZE, ddpg_agent.BATCH_SIZE, seed)
+                         for seed in self.seeds]
+        self.step_count = 0
+        self.loss_stats = [RunningStats() for _ in self.seeds]     # learning statistics of every member
+        self.shadow_agent = None    # a ddpg agent holding one member, for saving / loading it
+
+    def act(self, states, add_noise=True):
+        """
+        :param states: (S, num_agents, state_size)
+        :return: actions (S, num_agents, action_size)
+        """
+        with torch.no_grad():
+            actions = self.actor_local(torch.from_numpy(np.asarray(states)).float().to(device)).cpu().numpy()
+        if add_noise:
+            actions = actions + np.stack([noise.sample() for noise in self.noises])
+        return np.clip(actions, -1, 1)
+
+    def step(self, states, actions, rewards, next_states, dones):
+        """
+        store the step of every member and learn.
+        :param states: (S, num_agents, state_size), and the other arrays with the same two leading dimensions
+        """
+        for s, memory in enumerate(self.memories):
+            for agent in range(self.num_agents):
+                memory.add(states[s][agent], actions[s][agent], rewards[s][agent], next_states[s][agent],
+                           dones[s][agent])
+        self.step_count += 1
+        if (self.step_count % ddpg_agent.UPDATE_EVERY) == 0 \
+                and min(len(memory) for memory in self.memories) > ddpg_agent.BATCH_SIZE:
+            for _ in range(ddpg_agent.NUM_UPDATES):
+                self.learn()
+
+    def learn(self):
+        """ one ddpg update of every member, on a batch sampled from its own replay buffer """
+        samples = [memory.sample() for memory in self.memories]
+        states, actions, rewards, next_states, dones = [torch.stack(tensors) for tensors in zip(*samples)]
+        rewards = rewards.view(len(self.seeds), -1, 1)
+        dones = dones.view(len(self.seeds), -1, 1)
+
+        # ---------------------------- update critic ---------------------------- #
+        with torch.no_grad():
+            actions_next = self.actor_target(next_states)
+            q_targets = rewards + ddpg_agent.GAMMA * self.critic_target(next_states, actions_next) * (1 - dones)
+        q_expected = self.critic_local(states, actions)
+        # the loss of every member is its own mean, the sum keeps the gradients of the members apart
+        critic_losses = ((q_expected - q_targets) ** 2).mean(dim=(1, 2))
+        q_values = q_expected.mean(dim=(1, 2))
+        for s, stats in enumerate(self.loss_stats):
+            stats.add('critic_loss', critic_losses[s])
+            stats.add('q_value', q_values[s])
+        self.critic_optimizer.zero_grad()
+        critic_losses.sum().backward()
+        self.critic_optimizer.step()
+
+        # ---------------------------- update actor ---------------------------- #
+        actor_losses = -self.critic_local(states, self.actor_local(states)).mean(dim=(1, 2))
+        for s, stats in enumerate(self.loss_stats):
+            stats.add('actor_loss', actor_losses[s])
+        self.actor_optimizer.zero_grad()
+        actor_losses.sum().backward()
+        self.actor_optimizer.step()
+
+        # ----------------------- update target networks ----------------------- #
+        with torch.no_grad():
+            for local, target in [(self.critic_local, self.critic_target), (self.actor_local, self.actor_target)]:
+                for target_param, local_param in zip(target.parameters(), local.parameters()):
+                    target_param.lerp_(local_param, ddpg_agent.TAU)
+
+    def reset(self, s=None):
+        """ reset the noise and the learning statistics of member s (all the members if None), at the start of its
+        episode """
+        for member in range(len(self.seeds)) if s is None else [s]:
+            self.noises[member].reset()
+            self.loss_stats[member].reset()
+
+    def episode_stats(self, s):
+        """ :return: learning statistics of member s in its current episode """
+        return self.loss_stats[s].means()
+
+    def _shadow(self, s):
+        """ :return: a ddpg agent with the networks of member s """
+        if self.shadow_agent is None:
+            self.shadow_agent = ddpg_agent.Agent(state_size=self.state_size, action_size=self.action_size,
+                                                 num_agents=self.num_agents, random_seed=0)
+        for name, (local, target) in {'actor': (self.actor_local, self.actor_target),
+                                      'critic': (self.critic_local, self.critic_target)}.items():
+            shadow_local, shadow_target = self.shadow_agent.networks()[name]
+            shadow_local.load_state_dict(local.state_dict(s))
+            shadow_target.load_state_dict(target.state_dict(s))
+        return self.shadow_agent
+
+    def save_weights(self, s, directory_path, weights_format='files', episode=None):
+        """ save the networks of member s (ddpg layout, see save_checkpoint) """
+        save_checkpoint(self._shadow(s), directory_path, weights_format, episode=episode)
+
+    def load_weights(self, s, directory_path):
+        """ load ddpg weights (files or bundle) into member s """
+        shadow = self._shadow(s)
+        shadow.load_weights(directory_path)
+        for name, (local, target) in {'actor': (self.actor_local, self.actor_target),
+                                      'critic': (self.critic_local, self.critic_target)}.items():
+            shadow_local, shadow_target = shadow.networks()[name]
+            local.load_state_dict(s, shadow_local.state_dict())
+            target.load_state_dict(s, shadow_target.state_dict())
+
+    def save_mem(self, s, directory_path):
+        """ save the replay buffer of member s (ddpg layout) """
+        shadow = self._shadow(s)
+        shadow.memory, memory = self.memories[s], shadow.memory
+        shadow.save_mem(directory_path)
+        shadow.memory = memory
+
+    def load_mem(self, s, directory_path):
+        """ load a ddpg replay buffer into member s """
+        shadow = self._shadow(s)
+        shadow.memory, memory = self.memories[s], shadow.memory
+        shadow.load_mem(directory_path)
+        shadow.memory = memory
@@ -1,8 +1,9 @@
 import os
 
 from agent import AgentABC
-from ddpg.ddpg_agent import Agent as DDPGAgent
-import numpy as np
+from ddpg.ddpg_agent import Agent as DDPGAgent, device
+from utils.checkpoint import has_bundle, load_bundle, remove_bundle
+from utils.loss_stats import RunningStats
 
 
 class Agent(AgentABC):
@@ -22,7 +23,7 @@ class Agent(AgentABC):
         self.num_agents = num_agents
         self.agents = [DDPGAgent(state_size, action_size, 1, random_seed) for i in range(num_agents)]
 
-    def step(self, states, actions, rewards, next_states, dones):
+    def step(self, states, actions, rewards, next_states, dones, valid=None, rollout=0):
         """ see abstract class """
         for i in range(self.num_agents):
             states_single = states[i].reshape(1, self.state_size)
@@ -30,8 +31,19 @@ class Agent(AgentABC):
             next_states_single = next_states[i].reshape(1, self.state_size)
             dones_single = [dones[i]]
             rewards_single = [rewards[i]]
-            self.agents[i].step(states_single, actions_single, rewards_single, next_states_single, dones_single)
-        self.debug_loss = np.mean([agent.debug_loss for agent in self.agents])
+            valid_single = None if valid is None else [valid[i]]
+            self.agents[i].step(states_single, actions_single, rewards_single, next_states_single, dones_single,
+                                valid_single, rollout)
+
+    def add_experiences(self, states, actions, rewards, next_states, dones, aligned=True):
+        """ see abstract class """
+        for i in range(self.num_agents):
+            self.agents[i].add_experiences(states[:, i], actions[:, i], rewards[:, i], next_states[:, i], dones[:, i])
+
+    def update(self):
+        """ see abstract class """
+        for agent in self.agents:
+            agent.update()
 
     def act(self, state, add_noise=True):
         """ see abstract class """
@@ -42,9 +54,49 @@ class Agent(AgentABC):
         for agent in self.agents:
             agent.reset()
 
+    def restart(self, cars=None):
+        """ see abstract class """
+        for i in range(self.num_agents):
+            self.agents[i].restart(None if cars is None else [cars[i]])
+
+    def episode_stats(self):
+        """ see abstract class """
+        return RunningStats.combine([agent.loss_stats for agent in self.agents]).means()
+
+    def actors(self):
+        """ see abstract class """
+        return [agent.actor_local for agent in self.agents]
+
+    def networks(self):
+        """ see abstract class """
+        return {str(i) + '/' + name: pair for i, agent in enumerate(self.agents)
+                for name, pair in agent.networks().items()}
+
+    def optimizers(self):
+        """ see abstract class """
+        return {str(i) + '/' + name: optimizer for i, agent in enumerate(self.agents)
+                for name, optimizer in agent.optimizers().items()}
+
+    def replay_buffers(self):
+        """ see abstract class """
+        return [agent.memory for agent in self.agents]
+
+    def training_state(self):
+        """ see abstract class """
+        return {'agents': [agent.training_state() for agent in self.agents]}
+
+    def load_training_state(self, state):
+        """ see abstract class """
+        for agent, agent_state in zip(self.agents, state['agents']):
+            agent.load_training_state(agent_state)
+
     def load_weights(self, directory_path):
         """ see abstract class """
         super().load_weights(directory_path)
+        if has_bundle(directory_path):
+            # memory mapped: the tensors are copied straight from the page cache into the networks
+            load_bundle(self, directory_path, map_location=device, mmap=True)
+            return
         for agent in range(self.num_agents):
             self.agents[agent].load_weights(os.path.join(directory_path, str(agent)))
 
@@ -52,6 +104,7 @@ class Agent(AgentABC):
         """ see abstract class """
         # main directory
         super().save_weights(directory_path)
+        remove_bundle(directory_path)
         for agent in range(self.num_agents):
             # sub directory for each agent
             self.agents[agent].save_weights(os.path.join(directory_path, str(agent)))
@@ -0,0 +1,151 @@
+###################################
+# Policy distillation: one small student actor learns to imitate the actors of a trained agent (the N actors of an
+# mddpg / maddpg agent, one per car), so a result is deployed as a single network (test --agent student).
+# the student learns by regression on the actions of the teachers for recorded observations (no environment, no
+# rewards). every teacher acts on every observation, the student sees the index of the teacher's car (unless
+# --no-agent-index: then it is one policy for all the cars, the mean of the teachers).
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+import torch.optim as optim
+
+from agent import AgentABC
+from export import recorded_observations
+from student.student_agent import Agent as StudentAgent, device
+from utils.hyperparameters import read_hyperparameters, apply_hyperparameters, get_hyperparameters
+
+HOLDOUT_FRACTION = 0.1  # observations kept out of the training, the action error is measured on them
+ACT_REPEATS = 1000      # act() calls timed for the inference speedup
+
+
+def _action_errors(student, observations, targets, conditioned):
+    """
+    :param observations: (n, state_size) tensor
+    :param targets: (num_teachers, n, action_size) tensor, the actions of every teacher
+    :return: (mean, max) absolute action error of the student against every teacher, arrays (num_teachers,)
+    """
+    student.eval()
+    errors = []
+    with torch.no_grad():
+        for teacher in range(len(targets)):
+            index = torch.full((len(observations),), teacher, dtype=torch.long, device=device) if conditioned \
+                else None
+            errors.append((student(observations, index) - targets[teacher]).abs())
+    student.train()
+    return np.array([e.mean().item() for e in errors]), np.array([e.max().item() for e in errors])
+
+
+def _act_seconds(agent, states):
+    """ :return: mean seconds of one act() on the states of one env step """
+    agent.act(states, add_noise=False)  # warm up
+    start = time.perf_counter()
+    for _ in range(ACT_REPEATS):
+        agent.act(states, add_noise=False)
+    return (time.perf_counter() - start) / ACT_REPEATS
+
+
+def _num_parameters(actors):
+    return sum(p.numel() for actor in actors for p in actor.parameters())
+
+
+def distill_wrapper(env_config, wrapper_config):
+    """
+    distill the actors of a weights dir into one student actor.
+    :param env_config: dictionary, the environment parameters (num_agents)
+    :param wrapper_config: dictionary of user defined variables.
+    """
+    weights_path = wrapper_config['weights_path']
+    if not os.path.isdir(weights_path):
+        print('--weights-path is not a valid directory')
+        raise NotADirectoryError
+    agent_type = wrapper_config['agent']
+    if not issubclass(agent_type, AgentABC) or agent_type is StudentAgent:
+        print('invalid teacher agent type')
+        raise TypeError
+    # hparams: agent constants the teacher was trained with that change its networks
+    apply_hyperparameters(agent_type, read_hyperparameters(wrapper_config.get('hparams')))
+    if get_hyperparameters(agent_type, ['FRAME_HISTORY']).get('FRAME_HISTORY', 1) > 1:
+        print('the student does not keep an observation history (FRAME_HISTORY)')
+        raise ValueError
+    state_size = wrapper_config['state_size']
+    action_size = wrapper_config['action_size']
+    num_agents = env_config['num_agents']
+    output_path = wrapper_config['output_path'] or os.path.join(weights_path, 'student')
+    seed = wrapper_config['seed']
+    torch.manual_seed(seed)
+    rng = np.random.RandomState(seed)
+
+    teacher: AgentABC = agent_type(state_size=state_size, action_size=action_size, num_agents=num_agents,
+                                   random_seed=0)
+    teacher.load_weights(weights_path)
+    teachers = teacher.actors()
+    num_teachers = len(teachers)
+    # with a single teacher (ddpg) there is nothing to tell apart
+    conditioned = num_teachers > 1 and not wrapper_config['no_agent_index']
+    observations = recorded_observations(wrapper_config['observations_path'], teacher, env_config, state_size,
+                                         wrapper_config['num_observations'])
+    observations = torch.from_numpy(observations[rng.permutation(len(observations))]).to(device)
+    with torch.no_grad():
+        targets = torch.stack([actor.eval()(observations) for actor in teachers])
+    num_holdout = max(1, int(len(observations) * HOLDOUT_FRACTION))
+    num_train = len(observations) - num_holdout
+    if num_train < 1:
+        print('not enough observations to distill ({})'.format(len(observations)))
+        raise ValueError
+    print('\ndistilling {} actor(s) of {} on {} observations ({} held out), the student is {}'.format(
+        num_teachers, weights_path, len(observations), num_holdout,
+        'conditioned on the agent index' if conditioned else 'one policy for all the cars'))
+
+    student_agent = StudentAgent(state_size, action_size, num_agents, seed)
+    student_agent.build(wrapper_config['fc1_units'], wrapper_config['fc2_units'], num_teachers if conditioned else 0)
+    student = student_agent.actor
+    optimizer = optim.Adam(student.parameters(), lr=wrapper_config['lr'])
+    batch_size = wrapper_config['batch_size']
+    report_every = wrapper_config['report_every']
+    holdout = observations[num_train:], targets[:, num_train:]
+    losses = []
+    start = time.time()
+    for i_update in range(1, wrapper_config['num_updates'] + 1):
+        # random (observation, teacher) pairs
+        rows = torch.from_numpy(rng.randint(num_train, size=batch_size)).to(device)
+        teacher_index = torch.from_numpy(rng.randint(num_teachers, size=batch_size)).to(device)
+        loss = F.mse_loss(student(observations[rows], teacher_index if conditioned else None),
+                          targets[teacher_index, rows])
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        losses.append(loss.detach())
+        if i_update % report_every == 0:
+            mean_errors, _ = _action_errors(student, *holdout, conditioned)
+            print('\rUpdate {}\tUpdates/sec {:.1f}\tLoss {:.4g}\tHoldout Action Error {:.4g}'.format(
+                i_update, i_update / (time.time() - start), torch.stack(losses).mean().item(), mean_errors.mean()),
+                end="")
+            losses = []
+
+    mean_errors, max_errors = _action_errors(student, *holdout, conditioned)
+    print('\n\nteacher\tmean abs action error\tmax abs action error')
+    for i in range(num_teachers):
+        print('{}\t{:.4g}\t{:.4g}'.format(i, mean_errors[i], max_errors[i]))
+    print('all\t{:.4g}\t{:.4g}'.format(mean_errors.mean(), max_errors.max()))
+
+    # inference: the teacher agent against the student agent, on the observations of one env step
+    states = observations[num_train:num_train + num_agents].cpu().numpy()
+    if len(states) == num_agents:
+        teacher_seconds = _act_seconds(teacher, states)
+        student_seconds = _act_seconds(student_agent, states)
+        print('\nact() for {} cars\tteacher {:.1f} us ({} parameters)\tstudent {:.1f} us ({} parameters)'
+              '\tspeedup {:.2f}'.format(num_agents, teacher_seconds * 1e6, _num_parameters(teachers),
+                                        student_seconds * 1e6, _num_parameters([student]),
+                                        teacher_seconds / student_seconds))
+
+    if not os.path.isdir(output_path):
+        os.makedirs(output_path)
+    student_agent.save_weights(output_path)
+    # noinspection PyTypeChecker
+    np.savetxt(os.path.join(output_path, 'Distillation.csv'),
+               np.column_stack([np.arange(num_teachers), mean_errors, max_errors]), delimiter=',',
+               fmt=['%d', '%.6g', '%.6g'], header='teacher,mean_abs_action_error,max_abs_action_error', comments='')
+    print('\nsaved the student to {} (test --agent student --weights-path {})'.format(output_path, output_path))
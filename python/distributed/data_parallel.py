@@ -0,0 +1,123 @@
+"""
+data parallel learning over several cpu processes (torch.distributed, gloo backend).
+every process holds a full copy of the agent and a shard of the replay buffer. each learning update samples
+BATCH_SIZE / world_size experiences per process, and the gradients are averaged over the processes (one
+all-reduce per optimizer step) before the optimizer steps. the processes start from the same weights and apply
+the same averaged gradients, so the networks (and the soft updated targets) stay identical without any more
+communication - one update of N processes is one update with the full batch.
+"""
+
+import datetime
+import itertools
+import os
+import random
+import socket
+
+import torch
+import torch.distributed as dist
+
+from agent import AgentABC
+
+INIT_TIMEOUT = 300  # seconds the processes wait for each other (joining the group, and every all-reduce)
+
+
+def free_init_method():
+    """ :return: tcp init method on a free local port, for processes on this host """
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return 'tcp://127.0.0.1:{}'.format(s.getsockname()[1])
+
+
+def process_cores(rank, world_size):
+    """ :return: the cores of this process - the available cores split evenly between the processes """
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    per_process = max(1, len(cores) // world_size)
+    return cores[(rank * per_process) % len(cores):][:per_process]
+
+
+def pin_process(rank, world_size):
+    """
+    keep this process on its cores (process_cores) and run torch on as many threads.
+    :return: the previous (cores, number of torch threads), for restoring them
+    """
+    previous = (os.sched_getaffinity(0) if hasattr(os, 'sched_getaffinity') else None, torch.get_num_threads())
+    cores = process_cores(rank, world_size)
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    return previous
+
+
+def unpin_process(previous):
+    """ restore the cores and torch threads returned by pin_process """
+    cores, num_threads = previous
+    if cores is not None:
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(num_threads)
+
+
+def init_data_parallel(rank, world_size, init_method):
+    """ join the process group (a process that does not join fails the others after INIT_TIMEOUT), and keep this
+    process on its own cores """
+    pin_process(rank, world_size)
+    dist.init_process_group('gloo', init_method=init_method, rank=rank, world_size=world_size,
+                            timeout=datetime.timedelta(seconds=INIT_TIMEOUT))
+
+
+def _synchronize_gradients(optimizer, world_size):
+    """ make optimizer.step average the gradients of its parameters over the processes first """
+    step = optimizer.step
+
+    def synchronized_step(*args, **kwargs):
+        grads = [p.grad for group in optimizer.param_groups for p in group['params'] if p.grad is not None]
+        if grads:
+            # one all-reduce for all the parameters of the optimizer
+            flat = torch.cat([g.reshape(-1) for g in grads])
+            dist.all_reduce(flat)
+            flat /= world_size
+            offset = 0
+            for g in grads:
+                g.copy_(flat[offset:offset + g.numel()].view_as(g))
+                offset += g.numel()
+        return step(*args, **kwargs)
+    optimizer.step = synchronized_step
+
+
+def make_data_parallel(agent: AgentABC, rank, world_size):
+    """
+    prepare an agent (with its replay buffer loaded) for data parallel updates:
+    copy the weights of process 0 to every process, average the gradients of every optimizer step and keep only
+    this process' shard of the replay buffers.
+    """
+    with torch.no_grad():
+        for local, target in agent.networks().values():
+            for tensor in itertools.chain(local.state_dict().values(), target.state_dict().values()):
+                dist.broadcast(tensor, src=0)
+    for optimizer in agent.optimizers().values():
+        _synchronize_gradients(optimizer, world_size)
+    for buffer in agent.replay_buffers():
+        buffer.shard(rank, world_size)
+    # a different sampling sequence in every process (random.sample draws the batches)
+    random.seed(random.randrange(2 ** 32) + rank)
+
+
+def average_stats(stats):
+    """ :return: the episode_stats of the agent averaged over the processes """
+    if not stats:
+        return stats
+    names = sorted(stats)
+    values = torch.tensor([stats[name] for name in names], dtype=torch.float64)
+    dist.all_reduce(values)
+    return {name: value / dist.get_world_size() for name, value in zip(names, values.tolist())}
+
+
+def parameters_checksum(agent: AgentABC):
+    """ :return: (min, max) over the processes of the sum of all the weights - equal when the copies agree """
+    with torch.no_grad():
+        total = sum(float(p.double().sum()) for local, target in agent.networks().values()
+                    for p in itertools.chain(local.parameters(), target.parameters()))
+    low = torch.tensor([total], dtype=torch.float64)
+    high = low.clone()
+    dist.all_reduce(low, op=dist.ReduceOp.MIN)
+    dist.all_reduce(high, op=dist.ReduceOp.MAX)
+    return low.item(), high.item()
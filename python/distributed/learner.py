@@ -0,0 +1,254 @@
+"""
+central learner of the distributed training mode.
+rollout workers (distributed/worker.py) connect over TCP, stream their env steps in binary batches and report
+finished episodes. the learner owns the agent (and so the replay buffer), feeds every received step into
+agent.step (which stores it and learns) and pushes the actor weights back to the workers.
+"""
+
+import os
+import queue
+import socket
+import threading
+
+import numpy as np
+
+from agent import AgentABC
+from distributed import protocol
+from distributed.shared_weights import WeightPublisher, shared_weights_path, remove_shared_weights
+from utils.hyperparameters import read_hyperparameters, apply_hyperparameters
+from utils.checkpoint import save_checkpoint
+from utils.memory_budget import MemoryAccount, fit_memory_budget, parse_size
+from utils.loss_stats import format_stats
+from utils.demonstrations import load_demonstrations
+
+DISCONNECTED = 0    # internal message type: a worker connection was closed
+INBOX_SIZE = 4      # messages waiting for the learner. when full, the workers block on send (backpressure)
+
+
+class _Connection:
+    def __init__(self, conn_id, sock):
+        self.conn_id = conn_id
+        self.sock = sock
+        self.worker_id = None
+        self.rollout = None             # index of the worker among the connected ones, its cars' replay streams
+        self.alive = True
+        self.shared_weights = False     # reads the weights from the shared region, nothing to push
+
+
+def _read_connection(connection: _Connection, inbox: queue.Queue):
+    """ reader thread - moves the frames of one worker into the learner's inbox """
+    try:
+        while True:
+            msg_type, payload = protocol.recv_frame(connection.sock)
+            inbox.put((connection, msg_type, payload))
+    except (ConnectionError, OSError):
+        inbox.put((connection, DISCONNECTED, None))
+
+
+def _accept_connections(server: socket.socket, inbox: queue.Queue, connections):
+    """ acceptor thread - starts a reader thread for every worker that connects """
+    conn_id = 0
+    while True:
+        try:
+            sock, _ = server.accept()
+        except OSError:
+            return  # server socket was closed
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = _Connection(conn_id, sock)
+        conn_id += 1
+        connections.append(connection)
+        threading.Thread(target=_read_connection, args=(connection, inbox), daemon=True).start()
+
+
+def learner_wrapper(env_config, wrapper_config):
+    """
+    run the central learner.
+    :param env_config: dictionary, the environment parameters (only num_agents is checked against the workers)
+    :param wrapper_config: dictionary of user defined variables.
+    """
+    # num_episodes (int): number of episodes to train (summed over all the workers)
+    num_episodes = wrapper_config['num_episodes']
+    # scores_average_window (int): the window size employed for calculating the average score
+    scores_average_window = wrapper_config['scores_avg_window']
+    # solved_score (float): the average score required for the environment to be considered solved
+    solved_score = wrapper_config['solved_score']
+    # weights_path: path to the directory containing the weights (same directory to save them)
+    weights_path = wrapper_config['weights_path']
+    load_weights = wrapper_config['load_weights']
+    if load_weights and not(os.path.isdir(weights_path)):
+        print('weights dir does not exist')
+        raise NotADirectoryError
+    save_mem = wrapper_config['save_mem']
+    load_mem = wrapper_config['load_mem']
+    mem_path = wrapper_config['mem_path']
+    if load_mem and not(os.path.isdir(mem_path)):
+        print('mem dir does not exist')
+        raise NotADirectoryError
+    agent_type = wrapper_config['agent']
+    if not issubclass(agent_type, AgentABC):
+        print('invalid agent type')
+        raise TypeError
+    apply_hyperparameters(agent_type, read_hyperparameters(wrapper_config.get('hparams')))
+    print_agent_loss = wrapper_config['print_agent_loss']
+    save_log = wrapper_config['save_score_log']
+    save_best_weights = wrapper_config['save_best_weights']
+    weights_format = wrapper_config['weights_format']
+    # sync_every (int): push the actor weights to the workers every # learned env steps
+    sync_every = wrapper_config['sync_every']
+    # shared_weights (bool): also publish the actor weights in shared memory, for the workers on this host
+    shared_weights = wrapper_config.get('shared_weights', False)
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((wrapper_config['host'], wrapper_config['port']))
+    server.listen()
+    print('learner listening on {}:{}'.format(*server.getsockname()))
+    # a region of an earlier learner on this port is stale - the workers must not read it
+    remove_shared_weights(shared_weights_path(wrapper_config['port']))
+
+    inbox = queue.Queue(maxsize=INBOX_SIZE)
+    connections = []
+    threading.Thread(target=_accept_connections, args=(server, inbox, connections), daemon=True).start()
+
+    agent = None
+    memory_account = None
+    sizes = None
+    weights_version = 0
+    weights_payload = None
+    publisher = None
+    steps_since_sync = 0
+    total_steps = 0
+    episode_scores = []
+    best_score = -np.inf
+
+    def push_weights(targets):
+        for connection in targets:
+            if connection.alive and connection.worker_id is not None and not connection.shared_weights:
+                try:
+                    protocol.send_frame(connection.sock, protocol.WEIGHTS, weights_payload)
+                except OSError:
+                    connection.alive = False
+
+    def new_weights_payload():
+        flat = protocol.pack_actor_weights(agent.actors())
+        return protocol.WEIGHTS_HEADER.pack(weights_version) + flat.tobytes()
+
+    while len(episode_scores) < num_episodes:
+        connection, msg_type, payload = inbox.get()
+        if msg_type == protocol.HELLO:
+            worker_id, num_agents, state_size, action_size, num_weights = protocol.HELLO_FORMAT.unpack(payload)
+            if num_agents != env_config['num_agents']:
+                print('\nworker {} runs {} agents instead of {}, ignoring it'.format(
+                    worker_id, num_agents, env_config['num_agents']))
+                connection.sock.close()
+                continue
+            if agent is None:
+                sizes = (num_agents, state_size, action_size)
+                agent = agent_type(state_size=state_size, action_size=action_size,
+                                   num_agents=num_agents, random_seed=0)
+                if load_weights:
+                    agent.load_weights(weights_path)
+                if wrapper_config['memory_budget'] is not None:
+                    memory_account = fit_memory_budget(agent, parse_size(wrapper_config['memory_budget']))
+                else:
+                    memory_account = MemoryAccount(agent)
+                if load_mem:
+                    agent.load_mem(mem_path)
+                if wrapper_config['demo_path'] is not None:
+                    num_transitions = load_demonstrations(agent, wrapper_config['demo_path'], state_size,
+                                                          action_size, num_agents)
+                    print('\nadded {} demonstration transitions to the replay buffer'.format(num_transitions))
+                weights_payload = new_weights_payload()
+                if shared_weights:
+                    publisher = WeightPublisher(shared_weights_path(wrapper_config['port']), agent.actors())
+                    publisher.publish(weights_version)
+            elif sizes != (num_agents, state_size, action_size):
+                print('\nworker {} does not match the sizes of the other workers, ignoring it'.format(worker_id))
+                connection.sock.close()
+                continue
+            if num_weights != len(protocol.pack_actor_weights(agent.actors())):
+                # e.g. another FRAME_HISTORY - the weights of the learner can not drive the actors of the worker
+                print('\nthe actors of worker {} have {} weights, the actors of the learner {} - start the learner'
+                      ' and the workers with the same --hparams'.format(
+                        worker_id, num_weights, len(protocol.pack_actor_weights(agent.actors()))))
+                raise ValueError
+            connection.worker_id = worker_id
+            # the lowest rollout index not in use - the transitions of a worker continue only its own
+            in_use = {c.rollout for c in connections if c.alive and c.rollout is not None}
+            connection.rollout = min(set(range(len(in_use) + 1)) - in_use)
+            print('\nworker {} connected'.format(worker_id))
+            if weights_payload is None:
+                weights_payload = new_weights_payload()
+            push_weights([connection])
+        elif msg_type == protocol.TRANSITIONS:
+            states, actions, rewards, next_states, dones = protocol.unpack_transitions(payload)
+            for t in range(states.shape[0]):
+                agent.step(states[t], actions[t], rewards[t], next_states[t], dones[t], rollout=connection.rollout)
+            steps_since_sync += states.shape[0]
+            total_steps += states.shape[0]
+            if steps_since_sync >= sync_every:
+                steps_since_sync = 0
+                weights_version += 1
+                if publisher is not None:
+                    publisher.publish(weights_version)
+                # the tcp payload is only built when a worker needs it (None - out of date)
+                weights_payload = None
+                if any(c.alive and c.worker_id is not None and not c.shared_weights for c in connections):
+                    weights_payload = new_weights_payload()
+                    push_weights(connections)
+        elif msg_type == protocol.EPISODE:
+            worker_id, score, steps = protocol.EPISODE_FORMAT.unpack(payload)
+            episode_scores.append(score)
+            i_episode = len(episode_scores)
+            average_score = np.mean(episode_scores[-scores_average_window:])
+            print('\nEpisode {}\tWorker {}\tEpisode Score: {:.3f}\tAverage Score: {:.3f}\tNumber Of Steps{}'
+                  '\tLearned Steps {}'.format(i_episode, worker_id, score, average_score, steps, total_steps), end="")
+            if print_agent_loss:
+                print('\t' + format_stats(agent.episode_stats()))
+            # the loss statistics of the next episode start over (the learner has no episodes of its own)
+            agent.reset()
+            if wrapper_config['print_memory_usage']:
+                print('\t memory: {}'.format(memory_account.report()))
+            if save_log:
+                if not (os.path.isdir(weights_path)):
+                    os.mkdir(weights_path)
+                # noinspection PyTypeChecker
+                np.savetxt(os.path.join(weights_path, "Agent_Scores.csv"), episode_scores, delimiter=",")
+            save_checkpoint(agent, weights_path, weights_format, episode=i_episode)
+            if save_best_weights and best_score < average_score:
+                best_score = average_score
+                save_checkpoint(agent, weights_path + '_best', weights_format, episode=i_episode)
+            if save_mem and (i_episode % 50) == 0:
+                agent.save_mem(mem_path)
+            if i_episode > scores_average_window*2 and average_score >= solved_score:
+                print('\nEnvironment solved in {:d} episodes!\tAverage Score: {:.3f}'.format(i_episode, average_score))
+                break
+        elif msg_type == protocol.SHARED_WEIGHTS:
+            # the worker mapped the shared region: acknowledge, the weights are not pushed to it any more. the
+            # ack follows the weights already pushed, so the worker switches after its last tcp weights
+            if publisher is not None and not connection.shared_weights:
+                try:
+                    protocol.send_frame(connection.sock, protocol.SHARED_WEIGHTS)
+                except OSError:
+                    connection.alive = False
+                    continue
+                connection.shared_weights = True
+                print('\nworker {} reads the weights from shared memory'.format(connection.worker_id))
+        elif msg_type == DISCONNECTED:
+            connection.alive = False
+            if connection.worker_id is not None:
+                print('\nworker {} disconnected'.format(connection.worker_id))
+
+    # tell the workers to stop and close everything
+    for connection in connections:
+        if connection.alive:
+            try:
+                protocol.send_frame(connection.sock, protocol.SHUTDOWN)
+            except OSError:
+                pass
+            connection.sock.close()
+    server.close()
+    if publisher is not None:
+        publisher.close()
+    if agent is not None and save_mem:
+        agent.save_mem(mem_path)
@@ -0,0 +1,111 @@
+"""
+wire format between rollout workers and the central learner.
+every message is a frame: 1 byte message type + 4 bytes payload length (network order), then the payload.
+transitions and weights are sent as raw float32 arrays (no pickling), so a batch of steps costs
+about 4 bytes per number on the wire.
+"""
+
+import socket
+import struct
+
+import numpy as np
+import torch
+
+# message types
+HELLO = 1           # worker -> learner: worker id, num agents, state size, action size, number of actor weights
+TRANSITIONS = 2     # worker -> learner: batch of env steps
+EPISODE = 3         # worker -> learner: end of an episode (score, number of steps)
+WEIGHTS = 4         # learner -> worker: actor weights with a version number
+SHUTDOWN = 5        # learner -> worker: stop rolling out
+SHARED_WEIGHTS = 6  # worker -> learner: the worker mapped the learner's shared region (same host)
+                    # learner -> worker: acknowledged, the weights are only published there from now on
+
+FRAME_HEADER = struct.Struct('!BI')
+HELLO_FORMAT = struct.Struct('!IIIII')
+TRANSITIONS_HEADER = struct.Struct('!IIII')
+EPISODE_FORMAT = struct.Struct('!Ifi')
+WEIGHTS_HEADER = struct.Struct('!Q')
+
+
+def send_frame(sock: socket.socket, msg_type, payload=b''):
+    sock.sendall(FRAME_HEADER.pack(msg_type, len(payload)) + payload)
+
+
+def _recv_exactly(sock: socket.socket, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            raise ConnectionError('connection closed by peer')
+        received += n
+    return buf
+
+
+def recv_frame(sock: socket.socket):
+    """ :return: (message type, payload bytes) """
+    msg_type, length = FRAME_HEADER.unpack(_recv_exactly(sock, FRAME_HEADER.size))
+    return msg_type, _recv_exactly(sock, length) if length else bytearray()
+
+
+def pack_transitions(states, actions, rewards, next_states, dones):
+    """
+    pack a batch of env steps.
+    :param states: (steps, num_agents, state_size)
+    :param actions: (steps, num_agents, action_size)
+    :param rewards: (steps, num_agents)
+    :param next_states: (steps, num_agents, state_size)
+    :param dones: (steps, num_agents)
+    """
+    num_steps, num_agents, state_size = states.shape
+    action_size = actions.shape[2]
+    return b''.join([TRANSITIONS_HEADER.pack(num_steps, num_agents, state_size, action_size),
+                     np.ascontiguousarray(states, dtype=np.float32).tobytes(),
+                     np.ascontiguousarray(actions, dtype=np.float32).tobytes(),
+                     np.ascontiguousarray(rewards, dtype=np.float32).tobytes(),
+                     np.ascontiguousarray(next_states, dtype=np.float32).tobytes(),
+                     np.ascontiguousarray(dones, dtype=np.uint8).tobytes()])
+
+
+def unpack_transitions(payload):
+    """ inverse of pack_transitions. the arrays are views on the payload (no copy) """
+    num_steps, num_agents, state_size, action_size = TRANSITIONS_HEADER.unpack_from(payload)
+    offset = TRANSITIONS_HEADER.size
+    arrays = []
+    for shape, dtype in [((num_steps, num_agents, state_size), np.float32),
+                         ((num_steps, num_agents, action_size), np.float32),
+                         ((num_steps, num_agents), np.float32),
+                         ((num_steps, num_agents, state_size), np.float32),
+                         ((num_steps, num_agents), np.uint8)]:
+        count = int(np.prod(shape))
+        arrays.append(np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(shape))
+        offset += count * np.dtype(dtype).itemsize
+    states, actions, rewards, next_states, dones = arrays
+    return states, actions, rewards, next_states, dones.astype(bool)
+
+
+def pack_actor_weights(actors):
+    """ flatten the parameters of a list of actor networks into one float32 array (in state_dict order) """
+    with torch.no_grad():
+        return torch.cat([t.detach().reshape(-1).float().cpu()
+                          for actor in actors for t in actor.state_dict().values()]).numpy()
+
+
+def unpack_actor_weights(actors, flat):
+    """ copy a flat array created by pack_actor_weights into the actor networks (in place) """
+    flat = np.asarray(flat, dtype=np.float32)
+    tensors = [t for actor in actors for t in actor.state_dict().values()]
+    if flat.size != sum(t.numel() for t in tensors):
+        # checked before anything is copied, the actors are left as they were
+        raise ValueError('weights size does not match the actor networks')
+    if not flat.flags.writeable:
+        # e.g. the bytes of a received frame: torch only wraps writable arrays (nothing is written to it)
+        flat = flat.copy()
+    flat = torch.from_numpy(flat)
+    offset = 0
+    with torch.no_grad():
+        for t in tensors:
+            n = t.numel()
+            t.copy_(flat[offset:offset + n].view_as(t))
+            offset += n
@@ -0,0 +1,272 @@
+"""
+actor weights published through shared memory, for the processes that run the policy on the learner's host.
+the learner writes the flat actor parameters (same layout as protocol.pack_actor_weights) into a memory mapped
+region together with a version number; the readers copy the newest version from the mapping into their actor
+networks - no pickling, no socket, and the learner never waits for them.
+
+consistency is a seqlock: the writer makes the sequence number odd, writes the weights and the version, and makes
+it even again. a reader copies the weights straight into its actors when the sequence number is even, and keeps
+them only if the sequence number did not change meanwhile - otherwise a publication overlapped the copy and it
+copies again.
+region layout: uint64 sequence, uint64 version, uint64 number of floats, padding to HEADER_BYTES, float32 weights.
+"""
+
+import mmap
+import os
+import pickle
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from agent import AgentABC
+from distributed.protocol import pack_actor_weights, unpack_actor_weights
+
+HEADER_BYTES = 64   # the weights start on their own cache line
+SEQUENCE = 0        # index of the sequence number in the header
+VERSION = 1         # index of the version in the header
+NUM_FLOATS = 2      # index of the number of floats in the header
+READ_ATTEMPTS = 100     # reads interrupted by a publication before refresh gives up
+
+
+def shared_weights_path(port):
+    """ :return: path of the region published by the learner listening on port (/dev/shm is in memory) """
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'rl_multi_agent_weights_{}'.format(port))
+
+
+def remove_shared_weights(path):
+    """ remove a region left at path (e.g. by a learner that was killed), so no worker maps it """
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _num_floats(actors):
+    return sum(t.numel() for actor in actors for t in actor.state_dict().values())
+
+
+class WeightPublisher:
+    def __init__(self, path, actors):
+        """
+        create the shared region (replacing a region left at the same path).
+        :param path: path of the region (see shared_weights_path)
+        :param actors: the actor networks to publish
+        """
+        self.path = path
+        self.actors = actors
+        num_floats = _num_floats(actors)
+        with open(path, 'wb') as f:
+            f.truncate(HEADER_BYTES + 4 * num_floats)
+        with open(path, 'r+b') as f:
+            self.region = mmap.mmap(f.fileno(), HEADER_BYTES + 4 * num_floats)
+        self.header = np.frombuffer(self.region, dtype=np.uint64, count=3)
+        self.weights = np.frombuffer(self.region, dtype=np.float32, count=num_floats, offset=HEADER_BYTES)
+        self.header[NUM_FLOATS] = num_floats
+
+    def publish(self, version):
+        """ write the current parameters of the actors as version (never waits for the readers) """
+        self.header[SEQUENCE] += 1  # odd - a write is in progress
+        offset = 0
+        with torch.no_grad():
+            for actor in self.actors:
+                for t in actor.state_dict().values():
+                    n = t.numel()
+                    self.weights[offset:offset + n] = t.detach().reshape(-1).float().cpu().numpy()
+                    offset += n
+        self.header[VERSION] = version
+        self.header[SEQUENCE] += 1  # even - consistent
+
+    def close(self):
+        """ remove the region (readers that have it mapped keep their mapping) """
+        del self.header, self.weights
+        self.region.close()
+        remove_shared_weights(self.path)
+
+
+class WeightSubscriber:
+    def __init__(self, path, actors):
+        """
+        map the region of a publisher.
+        :param path: path of the region (see shared_weights_path)
+        :param actors: the actor networks to copy the published weights into
+        """
+        self.actors = actors
+        # mapped writable (torch warns on read-only arrays), the subscriber never writes
+        with open(path, 'r+b') as f:
+            self.region = mmap.mmap(f.fileno(), 0)
+        self.header = np.frombuffer(self.region, dtype=np.uint64, count=3)
+        num_floats = int(self.header[NUM_FLOATS])
+        if num_floats != _num_floats(actors):
+            print('the published weights do not match the actor networks')
+            raise ValueError(path)
+        self.weights = np.frombuffer(self.region, dtype=np.float32, count=num_floats, offset=HEADER_BYTES)
+        self.version = None     # version in the actors (None - nothing read yet)
+        self.retries = 0        # reads that were interrupted by a publication
+
+    def published_version(self):
+        return int(self.header[VERSION])
+
+    def refresh(self):
+        """
+        copy the newest published version into the actors, if it is newer than theirs.
+        :return: True if the actors were updated
+        """
+        for _ in range(READ_ATTEMPTS):
+            sequence = int(self.header[SEQUENCE])
+            if sequence % 2 == 1:
+                # a publication is in progress - let the learner run (it may share the core)
+                self.retries += 1
+                time.sleep(0)
+                continue
+            version = int(self.header[VERSION])
+            if sequence == 0 or version == self.version:
+                return False
+            # one copy, from the mapping into the parameters
+            unpack_actor_weights(self.actors, self.weights)
+            if int(self.header[SEQUENCE]) == sequence:
+                self.version = version
+                return True
+            # a publication overlapped the copy: the actors hold a mix of two versions, they are copied again
+            self.version = None
+            self.retries += 1
+        # (a mixed copy left here is replaced by the next refresh, the version of the actors is unknown)
+        return False
+
+    def close(self):
+        del self.header, self.weights
+        self.region.close()
+
+
+def _benchmark_reader(path, agent_type, sizes, seconds, pipe):
+    """ process target - refreshes as fast as possible for seconds after it is ready,
+    answers (refreshes, mean refresh seconds, retries) """
+    torch.set_num_threads(1)
+    state_size, action_size, num_agents = sizes
+    agent = agent_type(state_size=state_size, action_size=action_size, num_agents=num_agents, random_seed=0)
+    subscriber = WeightSubscriber(path, agent.actors())
+    pipe.send(None)     # ready
+    refreshes = 0
+    refresh_time = 0.0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        if subscriber.refresh():
+            refresh_time += time.perf_counter() - start
+            refreshes += 1
+    pipe.send((refreshes, refresh_time / max(refreshes, 1), subscriber.retries))
+    subscriber.close()
+
+
+def benchmark_weight_broadcast(agent_type, sizes, num_readers, seconds, publish_interval):
+    """
+    compare the ways of handing the actor weights to another process: pickled state dicts, the tcp payload of
+    the distributed mode (flat float32 bytes), and the shared region - alone, and with reader processes
+    refreshing while the learner publishes.
+    :param agent_type: the agent class
+    :param sizes: (state_size, action_size, num_agents)
+    :param num_readers: number of reader processes
+    :param seconds: duration of every timing
+    :param publish_interval: seconds between the publications while the readers refresh (the learner publishes
+    every --sync-every learned steps, not back to back)
+    :return: dictionary name -> seconds (or count)
+    """
+    import multiprocessing
+    state_size, action_size, num_agents = sizes
+    agent = agent_type(state_size=state_size, action_size=action_size, num_agents=num_agents, random_seed=0)
+    reader = agent_type(state_size=state_size, action_size=action_size, num_agents=num_agents, random_seed=1)
+    actors = agent.actors()
+
+    def timed(function):
+        calls = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            function()
+            calls += 1
+        return (time.perf_counter() - start) / calls
+
+    def state_dicts_round_trip():
+        payload = pickle.dumps([actor.state_dict() for actor in actors])
+        for actor, state_dict in zip(reader.actors(), pickle.loads(payload)):
+            actor.load_state_dict(state_dict)
+
+    def flat_round_trip():
+        payload = pack_actor_weights(actors).tobytes()
+        unpack_actor_weights(reader.actors(), np.frombuffer(payload, dtype=np.float32))
+
+    results = {'weights_bytes': 4 * _num_floats(actors),
+               'pickled_state_dicts_seconds': timed(state_dicts_round_trip),
+               'flat_payload_seconds': timed(flat_round_trip)}
+
+    path = shared_weights_path('benchmark_{}'.format(os.getpid()))
+    publisher = WeightPublisher(path, actors)
+    subscriber = WeightSubscriber(path, reader.actors())
+    version = [0]
+
+    def publish():
+        version[0] += 1
+        publisher.publish(version[0])
+
+    results['publish_seconds'] = timed(publish)
+
+    def publish_and_refresh():
+        publish()
+        subscriber.refresh()
+
+    results['publish_refresh_seconds'] = timed(publish_and_refresh)
+    subscriber.close()
+
+    # publishing while reader processes refresh concurrently
+    if num_readers > 0:
+        context = multiprocessing.get_context('spawn')
+        pipes = []
+        for _ in range(num_readers):
+            pipe, child_pipe = context.Pipe()
+            context.Process(target=_benchmark_reader, args=(path, agent_type, sizes, seconds, child_pipe),
+                            daemon=True).start()
+            pipes.append(pipe)
+        for pipe in pipes:
+            pipe.recv()
+        publish_time = 0.0
+        publications = 0
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            publish()
+            publish_time += time.perf_counter() - start
+            publications += 1
+            time.sleep(publish_interval)
+        results['concurrent_publications'] = publications
+        results['concurrent_publish_seconds'] = publish_time / publications
+        answers = [pipe.recv() for pipe in pipes]
+        results['concurrent_refreshes'] = sum(a[0] for a in answers)
+        results['concurrent_refresh_seconds'] = float(np.mean([a[1] for a in answers]))
+        results['concurrent_read_retries'] = sum(a[2] for a in answers)
+    publisher.close()
+    return results
+
+
+def weights_benchmark_wrapper(env_config, wrapper_config):
+    """
+    print the latency of handing the actor weights of an agent to other processes (see benchmark_weight_broadcast).
+    :param env_config: dictionary, the environment parameters (num_agents)
+    :param wrapper_config: dictionary of user defined variables.
+    """
+    agent_type = wrapper_config['agent']
+    if not issubclass(agent_type, AgentABC):
+        print('invalid agent type')
+        raise TypeError
+    sizes = (wrapper_config['state_size'], wrapper_config['action_size'], env_config['num_agents'])
+    results = benchmark_weight_broadcast(agent_type, sizes, wrapper_config['num_readers'],
+                                         wrapper_config['trial_seconds'], wrapper_config['publish_interval'])
+    print('\nactor weights: {} bytes'.format(results['weights_bytes']))
+    print('pickled state dicts (dump + load):\t{:.1f} us'.format(results['pickled_state_dicts_seconds'] * 1e6))
+    print('tcp payload (pack + unpack):\t\t{:.1f} us'.format(results['flat_payload_seconds'] * 1e6))
+    print('shared memory publish:\t\t\t{:.1f} us'.format(results['publish_seconds'] * 1e6))
+    print('shared memory publish + refresh:\t{:.1f} us'.format(results['publish_refresh_seconds'] * 1e6))
+    if wrapper_config['num_readers'] > 0:
+        print('with {} reader processes:\t{} publications\tpublish {:.1f} us\trefresh {:.1f} us\t'
+              '{} refreshes\t{} retried reads'.format(
+                wrapper_config['num_readers'], results['concurrent_publications'],
+                results['concurrent_publish_seconds'] * 1e6, results['concurrent_refresh_seconds'] * 1e6,
+                results['concurrent_refreshes'], results['concurrent_read_retries']))
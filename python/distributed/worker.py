@@ -0,0 +1,163 @@
+"""
+rollout worker of the distributed training mode.
+runs its own environment and a copy of the agent (used for act() only), streams the env steps to the learner
+and replaces its actor weights whenever the learner pushes new ones.
+"""
+
+import socket
+import threading
+
+import numpy as np
+
+from agent import AgentABC
+from distributed import protocol
+from distributed.shared_weights import WeightSubscriber, shared_weights_path
+from utils.hyperparameters import read_hyperparameters, apply_hyperparameters
+from utils.environment import resolve_build_path, open_environment
+
+
+class _WeightsReceiver:
+    """ receiver thread - keeps the latest weights pushed by the learner (older versions are dropped) """
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.latest = None
+        self.shutdown = threading.Event()
+        self.first_weights = threading.Event()
+        self.shared_weights = threading.Event()     # the learner acknowledged the shared region
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        try:
+            while True:
+                msg_type, payload = protocol.recv_frame(self.sock)
+                if msg_type == protocol.WEIGHTS:
+                    with self.lock:
+                        self.latest = payload
+                    self.first_weights.set()
+                elif msg_type == protocol.SHARED_WEIGHTS:
+                    self.shared_weights.set()
+                elif msg_type == protocol.SHUTDOWN:
+                    break
+        except (ConnectionError, OSError):
+            pass
+        self.shutdown.set()
+        self.first_weights.set()
+
+    def take(self):
+        """ :return: the newest weights payload since the last call (or None) """
+        with self.lock:
+            payload, self.latest = self.latest, None
+        return payload
+
+
+def worker_wrapper(env_config, wrapper_config):
+    """
+    run a rollout worker until the learner tells it to stop.
+    :param env_config: dictionary, used to pass parameters into the environment
+    :param wrapper_config: dictionary of user defined variables.
+    """
+    build_path = resolve_build_path(wrapper_config['build'])
+    agent_type = wrapper_config['agent']
+    if not issubclass(agent_type, AgentABC):
+        print('invalid agent type')
+        raise TypeError
+    # hparams: the agent constants of the learner that change the actors (e.g. FRAME_HISTORY)
+    apply_hyperparameters(agent_type, read_hyperparameters(wrapper_config.get('hparams')))
+    worker_id = wrapper_config['worker_id']
+    # batch_steps (int): number of env steps sent to the learner in one message
+    batch_steps = wrapper_config['batch_steps']
+
+    env = open_environment(build_path, no_graphics=not wrapper_config['show_graphics'],
+                           worker_id=worker_id, seed=worker_id)
+    brain_name = env.brain_names[0]
+    brain = env.brains[brain_name]
+    action_size = brain.vector_action_space_size[0]
+    state_size = brain.vector_observation_space_size
+    env_info = env.reset(train_mode=True, config=env_config)[brain_name]
+    num_agents = len(env_info.agents)
+
+    agent: AgentABC = agent_type(state_size=state_size, action_size=action_size,
+                                 num_agents=num_agents, random_seed=worker_id)
+
+    sock = socket.create_connection((wrapper_config['learner_host'], wrapper_config['learner_port']))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    protocol.send_frame(sock, protocol.HELLO,
+                        protocol.HELLO_FORMAT.pack(worker_id, num_agents, state_size, action_size,
+                                                   len(protocol.pack_actor_weights(agent.actors()))))
+    receiver = _WeightsReceiver(sock)
+    receiver.first_weights.wait()
+    weights_version = -1
+    # shared_weights (bool): read the weights from the learner's shared region (when the learner runs on this host).
+    # the region is only read once the learner acknowledged it - until then (or if the learner does not publish,
+    # e.g. the region is left from another learner) the weights come over tcp
+    subscriber = None
+    if wrapper_config.get('shared_weights', False) and not receiver.shutdown.is_set():
+        try:
+            subscriber = WeightSubscriber(shared_weights_path(wrapper_config['learner_port']), agent.actors())
+            protocol.send_frame(sock, protocol.SHARED_WEIGHTS)
+        except FileNotFoundError:
+            print('\nthe learner does not publish its weights on this host, receiving them over tcp')
+
+    # preallocated batch of steps (sent whenever it is full or the episode ends)
+    batch_states = np.zeros((batch_steps, num_agents, state_size), dtype=np.float32)
+    batch_actions = np.zeros((batch_steps, num_agents, action_size), dtype=np.float32)
+    batch_rewards = np.zeros((batch_steps, num_agents), dtype=np.float32)
+    batch_next_states = np.zeros((batch_steps, num_agents, state_size), dtype=np.float32)
+    batch_dones = np.zeros((batch_steps, num_agents), dtype=bool)
+
+    def send_batch(n):
+        protocol.send_frame(sock, protocol.TRANSITIONS, protocol.pack_transitions(
+            batch_states[:n], batch_actions[:n], batch_rewards[:n], batch_next_states[:n], batch_dones[:n]))
+
+    i_episode = 0
+    try:
+        while not receiver.shutdown.is_set():
+            i_episode += 1
+            env_info = env.reset(train_mode=True, config=env_config)[brain_name]
+            states = env_info.vector_observations
+            agent.reset()
+            agent.restart()
+            agent_scores = np.zeros(num_agents)
+            steps = 0
+            n = 0
+            while True:
+                # use the newest weights the learner pushed (or published)
+                payload = receiver.take()
+                if subscriber is not None and receiver.shared_weights.is_set():
+                    if subscriber.refresh():
+                        weights_version = subscriber.version
+                elif payload is not None:
+                    weights_version = protocol.WEIGHTS_HEADER.unpack_from(payload)[0]
+                    protocol.unpack_actor_weights(agent.actors(), np.frombuffer(
+                        payload, dtype=np.float32, offset=protocol.WEIGHTS_HEADER.size))
+                steps += 1
+                actions = np.reshape(agent.act(states), (num_agents, action_size))
+                env_info = env.step(actions)[brain_name]
+                next_states = env_info.vector_observations
+                rewards = env_info.rewards
+                dones = env_info.local_done
+                batch_states[n] = states
+                batch_actions[n] = actions
+                batch_rewards[n] = rewards
+                batch_next_states[n] = next_states
+                batch_dones[n] = dones
+                n += 1
+                states = next_states
+                agent_scores += rewards
+                episode_done = np.any(dones)
+                if n == batch_steps or episode_done:
+                    send_batch(n)
+                    n = 0
+                if episode_done:
+                    break
+            protocol.send_frame(sock, protocol.EPISODE,
+                                protocol.EPISODE_FORMAT.pack(worker_id, float(np.mean(agent_scores)), steps))
+            print('\nWorker {}\tEpisode {}\tEpisode Score: {:.3f}\tNumber Of Steps{}\tWeights Version {}'.format(
+                worker_id, i_episode, np.mean(agent_scores), steps, weights_version), end="")
+    except (ConnectionError, OSError):
+        print('\nconnection to the learner closed')
+    if subscriber is not None:
+        subscriber.close()
+    sock.close()
+    env.close()
@@ -0,0 +1,153 @@
+###################################
+# Multi-seed training in one process: S independent ddpg agents (one per seed), each on its own environment,
+# acting and learning as one batched computation (see ddpg/ddpg_ensemble.py). every seed writes its weights and
+# scores to its own dir ({weights-path}/seed_{seed}), as a train run with that seed would.
+import os
+import time
+
+import numpy as np
+import torch
+
+from ddpg import ddpg_agent, ddpg_ensemble
+from ddpg.ddpg_agent import Agent as DDPGAgent
+from ddpg.ddpg_ensemble import EnsembleAgent
+from utils.environment import resolve_build_path, open_environment, step_environment
+from utils.hyperparameters import read_hyperparameters, apply_hyperparameters
+from utils.loss_stats import format_stats
+
+
+def ensemble_wrapper(env_config, wrapper_config):
+    """
+    train one agent per seed together.
+    :param env_config: dictionary, used to pass parameters into the environments
+    :param wrapper_config: dictionary of user defined variables.
+    """
+    # num_episodes (int): number of training episodes of every seed
+    num_episodes = wrapper_config['num_episodes']
+    scores_average_window = wrapper_config['scores_avg_window']
+    solved_score = wrapper_config['solved_score']
+    weights_path = wrapper_config['weights_path']
+    load_weights = wrapper_config['load_weights']
+    save_mem = wrapper_config['save_mem']
+    load_mem = wrapper_config['load_mem']
+    mem_path = wrapper_config['mem_path']
+    if (save_mem or load_mem) and mem_path is None:
+        print('--mem-path is required to save or load the replay buffers')
+        raise ValueError
+    build_path = resolve_build_path(wrapper_config['build'])
+    if wrapper_config['agent'] is not DDPGAgent:
+        print('the ensemble mode trains ddpg agents only')
+        raise TypeError
+    if ddpg_ensemble.vmap is None:
+        print('the ensemble mode needs torch 2.0 or higher (torch.func), found torch {}'.format(torch.__version__))
+        raise ImportError
+    apply_hyperparameters(DDPGAgent, read_hyperparameters(wrapper_config.get('hparams')))
+    if ddpg_agent.FRAME_HISTORY != 1:
+        print('the ensemble mode does not support FRAME_HISTORY')
+        raise ValueError
+    if ddpg_agent.MIXED_PRECISION:
+        print('the ensemble mode does not support MIXED_PRECISION')
+        raise ValueError
+    for option in ['memory_budget', 'demo_path']:
+        if wrapper_config[option] is not None:
+            print('the ensemble mode does not support --{}'.format(option.replace('_', '-')))
+            raise ValueError
+    if wrapper_config['print_memory_usage']:
+        print('the ensemble mode does not support --print-memory-usage')
+        raise ValueError
+    print_agent_loss = wrapper_config['print_agent_loss']
+    save_log = wrapper_config['save_score_log']
+    save_best_weights = wrapper_config['save_best_weights']
+    weights_format = wrapper_config['weights_format']
+    action_repeat = wrapper_config['action_repeat']
+    if action_repeat < 1:
+        print('--action-repeat must be at least 1')
+        raise ValueError
+    # seeds: random seed of every member, member i runs on the environment with worker id --worker-id + i
+    seeds = wrapper_config['seeds']
+    if len(set(seeds)) != len(seeds):
+        print('--seeds must be different')
+        raise ValueError
+    worker_id = wrapper_config['worker_id']
+    seed_paths = [os.path.join(weights_path, 'seed_{}'.format(seed)) for seed in seeds]
+    mem_paths = [os.path.join(mem_path, 'seed_{}'.format(seed)) if mem_path is not None else None for seed in seeds]
+
+    envs = [open_environment(build_path, no_graphics=not wrapper_config['show_graphics'], worker_id=worker_id + i,
+                             seed=seed) for i, seed in enumerate(seeds)]
+    brain_name = envs[0].brain_names[0]
+    brain = envs[0].brains[brain_name]
+    action_size = brain.vector_action_space_size[0]
+    state_size = brain.vector_observation_space_size
+    states = np.stack([env.reset(train_mode=True, config=env_config)[brain_name].vector_observations
+                       for env in envs])
+    num_agents = states.shape[1]
+    print('\nNumber of Agents: {}\tSeeds: {}'.format(num_agents, seeds))
+
+    ensemble = EnsembleAgent(state_size, action_size, num_agents, seeds)
+    for s in range(len(seeds)):
+        if load_weights:
+            ensemble.load_weights(s, seed_paths[s])
+        if load_mem:
+            ensemble.load_mem(s, mem_paths[s])
+    # the agents create only the last level of a directory (os.mkdir), so the dirs of the members are made here
+    for path in seed_paths + (mem_paths if save_mem else []):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    agent_scores = np.zeros((len(seeds), num_agents))
+    steps = np.zeros(len(seeds), dtype=int)
+    episode_scores = [[] for _ in seeds]
+    best_scores = [-np.inf] * len(seeds)
+    finished = [False] * len(seeds)     # the seed has run num_episodes (or solved the environment)
+    total_steps = 0
+    start = time.time()
+    # all the members are stepped together. a member that is finished keeps driving (the batch does not shrink),
+    # but nothing of it is logged or saved any more - its results are those of its first num_episodes episodes
+    while not all(finished):
+        actions = ensemble.act(states)
+        results = [step_environment(env, brain_name, actions[s], action_repeat) for s, env in enumerate(envs)]
+        next_states = np.stack([r[0] for r in results])
+        rewards = np.array([r[1] for r in results])
+        dones = np.array([r[2] for r in results], dtype=bool)
+        ensemble.step(states, actions, rewards, next_states, dones)
+        states = next_states
+        agent_scores += rewards
+        steps += 1
+        total_steps += 1
+
+        for s in np.flatnonzero(dones.any(axis=1)):
+            if not finished[s]:
+                episode_scores[s].append(np.mean(agent_scores[s]))
+                i_episode = len(episode_scores[s])
+                average_score = np.mean(episode_scores[s][-scores_average_window:])
+                print('\nSeed {}\tEpisode {}\tEpisode Score: {:.3f}\tAverage Score: {:.3f}\tNumber Of Steps{}'
+                      '\tEnv Steps/sec {:.1f}'.format(seeds[s], i_episode, episode_scores[s][-1], average_score,
+                                                      steps[s], total_steps * len(seeds) / (time.time() - start)),
+                      end="")
+                if print_agent_loss:
+                    print('\t' + format_stats(ensemble.episode_stats(s)), end="")
+                if save_log:
+                    # noinspection PyTypeChecker
+                    np.savetxt(os.path.join(seed_paths[s], "Agent_Scores.csv"), episode_scores[s], delimiter=",")
+                ensemble.save_weights(s, seed_paths[s], weights_format, episode=i_episode)
+                if save_best_weights and best_scores[s] < average_score:
+                    best_scores[s] = average_score
+                    ensemble.save_weights(s, seed_paths[s] + '_best', weights_format, episode=i_episode)
+                if save_mem and (i_episode % 50) == 0:
+                    ensemble.save_mem(s, mem_paths[s])
+                solved = i_episode > scores_average_window*2 and average_score >= solved_score
+                if solved:
+                    print('\nSeed {} solved the environment in {:d} episodes!\tAverage Score: {:.3f}'.format(
+                        seeds[s], i_episode, average_score), end="")
+                if solved or i_episode >= num_episodes:
+                    finished[s] = True
+                    if save_mem:
+                        ensemble.save_mem(s, mem_paths[s])
+            # start the next episode of the member
+            states[s] = envs[s].reset(train_mode=True, config=env_config)[brain_name].vector_observations
+            agent_scores[s] = 0
+            steps[s] = 0
+            ensemble.reset(s)
+
+    for env in envs:
+        env.close()
@@ -0,0 +1,197 @@
+###################################
+# Evaluate many checkpoints (weights directories) at once, spread over a pool of environment workers.
+import csv
+import multiprocessing
+import multiprocessing.connection
+import os
+
+import numpy as np
+
+from agent import AgentABC
+from test import run_test_episode
+from utils.environment import resolve_build_path, open_environment
+from utils.hyperparameters import read_hyperparameters, apply_hyperparameters
+
+
+def _evaluation_worker(worker_id, build_path, agent_type, env_config, hparams, cores, pipe):
+    """
+    process target - owns one environment, receives weights directories and answers with the score of one
+    episode. every policy is loaded once and kept for the following episodes. a weights dir that can not be loaded
+    is answered with the score None and the error.
+    """
+    import torch
+    apply_hyperparameters(agent_type, hparams)
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    env = open_environment(build_path, worker_id=worker_id, seed=worker_id)
+    brain_name = env.brain_names[0]
+    brain = env.brains[brain_name]
+    num_agents = len(env.reset(train_mode=True, config=env_config)[brain_name].agents)
+    agents = {}
+    while True:
+        try:
+            weights_path = pipe.recv()
+        except EOFError:
+            # the evaluation process is gone
+            break
+        if weights_path is None:
+            break
+        if weights_path not in agents:
+            agent = agent_type(state_size=brain.vector_observation_space_size,
+                               action_size=brain.vector_action_space_size[0], num_agents=num_agents, random_seed=0)
+            try:
+                agent.load_weights(weights_path)
+            except Exception as e:
+                pipe.send((weights_path, None, repr(e)))
+                continue
+            agents[weights_path] = agent
+        scores, steps = run_test_episode(env, brain_name, agents[weights_path], env_config, train_mode=True)
+        pipe.send((weights_path, float(np.mean(scores)), steps))
+    env.close()
+
+
+def confidence_interval(scores, confidence):
+    """ :return: (mean, std, low, high) normal approximation of the confidence interval of the mean """
+    scores = np.asarray(scores)
+    mean = float(np.mean(scores))
+    std = float(np.std(scores, ddof=1)) if len(scores) > 1 else 0.0
+    # python 3.8 - imported here, so the other modes still run on older versions
+    from statistics import NormalDist
+    half_width = NormalDist().inv_cdf(0.5 + confidence / 2) * std / np.sqrt(len(scores))
+    return mean, std, mean - half_width, mean + half_width
+
+
+def evaluate_wrapper(env_config, wrapper_config):
+    """
+    evaluate a set of checkpoints and rank them.
+    :param env_config: dictionary, used to pass parameters into the environment
+    :param wrapper_config: dictionary of user defined variables.
+    """
+    build_path = resolve_build_path(wrapper_config['build'])
+    weights_paths = wrapper_config['weights_paths']
+    for weights_path in weights_paths:
+        if not os.path.isdir(weights_path):
+            print('{} is not a valid directory'.format(weights_path))
+            raise NotADirectoryError
+    agent_type = wrapper_config['agent']
+    if not issubclass(agent_type, AgentABC):
+        print('invalid agent type')
+        raise TypeError
+    # hparams: agent constants the weights were trained with that change the networks (e.g. FRAME_HISTORY),
+    # applied in every worker
+    hparams = read_hyperparameters(wrapper_config.get('hparams'))
+    apply_hyperparameters(agent_type, hparams)
+    # num_episodes (int): maximal number of episodes for every checkpoint
+    num_episodes = wrapper_config['num_episodes']
+    # min_episodes (int): episodes before a checkpoint can be stopped early
+    min_episodes = wrapper_config['min_episodes']
+    confidence = wrapper_config['confidence']
+
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    num_workers = wrapper_config['num_workers'] or len(cores)
+    context = multiprocessing.get_context('spawn')
+    workers = []
+    for i in range(num_workers):
+        pipe, child_pipe = context.Pipe()
+        process = context.Process(target=_evaluation_worker, daemon=True,
+                                  args=(wrapper_config['base_worker_id'] + i, build_path, agent_type, env_config,
+                                        hparams, [cores[i % len(cores)]], child_pipe))
+        process.start()
+        # only the worker holds its end, so the pipe reports the end of the worker (EOFError)
+        child_pipe.close()
+        workers.append((process, pipe))
+    print('\nevaluating {} checkpoints with {} workers'.format(len(weights_paths), num_workers))
+
+    scores = {weights_path: [] for weights_path in weights_paths}
+    in_flight = {weights_path: 0 for weights_path in weights_paths}
+    status = {weights_path: 'running' for weights_path in weights_paths}
+
+    def next_checkpoint():
+        """ the running checkpoint with the fewest episodes (done + in flight) that still needs episodes """
+        candidates = [w for w in weights_paths
+                      if status[w] == 'running' and len(scores[w]) + in_flight[w] < num_episodes]
+        return min(candidates, key=lambda w: len(scores[w]) + in_flight[w]) if candidates else None
+
+    def update_status():
+        """ stop checkpoints whose confidence interval is entirely below the best checkpoint's interval """
+        for w in weights_paths:
+            if status[w] == 'running' and len(scores[w]) >= num_episodes:
+                status[w] = 'done'
+        intervals = {w: confidence_interval(scores[w], confidence)
+                     for w in weights_paths if status[w] in ['running', 'done'] and len(scores[w]) >= min_episodes}
+        if len(intervals) < 2:
+            return
+        best_low = max(low for _, _, low, _ in intervals.values())
+        for w, (_, _, _, high) in intervals.items():
+            if status[w] == 'running' and high < best_low:
+                status[w] = 'stopped'
+                print('\nstopping {} after {} episodes (clearly worse)'.format(w, len(scores[w])))
+
+    idle = list(range(num_workers))
+    busy = {}   # worker index -> weights path
+    dead = set()    # workers that crashed
+    while True:
+        while idle:
+            weights_path = next_checkpoint()
+            if weights_path is None:
+                break
+            i = idle.pop()
+            workers[i][1].send(weights_path)
+            busy[i] = weights_path
+            in_flight[weights_path] += 1
+        if not busy:
+            break
+        pipes = {workers[i][1]: i for i in busy}
+        for pipe in multiprocessing.connection.wait(list(pipes)):
+            i = pipes[pipe]
+            try:
+                weights_path, score, steps = pipe.recv()
+            except EOFError:
+                # the worker crashed on this weights dir (e.g. it could not be loaded) - the dir is not evaluated
+                # any further and the other workers go on
+                weights_path = busy.pop(i)
+                in_flight[weights_path] -= 1
+                status[weights_path] = 'failed'
+                dead.add(i)
+                print('\nworker {} died while evaluating {}, the weights dir is marked as failed'.format(
+                    i, weights_path), end="")
+                continue
+            del busy[i]
+            idle.append(i)
+            in_flight[weights_path] -= 1
+            if score is None:
+                if status[weights_path] != 'failed':
+                    status[weights_path] = 'failed'
+                    print('\nloading {} failed ({}), the weights dir is marked as failed'.format(
+                        weights_path, steps), end="")
+                continue
+            scores[weights_path].append(score)
+            print('\n{}\tEpisode {}\tScore: {:.3f}\tNumber Of Steps {}'.format(
+                weights_path, len(scores[weights_path]), score, steps), end="")
+        update_status()
+
+    if len(dead) == num_workers and any(status[w] == 'running' for w in weights_paths):
+        print('\nevery worker died, the remaining weights dirs were not evaluated', end="")
+    for i, (process, pipe) in enumerate(workers):
+        if i not in dead:
+            pipe.send(None)
+        process.join()
+
+    # ranked table (by mean score)
+    rows = []
+    for w in weights_paths:
+        mean, std, low, high = confidence_interval(scores[w], confidence) if scores[w] else (np.nan,) * 4
+        rows.append([w, status[w], len(scores[w]), mean, std, low, high])
+    rows.sort(key=lambda r: -np.inf if np.isnan(r[3]) else r[3], reverse=True)
+    columns = ['rank', 'checkpoint', 'status', 'episodes', 'mean', 'std',
+               'ci_low_{:g}'.format(confidence), 'ci_high_{:g}'.format(confidence)]
+    print('\n\n' + '\t'.join(columns))
+    for rank, row in enumerate(rows, 1):
+        print('{}\t{}\t{}\t{}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}'.format(rank, *row))
+    if wrapper_config['results_file'] is not None:
+        with open(wrapper_config['results_file'], 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for rank, row in enumerate(rows, 1):
+                writer.writerow([rank] + row)
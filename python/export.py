@@ -0,0 +1,166 @@
+###################################
+# Export the trained actors to ONNX, to drive the cars inside Unity (ML-Agents LearningBrain / Barracuda)
+# without the python process in the loop.
+import inspect
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from agent import AgentABC
+from utils.demonstrations import DEMO_EXTENSION, demonstration_files, read_demonstration
+from utils.environment import STAND_IN_BUILD, open_environment
+from utils.hyperparameters import read_hyperparameters, apply_hyperparameters, get_hyperparameters
+from utils.numpy_actor import read_numpy_actors, save_numpy_actors
+
+# names and constants the ML-Agents inference brain reads from a model (InferenceBrain/TensorNames.cs)
+INPUT_NAME = 'vector_observation'
+OUTPUT_NAME = 'action'
+MODEL_API_VERSION = 2   # InferenceBrain/ModelParamLoader.cs ApiVersion
+CONSTANT_OUTPUTS = ['version_number', 'memory_size', 'is_continuous_control', 'action_output_shape']
+
+
+class ExportedActor(nn.Module):
+    """ an actor with the constant outputs the inference brain checks before running a model """
+    def __init__(self, actor, action_size):
+        super().__init__()
+        self.actor = actor
+        self.register_buffer('version_number', torch.tensor([MODEL_API_VERSION], dtype=torch.float32))
+        self.register_buffer('memory_size', torch.tensor([0], dtype=torch.float32))
+        self.register_buffer('is_continuous_control', torch.tensor([1], dtype=torch.float32))
+        self.register_buffer('action_output_shape', torch.tensor([action_size], dtype=torch.float32))
+
+    def forward(self, vector_observation):
+        return (self.actor(vector_observation), self.version_number, self.memory_size, self.is_continuous_control,
+                self.action_output_shape)
+
+
+def export_actor(actor, path, state_size, action_size, opset):
+    """ write one actor as an onnx graph with a dynamic batch size (one row per car using the brain) """
+    module = ExportedActor(actor, action_size).eval()
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        kwargs['dynamo'] = False    # the torchscript exporter supports the old opsets barracuda reads
+    torch.onnx.export(module, torch.zeros(1, state_size), path, input_names=[INPUT_NAME],
+                      output_names=[OUTPUT_NAME] + CONSTANT_OUTPUTS, opset_version=opset,
+                      dynamic_axes={INPUT_NAME: {0: 'batch'}, OUTPUT_NAME: {0: 'batch'}}, **kwargs)
+
+
+def _onnx_runner(path):
+    """ :return: function observations -> actions running the onnx file (onnxruntime, or the onnx reference) """
+    try:
+        import onnxruntime
+        session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+        return lambda observations: session.run([OUTPUT_NAME], {INPUT_NAME: observations})[0]
+    except ImportError:
+        from onnx.reference import ReferenceEvaluator
+        evaluator = ReferenceEvaluator(path)
+        return lambda observations: evaluator.run([OUTPUT_NAME], {INPUT_NAME: observations})[0]
+
+
+def _is_demo_path(path):
+    if os.path.isdir(path):
+        return any(name.endswith(DEMO_EXTENSION) for name in os.listdir(path))
+    return path.endswith(DEMO_EXTENSION)
+
+
+def recorded_observations(observations_path, agent: AgentABC, env_config, state_size, num_observations):
+    """
+    observations to compare pytorch and onnx on.
+    :param observations_path: .demo file / dir of .demo files, replay buffer dir (--save-mem),
+    or None - a few episodes of the stand-in environment driven by the agent
+    :return: array (num observations, state_size)
+    """
+    if observations_path is None:
+        env = open_environment(STAND_IN_BUILD)
+        brain_name = env.brain_names[0]
+        observations = []
+        while len(observations) * env_config['num_agents'] < num_observations:
+            env_info = env.reset(train_mode=True, config=env_config)[brain_name]
+            agent.restart()
+            while not np.any(env_info.local_done):
+                observations.append(env_info.vector_observations)
+                env_info = env.step(agent.act(env_info.vector_observations, add_noise=False))[brain_name]
+        env.close()
+        observations = np.concatenate(observations)
+    elif _is_demo_path(observations_path):
+        observations = np.concatenate([steps['observations'] for path in demonstration_files(observations_path)
+                                       for steps in read_demonstration(path)[2].values()])
+    elif os.path.isdir(observations_path):
+        agent.load_mem(observations_path)
+        observations = np.concatenate([buffer.states().reshape(-1, state_size) for buffer in agent.replay_buffers()])
+    else:
+        print('--observations-path is not a .demo file or a directory')
+        raise FileNotFoundError
+    if observations.shape[1] != state_size:
+        print('the recorded observations have size {} instead of {}'.format(observations.shape[1], state_size))
+        raise ValueError
+    return observations[:num_observations].astype(np.float32)
+
+
+def export_wrapper(env_config, wrapper_config):
+    """
+    export the actors of a weights dir to onnx (one file per actor) or to a numpy array file, and check them against
+    pytorch.
+    :param env_config: dictionary, the environment parameters (num_agents)
+    :param wrapper_config: dictionary of user defined variables.
+    """
+    weights_path = wrapper_config['weights_path']
+    if not os.path.isdir(weights_path):
+        print('--weights-path is not a valid directory')
+        raise NotADirectoryError
+    agent_type = wrapper_config['agent']
+    if not issubclass(agent_type, AgentABC):
+        print('invalid agent type')
+        raise TypeError
+    # hparams: agent constants the weights were trained with that change the networks (e.g. FRAME_HISTORY)
+    apply_hyperparameters(agent_type, read_hyperparameters(wrapper_config.get('hparams')))
+    frame_history = get_hyperparameters(agent_type, ['FRAME_HISTORY']).get('FRAME_HISTORY', 1)
+    state_size = wrapper_config['state_size']
+    action_size = wrapper_config['action_size']
+    num_agents = env_config['num_agents']
+    export_format = wrapper_config.get('format', 'onnx')
+    output_path = wrapper_config['output_path'] or (weights_path if export_format == 'numpy'
+                                                    else os.path.join(weights_path, 'onnx'))
+    if not os.path.isdir(output_path):
+        os.makedirs(output_path)
+
+    agent: AgentABC = agent_type(state_size=state_size, action_size=action_size, num_agents=num_agents,
+                                 random_seed=0)
+    agent.load_weights(weights_path)
+    observations = recorded_observations(wrapper_config['observations_path'], agent, env_config, state_size,
+                                         wrapper_config['num_observations'])
+    if frame_history > 1:
+        # the actors see the last frame_history observations of a car, oldest first (stacked vectors in unity)
+        observations = np.concatenate([np.roll(observations, k, axis=0) for k in range(frame_history - 1, -1, -1)],
+                                      axis=1)
+    actors = [actor.cpu().eval() for actor in agent.actors()]
+    print('\nchecking on {} recorded observations'.format(len(observations)))
+    tolerance = wrapper_config['tolerance']
+
+    if export_format == 'numpy':
+        # all the actors in one array file, read back the way test / serve --runtime numpy read it
+        path = save_numpy_actors(actors, output_path)
+        for i, (actor, numpy_actor) in enumerate(zip(actors, read_numpy_actors(path))):
+            with torch.no_grad():
+                expected = actor(torch.from_numpy(observations)).numpy()
+            max_error = float(np.max(np.abs(numpy_actor(observations) - expected)))
+            print('{} actor {}\tmax abs difference from pytorch: {:.3g}'.format(path, i, max_error))
+            if not max_error <= tolerance:
+                print('the numpy actor does not match pytorch (tolerance {:g})'.format(tolerance))
+                raise ValueError(path)
+        return
+
+    # ddpg: one actor for every car. mddpg / maddpg: the actor of car i drives car i (one brain per car in unity)
+    for i, actor in enumerate(actors):
+        path = os.path.join(output_path, 'actor.onnx' if len(actors) == 1 else 'actor_{}.onnx'.format(i))
+        export_actor(actor, path, state_size * frame_history, action_size, wrapper_config['opset'])
+        with torch.no_grad():
+            expected = actor(torch.from_numpy(observations)).numpy()
+        actual = _onnx_runner(path)(observations)
+        max_error = float(np.max(np.abs(actual - expected)))
+        print('{}\tmax abs difference from pytorch: {:.3g}'.format(path, max_error))
+        if not max_error <= tolerance:
+            print('the exported actor does not match pytorch (tolerance {:g})'.format(tolerance))
+            raise ValueError(path)
@@ -5,6 +5,9 @@ from agent import AgentABC
 from maddpg.maddpg_model import Actor, Critic
 from utils.replay_buffer import ReplayBuffer
 from utils.noise import OUNoise
+from utils.loss_stats import RunningStats
+from utils.checkpoint import has_bundle, load_bundle, remove_bundle
+from utils.mixed_precision import learn_autocast
 
 import torch
 import torch.nn.functional as F
@@ -19,6 +22,8 @@ NUM_UPDATES = 1         # how many learning steps to take each learning phase (a
 LR_ACTOR = 1e-4         # learning rate of the actor
 LR_CRITIC = 1.5e-4      # learning rate of the critic
 WEIGHT_DECAY = 0        # weight decay
+MIXED_PRECISION = False     # bfloat16 forward / backward passes in learn (float32 weights and soft updates)
+FRAME_HISTORY = 1       # observations in a state - maddpg does not support more than 1 (see ddpg)
 
 an_filename = "maddpgActor_Model.pth"
 cn_filename = "maddpgCritic_Model.pth"
@@ -39,6 +44,10 @@ class Agent(AgentABC):
             :param random_seed: random seed
         """
         super().__init__(state_size, action_size, num_agents, random_seed)
+        if FRAME_HISTORY != 1:
+            # the critics learn from the joint state of the cars, which has no observation history
+            print('maddpg does not support FRAME_HISTORY, use ddpg or mddpg')
+            raise ValueError
         self.state_size = state_size
         self.action_size = action_size
         self.num_agents = num_agents
@@ -70,12 +79,14 @@ class Agent(AgentABC):
 
         # debugging variables
         self.step_count = 0
-        self.mse_error_list = []
+        self.loss_stats = RunningStats()
 
-    def step(self, states, actions, rewards, next_states, dones):
+    def step(self, states, actions, rewards, next_states, dones, valid=None, rollout=0):
         """Save experience in replay memory, and use random sample from buffer to learn."""
         # Save experience / reward
-        self.memory.add(states, actions, rewards, next_states, dones)
+        # (the critics learn from the joint transition - it is stored only if the transition of every car is valid)
+        if valid is None or np.all(valid):
+            self.memory.add(states, actions, rewards, next_states, dones)
 
         # Learn, if enough samples are available in memory
         # in order to add some stability to the learning, we don't modify weights every turn.
@@ -85,9 +96,21 @@ class Agent(AgentABC):
                 if len(self.memory) > 1000:
                     experiences = self.memory.sample()
                     self.learn(experiences)
-                    self.debug_loss = np.mean(self.mse_error_list)
             self.update_target_networks()
 
+    def add_experiences(self, states, actions, rewards, next_states, dones, aligned=True):
+        """ see abstract class """
+        if not aligned:
+            # the critics learn from the joint state, the cars of an experience must be from the same time
+            print('maddpg needs the experiences of all the cars recorded together')
+            raise ValueError
+        self.memory.add_batch(states, actions, rewards, next_states, dones)
+
+    def update(self):
+        """ see abstract class """
+        self.learn(self.memory.sample())
+        self.update_target_networks()
+
     def act(self, state, add_noise=True):
         """Returns actions for given state as per current policy."""
         state = torch.from_numpy(state).float().to(device)
@@ -105,7 +128,7 @@ class Agent(AgentABC):
         """ see abstract class """
         super().reset()
         self.noise.reset()
-        self.mse_error_list = []
+        self.loss_stats.reset()
 
     def learn(self, experiences):
         """Update policy and value parameters using given batch of experience tuples.
@@ -124,32 +147,36 @@ class Agent(AgentABC):
         actions_concated = actions_batched.view([BATCH_SIZE, self.num_agents * self.action_size])
 
         for agent in range(self.num_agents):
-            actions_next_batched = [self.actors_target[i](next_states_batched[:, i, :]) for i in
-                                    range(self.num_agents)]
-            actions_next_whole = torch.cat(actions_next_batched, 1)
-            # ---------------------------- update critic ---------------------------- #
-            # Get predicted next-state actions and Q values from target models
-            q_targets_next = self.critics_target[agent](next_states_concated, actions_next_whole)
-            # Compute Q targets for current states (y_i)
-            q_targets = rewards[:, agent].view(BATCH_SIZE, -1) + (
-                    GAMMA * q_targets_next * (1 - dones[:, agent].view(BATCH_SIZE, -1)))
-            # Compute critic loss
-            q_expected = self.critics_local[agent](states_concated, actions_concated)
-            critic_loss = F.mse_loss(q_expected, q_targets)
+            with learn_autocast(device, MIXED_PRECISION):
+                actions_next_batched = [self.actors_target[i](next_states_batched[:, i, :]) for i in
+                                        range(self.num_agents)]
+                actions_next_whole = torch.cat(actions_next_batched, 1)
+                # ---------------------------- update critic ---------------------------- #
+                # Get predicted next-state actions and Q values from target models
+                q_targets_next = self.critics_target[agent](next_states_concated, actions_next_whole).float()
+                # Compute Q targets for current states (y_i)
+                q_targets = rewards[:, agent].view(BATCH_SIZE, -1) + (
+                        GAMMA * q_targets_next * (1 - dones[:, agent].view(BATCH_SIZE, -1)))
+                # Compute critic loss (in float32)
+                q_expected = self.critics_local[agent](states_concated, actions_concated).float()
+                critic_loss = F.mse_loss(q_expected, q_targets)
             # Minimize the loss
             self.critic_optimizers[agent].zero_grad()
             critic_loss.backward()
             self.critic_optimizers[agent].step()
             # save the error for statistics
-            self.mse_error_list.append(critic_loss.detach().cpu().numpy())
+            self.loss_stats.add('critic_loss', critic_loss)
+            self.loss_stats.add('q_value', q_expected.mean())
 
             # ---------------------------- update actor ---------------------------- #
-            action_i = self.actors_local[agent](states_batched[:, agent, :])
-            actions_pred = actions_batched.clone()
-            actions_pred[:, agent, :] = action_i
-            actions_pred_whole = actions_pred.view(BATCH_SIZE, -1)
-            # Compute actor loss
-            actor_loss = -self.critics_local[agent](states_concated, actions_pred_whole).mean()
+            with learn_autocast(device, MIXED_PRECISION):
+                action_i = self.actors_local[agent](states_batched[:, agent, :])
+                actions_pred = actions_batched.clone()
+                actions_pred[:, agent, :] = action_i.float()
+                actions_pred_whole = actions_pred.view(BATCH_SIZE, -1)
+                # Compute actor loss
+                actor_loss = -self.critics_local[agent](states_concated, actions_pred_whole).float().mean()
+            self.loss_stats.add('actor_loss', actor_loss)
             # Minimize the loss
             self.actor_optimizers[agent].zero_grad()
             actor_loss.backward()
@@ -175,22 +202,65 @@ class Agent(AgentABC):
         for target_param, local_param in zip(target_model.parameters(), local_model.parameters()):
             target_param.data.copy_(tau * local_param.data + (1.0 - tau) * target_param.data)
 
+    def episode_stats(self):
+        """ see abstract class """
+        return self.loss_stats.means()
+
+    def actors(self):
+        """ see abstract class """
+        return self.actors_local
+
+    def networks(self):
+        """ see abstract class """
+        networks = {}
+        for agent in range(self.num_agents):
+            networks['actor_' + str(agent)] = (self.actors_local[agent], self.actors_target[agent])
+            networks['critic_' + str(agent)] = (self.critics_local[agent], self.critics_target[agent])
+        return networks
+
+    def optimizers(self):
+        """ see abstract class """
+        optimizers = {}
+        for agent in range(self.num_agents):
+            optimizers['actor_' + str(agent)] = self.actor_optimizers[agent]
+            optimizers['critic_' + str(agent)] = self.critic_optimizers[agent]
+        return optimizers
+
+    def replay_buffers(self):
+        """ see abstract class """
+        return [self.memory]
+
+    def training_state(self):
+        """ see abstract class """
+        return {'step_count': self.step_count, 'noise': self.noise.state_dict()}
+
+    def load_training_state(self, state):
+        """ see abstract class """
+        self.step_count = state['step_count']
+        self.noise.load_state_dict(state['noise'])
+
     def load_weights(self, directory_path):
         """ see abstract class """
         super().load_weights(directory_path)
+        if has_bundle(directory_path):
+            # memory mapped: the tensors are copied straight from the page cache into the networks
+            load_bundle(self, directory_path, map_location=device, mmap=True)
+            return
         actor_weights = os.path.join(directory_path, an_filename)
         critic_weights = os.path.join(directory_path, cn_filename)
         for agent in range(self.num_agents):
-            self.actors_target[agent].load_state_dict(torch.load(actor_weights + "_" + str(agent), map_location=device))
-            self.critics_target[agent].load_state_dict(
-                torch.load(critic_weights + "_" + str(agent), map_location=device))
-            self.actors_local[agent].load_state_dict(torch.load(actor_weights + "_" + str(agent), map_location=device))
-            self.critics_local[agent].load_state_dict(
-                torch.load(critic_weights + "_" + str(agent), map_location=device))
+            # each file is read once, and copied into both the local and the target network
+            actor_state = torch.load(actor_weights + "_" + str(agent), map_location=device)
+            critic_state = torch.load(critic_weights + "_" + str(agent), map_location=device)
+            self.actors_target[agent].load_state_dict(actor_state)
+            self.critics_target[agent].load_state_dict(critic_state)
+            self.actors_local[agent].load_state_dict(actor_state)
+            self.critics_local[agent].load_state_dict(critic_state)
 
     def save_weights(self, directory_path):
         """ see abstract class """
         super().save_weights(directory_path)
+        remove_bundle(directory_path)
         actor_weights = os.path.join(directory_path, an_filename)
         critic_weights = os.path.join(directory_path, cn_filename)
         for agent in range(self.num_agents):
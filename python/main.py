@@ -1,9 +1,23 @@
 import argparse
 from test import test_wrapper
 from train import train_wrapper
+from evaluate import evaluate_wrapper
+from serve import serve_wrapper
+from offline import offline_wrapper
+from utils.checkpoint import convert_wrapper
+from export import export_wrapper
+from distill import distill_wrapper
+from autotune import autotune_wrapper
+from sweep import sweep_wrapper
+from ensemble import ensemble_wrapper
+from distributed.learner import learner_wrapper
+from distributed.worker import worker_wrapper
+from distributed.shared_weights import weights_benchmark_wrapper
+from utils.env_daemon import env_daemon_wrapper
 from ddpg.ddpg_agent import Agent as DDPGAgent
 from ddpg.multi_ddpg_agent import Agent as MDDPGAgent
 from maddpg.maddpg_agent import Agent as MADDPGAgent
+from student.student_agent import Agent as StudentAgent
 from agent import AgentABC
 
 
@@ -21,72 +35,473 @@ def select_agent(agent_type: str) -> type(AgentABC):
         agent = MDDPGAgent
     elif agent_type == 'maddpg':
         agent = MADDPGAgent
+    elif agent_type == 'student':
+        agent = StudentAgent
     else:
         agent = None
     return agent
 
 
+def agent_parser(agents, agent_help='type of agent'):
+    """ :return: parser of the agent and environment options, shared by all running modes """
+    a_parser = argparse.ArgumentParser(add_help=False)
+    a_parser.add_argument('--agent', choices=agents, required=True, help=agent_help)
+    a_parser.add_argument('--num-agents', choices=range(1, 9), default=4, type=int, metavar='[1-8]',
+                          help='number of agents (cars)')
+    a_parser.add_argument('--num-obstacles', choices=range(0, 17), default=4, type=int, metavar='[0-16]',
+                          help='number of random obstacles')
+    return a_parser
+
+
 def main():
+    # agent and environment options, shared by all running modes
+    a_parser = agent_parser(['ddpg', 'mddpg', 'maddpg'])
+    # test and evaluate also run the student - it is not trained by reinforcement learning, it only acts
+    acting_parser = agent_parser(['ddpg', 'mddpg', 'maddpg', 'student'],
+                                 'type of agent (student: an actor distilled by the distill mode)')
     # required for test and train:
     # parsed by the main parser - this group is shared
     g_parser = argparse.ArgumentParser(add_help=False)
     g_parser.add_argument('--num-episodes', type=int,
                           help='number of running episodes (default is 1000 for train, and 5 for test')
     g_parser.add_argument('--build', default=None, type=str, required=True,
-                          help='path of the unity build file, to run inside Unity - enter None')
+                          help='path of the unity build file, to run inside Unity - enter None,'
+                               ' to run the stand-in environment - enter stand-in, to lease an environment of a'
+                               ' running env-daemon - enter env-daemon[:host:port][/name]')
     g_parser.add_argument('--weights-path', type=str, required=True,
                           help='path to weights dir')
-    g_parser.add_argument('--agent', choices=['ddpg', 'mddpg', 'maddpg'], required=True,
-                          help='type of agent')
-    g_parser.add_argument('--num-agents', choices=range(1, 9), default=4, type=int, metavar='[1-8]',
-                          help='number of agents (cars)')
-    g_parser.add_argument('--num-obstacles', choices=range(0, 17), default=4, type=int, metavar='[0-16]',
-                          help='number of random obstacles')
+    g_parser.add_argument('--action-repeat', default=1, type=int,
+                          help='hold every action for # environment frames, one transition per action (default=1)')
+    g_parser.add_argument('--continuous', action='store_true',
+                          help='do not reset the environment when a car is done, the car starts over on its own while'
+                               ' the others keep driving (an episode = num-agents car episodes)')
+    g_parser.add_argument('--record-path', default=None, type=str,
+                          help='record the steps of the episodes (observations, actions, rewards, dones) into this'
+                               ' dir, as compressed column chunks (default is no recording)')
     # general group end
+    # training options, shared by train and learner
+    t_parser = argparse.ArgumentParser(add_help=False)
+    t_parser.add_argument('--save-mem', action='store_true',
+                          help='save the replay buffer during training for later use', )
+    t_parser.add_argument('--scores-avg-window', choices=range(0, 101), metavar='[0-100]', default=50, type=int,
+                          help='number of last scores to average')
+    t_parser.add_argument('--load-weights', action='store_true',
+                          help='add this to load weights from previous runs')
+    t_parser.add_argument('--load-mem', action='store_true',
+                          help='add this to load replay buffer from previous run')
+    t_parser.add_argument('--mem-path', type=str,
+                          help='path of replay buffer file to load or store')
+    t_parser.add_argument('--solved-score', default=40, type=int,
+                          help='score that complete the episode')
+    t_parser.add_argument('--print-agent-loss', action='store_true',
+                          help='print agent\'s loss after each episode (default=False)')
+    t_parser.add_argument('--save-best-weights', action='store_true',
+                          help='save the best weights so far (by average score). saving directory will be the'
+                               ' same as weights-path with suffix \'best\' default=False')
+    t_parser.add_argument('--save-score-log', action='store_true',
+                          help='saves a csv file with the ongoing scores of each episode (default=False)')
+    t_parser.add_argument('--weights-format', choices=['files', 'bundle'], default='files',
+                          help='save the weights as one file per network (files) or as a single checkpoint file'
+                               ' with every network and metadata (bundle). default=files')
+    t_parser.add_argument('--memory-budget', type=str,
+                          help='memory for the agent, e.g. 4G or 512M. the replay buffers are made smaller if they'
+                               ' would not fit (default=no budget)')
+    t_parser.add_argument('--print-memory-usage', action='store_true',
+                          help='print the memory used by replay buffers, networks and optimizers after each episode')
+    t_parser.add_argument('--hparams', type=str,
+                          help='json string or file overriding agent hyperparameters, e.g. {"BATCH_SIZE": 256}')
+    t_parser.add_argument('--demo-path', type=str,
+                          help='ml-agents .demo file or dir of .demo files to pre-fill the replay buffer with')
+    # training options end
     parser = argparse.ArgumentParser(prog='RL_Multi_agent_Cars',
-                                     description='please choose train or test to get specific help'
+                                     description='please choose a running mode to get specific help'
                                                  ' (e.g main.py train -h)')
-    subparsers = parser.add_subparsers(help='two available running modes', dest='subparser_name')
+    subparsers = parser.add_subparsers(help='available running modes', dest='subparser_name')
     # define new sub-command
-    subparsers.add_parser('test', help='run test mode', parents=[g_parser])
+    test_parser = subparsers.add_parser('test', help='run test mode', parents=[acting_parser, g_parser])
+    test_parser.add_argument('--runtime', default='torch', choices=['torch', 'numpy'],
+                             help='evaluate the actors with pytorch or with numpy (default=torch)')
+    test_parser.add_argument('--hparams', type=str,
+                             help='json string or file with the agent constants the weights were trained with, e.g.'
+                                  ' {"FRAME_HISTORY": 4}')
     # required for train only:
     # parse by the train command sub-parser
-    train_parser = subparsers.add_parser('train', help='run train mode', parents=[g_parser])
-
-    train_parser.add_argument('--save-mem', action='store_true',
-                              help='save the replay buffer during training for later use', )
-    train_parser.add_argument('--scores-avg-window', choices=range(0, 101), metavar='[0-100]', default=50, type=int,
-                              help='number of last scores to average')
-    train_parser.add_argument('--load-weights', action='store_true',
-                              help='add this to load weights from previous runs')
-    train_parser.add_argument('--load-mem', action='store_true',
-                              help='add this to load replay buffer from previous run')
-    train_parser.add_argument('--mem-path', type=str,
-                              help='path of replay buffer file to load or store')
-    train_parser.add_argument('--solved-score', default=40, type=int,
-                              help='score that complete the episode')
+    train_parser = subparsers.add_parser('train', help='run train mode', parents=[a_parser, g_parser, t_parser])
     train_parser.add_argument('--show-graphics', action='store_true',
                               help='add this to show graphics (slows down training)')
-    train_parser.add_argument('--print-agent-loss', action='store_true',
-                              help='print agent\'s loss after each episode (default=False)')
-    train_parser.add_argument('--save-best-weights', action='store_true',
-                              help='save the best weights so far (by average score). saving directory will be the'
-                                   ' same as weights-path with suffix \'best\' default=False')
-    train_parser.add_argument('--save-score-log', action='store_true',
-                              help='saves a csv file with the ongoing scores of each episode (default=False)')
+    train_parser.add_argument('--eval-every', default=0, type=int,
+                              help='evaluate the agent without noise every # episodes in a background process with'
+                                   ' its own environment, and pick the best weights by these scores (default=0, off)')
+    train_parser.add_argument('--eval-episodes', default=5, type=int,
+                              help='number of episodes of every evaluation (default=5)')
+    train_parser.add_argument('--eval-worker-id', type=int,
+                              help='unity worker id of the evaluation environment (default is --worker-id + 1)')
+    train_parser.add_argument('--worker-id', default=0, type=int,
+                              help='unity worker id, must be different for every run on the same host (default=0)')
+    train_parser.add_argument('--env-step-timeout', type=float,
+                              help='run the environment supervised: a step taking longer than # seconds, a crash or'
+                                   ' a dead player restart it on a new worker id and the training goes on'
+                                   ' (default is no supervision)')
+    train_parser.add_argument('--env-reset-timeout', default=120.0, type=float,
+                              help='seconds the launch or a reset of a supervised environment may take (default=120)')
+    train_parser.add_argument('--max-env-restarts', default=10, type=int,
+                              help='restarts of a supervised environment before the run stops (default=10)')
+    train_parser.add_argument('--checkpoint-every', default=0, type=int,
+                              help='save the full training state (networks, optimizers, noise, random generators,'
+                                   ' episode and scores) with the replay buffer in --mem-path every # episodes and at'
+                                   ' the end (default=0, off)')
+    train_parser.add_argument('--resume', action='store_true',
+                              help='continue the training saved in --mem-path by --checkpoint-every from its next'
+                                   ' episode')
+
+    # several seeds trained together in one process
+    ensemble_parser = subparsers.add_parser('ensemble', help='train one ddpg agent per seed in one process',
+                                            parents=[a_parser, t_parser])
+    ensemble_parser.add_argument('--seeds', default=[0, 1, 2, 3], type=int, nargs='+',
+                                 help='random seed of every agent (default=0 1 2 3)')
+    ensemble_parser.add_argument('--num-episodes', default=1000, type=int,
+                                 help='number of episodes of every seed (default=1000)')
+    ensemble_parser.add_argument('--build', default=None, type=str, required=True,
+                                 help='path of the unity build file, to run inside Unity - enter None,'
+                                      ' to run the stand-in environment - enter stand-in')
+    ensemble_parser.add_argument('--weights-path', type=str, required=True,
+                                 help='path to weights dir, every seed uses the sub dir seed_{seed}')
+    ensemble_parser.add_argument('--action-repeat', default=1, type=int,
+                                 help='hold every action for # environment frames (default=1)')
+    ensemble_parser.add_argument('--show-graphics', action='store_true',
+                                 help='add this to show graphics (slows down training)')
+    ensemble_parser.add_argument('--worker-id', default=0, type=int,
+                                 help='unity worker id of the environment of the first seed, the others follow'
+                                      ' (default=0)')
+
+    # hyperparameter sweep: many train runs at once
+    sweep_parser = subparsers.add_parser('sweep', help='run a hyperparameter sweep of train runs',
+                                         parents=[a_parser, g_parser, t_parser])
+    sweep_parser.add_argument('--search-space', type=str, required=True,
+                              help='json string or file mapping hyperparameters to a list of values or to'
+                                   ' {"choice": [...]}, {"uniform": [low, high]} or {"log_uniform": [low, high]}')
+    sweep_parser.add_argument('--search', choices=['grid', 'random'], default='grid',
+                              help='grid search over the lists, or random samples of the search space (default=grid)')
+    sweep_parser.add_argument('--num-trials', default=8, type=int,
+                              help='number of runs in random search (default=8)')
+    sweep_parser.add_argument('--threads-per-job', default=1, type=int,
+                              help='cores (torch threads) given to every run (default=1)')
+    sweep_parser.add_argument('--max-parallel', type=int,
+                              help='maximal number of runs at once (default is number of cores / threads per job)')
+    sweep_parser.add_argument('--base-worker-id', default=0, type=int,
+                              help='unity worker id of the first run slot, the others follow (default=0)')
+    sweep_parser.add_argument('--halving-episodes', default=50, type=int,
+                              help='episodes until the first successive halving rung (default=50)')
+    sweep_parser.add_argument('--halving-rate', default=2, type=int,
+                              help='only the top 1/rate of the runs at every rung continue, rungs are rate times'
+                                   ' further apart (default=2)')
+
+    # evaluation of many checkpoints at once
+    evaluate_parser = subparsers.add_parser('evaluate', help='evaluate and rank several weights directories',
+                                            parents=[acting_parser])
+    evaluate_parser.add_argument('--build', default=None, type=str, required=True,
+                                 help='path of the unity build file, to run inside Unity - enter None,'
+                                      ' to run the stand-in environment - enter stand-in')
+    evaluate_parser.add_argument('--weights-paths', type=str, nargs='+', required=True,
+                                 help='weights dirs to evaluate')
+    evaluate_parser.add_argument('--num-episodes', default=20, type=int,
+                                 help='maximal number of episodes for every weights dir (default=20)')
+    evaluate_parser.add_argument('--min-episodes', default=5, type=int,
+                                 help='episodes before a weights dir that is clearly worse is stopped (default=5)')
+    evaluate_parser.add_argument('--confidence', default=0.95, type=float,
+                                 help='confidence level of the intervals (default=0.95)')
+    evaluate_parser.add_argument('--num-workers', type=int,
+                                 help='number of environments running at once (default is number of cores)')
+    evaluate_parser.add_argument('--base-worker-id', default=0, type=int,
+                                 help='unity worker id of the first environment, the others follow (default=0)')
+    evaluate_parser.add_argument('--results-file', type=str,
+                                 help='save the ranked table to this csv file')
+    evaluate_parser.add_argument('--hparams', type=str,
+                                 help='json string or file with the agent constants the weights were trained with,'
+                                      ' e.g. {"FRAME_HISTORY": 4}')
+
+    # local inference server
+    serve_parser = subparsers.add_parser('serve', help='serve a trained policy to game instances over http',
+                                         parents=[a_parser])
+    serve_parser.add_argument('--weights-path', type=str, required=True,
+                              help='path to weights dir (reloaded when it changes)')
+    serve_parser.add_argument('--state-size', default=46, type=int,
+                              help='size of the observation of one car (default=46)')
+    serve_parser.add_argument('--action-size', default=2, type=int,
+                              help='size of the action of one car (default=2)')
+    serve_parser.add_argument('--host', default='127.0.0.1', type=str,
+                              help='address to listen on (default=127.0.0.1)')
+    serve_parser.add_argument('--port', default=8000, type=int,
+                              help='port to listen on (default=8000)')
+    serve_parser.add_argument('--max-batch', default=64, type=int,
+                              help='maximal number of requests in one forward pass (default=64)')
+    serve_parser.add_argument('--latency-budget', default=2.0, type=float,
+                              help='milliseconds a request may wait for others to share its forward pass'
+                                   ' (default=2)')
+    serve_parser.add_argument('--reload-interval', default=5.0, type=float,
+                              help='seconds between checks of the weights dir for new weights (default=5)')
+    serve_parser.add_argument('--metrics-interval', default=30.0, type=float,
+                              help='seconds between metrics prints, 0 to disable (default=30)')
+    serve_parser.add_argument('--runtime', default='torch', choices=['torch', 'numpy'],
+                              help='evaluate the actors with pytorch or with numpy (default=torch)')
+    serve_parser.add_argument('--hparams', type=str,
+                              help='json string or file with the agent constants the weights were trained with, e.g.'
+                                   ' {"FRAME_HISTORY": 4} (the clients then send the last 4 observations of every'
+                                   ' car, oldest first)')
+
+    # learner only training from a saved replay buffer
+    offline_parser = subparsers.add_parser('offline', help='learn from a saved replay buffer, without environment',
+                                           parents=[a_parser])
+    offline_parser.add_argument('--mem-path', type=str, required=True,
+                                help='path of the replay buffer saved with --save-mem')
+    offline_parser.add_argument('--weights-path', type=str, required=True,
+                                help='path to weights dir (saved to, and loaded from with --load-weights)')
+    offline_parser.add_argument('--load-weights', action='store_true',
+                                help='add this to start from the weights in --weights-path')
+    offline_parser.add_argument('--num-updates', default=10000, type=int,
+                                help='number of learning updates (default=10000)')
+    offline_parser.add_argument('--checkpoint-every', default=1000, type=int,
+                                help='save the weights every # updates, 0 to save only at the end (default=1000)')
+    offline_parser.add_argument('--report-every', default=100, type=int,
+                                help='print updates/sec and loss every # updates (default=100)')
+    offline_parser.add_argument('--weights-format', choices=['files', 'bundle'], default='files',
+                                help='layout of the saved weights (default=files)')
+    offline_parser.add_argument('--hparams', type=str,
+                                help='json string or file overriding agent hyperparameters, e.g. {"BATCH_SIZE": 256}')
+    offline_parser.add_argument('--num-processes', default=1, type=int,
+                                help='data parallel learner processes, each learns from BATCH_SIZE / # experiences '
+                                     'per update and the gradients are averaged (default=1)')
+    offline_parser.add_argument('--scaling-benchmark', type=int, nargs='+',
+                                help='measure the updates/sec with each given number of processes, e.g. 1 2 4 '
+                                     '(nothing is saved)')
+    offline_parser.add_argument('--precision-benchmark', action='store_true',
+                                help='compare float32 and bfloat16 mixed precision updates (MIXED_PRECISION) on the'
+                                     ' same seed: updates/sec and critic loss every --report-every updates (only the'
+                                     ' loss curves are saved, to {weights-path}/Precision_Benchmark.csv)')
+    offline_parser.add_argument('--state-size', default=46, type=int,
+                                help='size of the observation of one car (default=46)')
+    offline_parser.add_argument('--action-size', default=2, type=int,
+                                help='size of the action of one car (default=2)')
+
+    # throughput autotuning of the training step
+    autotune_parser = subparsers.add_parser('autotune', help='find the fastest batch size, threads and update cadence',
+                                            parents=[a_parser])
+    autotune_parser.add_argument('--batch-sizes', default=[64, 128, 256, 512], type=int, nargs='+',
+                                 help='BATCH_SIZE values to try (default=64 128 256 512)')
+    autotune_parser.add_argument('--threads', type=int, nargs='+',
+                                 help='torch thread counts to try (default: powers of 2 up to the number of cores)')
+    autotune_parser.add_argument('--updates-per-step', default=[0.5, 1, 2], type=float, nargs='+',
+                                 help='learning updates per env step to try, sets UPDATE_EVERY and NUM_UPDATES'
+                                      ' (default=0.5 1 2)')
+    autotune_parser.add_argument('--trial-seconds', default=2.0, type=float,
+                                 help='timed seconds of every configuration (default=2)')
+    autotune_parser.add_argument('--output', default='autotune.json', type=str,
+                                 help='hyperparameters file of the fastest configuration, for train --hparams'
+                                      ' (default=autotune.json)')
+    autotune_parser.add_argument('--state-size', default=46, type=int,
+                                 help='size of the observation of one car (default=46)')
+    autotune_parser.add_argument('--action-size', default=2, type=int,
+                                 help='size of the action of one car (default=2)')
+
+    # export of the actors for inference inside unity
+    export_parser = subparsers.add_parser('export', help='export the actors of a weights dir to onnx',
+                                          parents=[a_parser])
+    export_parser.add_argument('--weights-path', type=str, required=True,
+                               help='weights dir to export')
+    export_parser.add_argument('--output-path', type=str,
+                               help='dir of the exported files (default is {weights-path}/onnx for onnx and'
+                                    ' {weights-path} for numpy)')
+    export_parser.add_argument('--format', default='onnx', choices=['onnx', 'numpy'],
+                               help='onnx graphs (unity) or one numpy array file (test / serve --runtime numpy)'
+                                    ' (default=onnx)')
+    export_parser.add_argument('--observations-path', type=str,
+                               help='.demo file / dir or replay buffer dir with the observations of the parity check'
+                                    ' (default: episodes of the stand-in environment)')
+    export_parser.add_argument('--num-observations', default=1000, type=int,
+                               help='number of observations in the parity check (default=1000)')
+    export_parser.add_argument('--tolerance', default=1e-5, type=float,
+                               help='largest allowed difference between the onnx and pytorch actions (default=1e-5)')
+    export_parser.add_argument('--opset', default=9, type=int,
+                               help='onnx opset version (default=9)')
+    export_parser.add_argument('--state-size', default=46, type=int,
+                               help='size of the observation of one car (default=46)')
+    export_parser.add_argument('--action-size', default=2, type=int,
+                               help='size of the action of one car (default=2)')
+    export_parser.add_argument('--hparams', type=str,
+                               help='json string or file with the agent constants the weights were trained with, e.g.'
+                                    ' {"FRAME_HISTORY": 4}')
+
+    # distillation of the actors of an agent into one small student actor
+    distill_parser = subparsers.add_parser('distill', help='distill the actors of a weights dir into one student actor'
+                                                           ' (test --agent student)', parents=[a_parser])
+    distill_parser.add_argument('--weights-path', type=str, required=True,
+                                help='weights dir of the teacher agent (--agent)')
+    distill_parser.add_argument('--output-path', type=str,
+                                help='weights dir of the student (default is {weights-path}/student)')
+    distill_parser.add_argument('--observations-path', type=str,
+                                help='.demo file / dir or replay buffer dir with the observations to imitate the'
+                                     ' teachers on (default: episodes of the stand-in environment)')
+    distill_parser.add_argument('--num-observations', default=20000, type=int,
+                                help='number of observations, 10%% of them are held out to measure the action error'
+                                     ' (default=20000)')
+    distill_parser.add_argument('--no-agent-index', action='store_true',
+                                help='one policy for all the cars, instead of a student conditioned on the index of'
+                                     ' the car')
+    distill_parser.add_argument('--fc1-units', default=64, type=int,
+                                help='nodes of the first hidden layer of the student (default=64)')
+    distill_parser.add_argument('--fc2-units', default=64, type=int,
+                                help='nodes of the second hidden layer of the student (default=64)')
+    distill_parser.add_argument('--num-updates', default=5000, type=int,
+                                help='number of learning updates (default=5000)')
+    distill_parser.add_argument('--batch-size', default=256, type=int,
+                                help='(observation, teacher) pairs per update (default=256)')
+    distill_parser.add_argument('--lr', default=1e-3, type=float,
+                                help='learning rate of the student (default=1e-3)')
+    distill_parser.add_argument('--report-every', default=500, type=int,
+                                help='print the loss and the held out action error every # updates (default=500)')
+    distill_parser.add_argument('--seed', default=0, type=int,
+                                help='random seed of the student and of the sampling (default=0)')
+    distill_parser.add_argument('--hparams', type=str,
+                                help='json string or file with the agent constants the teacher was trained with')
+    distill_parser.add_argument('--state-size', default=46, type=int,
+                                help='size of the observation of one car (default=46)')
+    distill_parser.add_argument('--action-size', default=2, type=int,
+                                help='size of the action of one car (default=2)')
+
+    # conversion of weights dirs to single file checkpoints
+    convert_parser = subparsers.add_parser('convert-weights',
+                                           help='convert a weights dir into a single checkpoint file',
+                                           parents=[a_parser])
+    convert_parser.add_argument('--weights-path', type=str, required=True,
+                                help='weights dir to convert')
+    convert_parser.add_argument('--output-path', type=str,
+                                help='dir of the checkpoint file (default is the weights dir itself)')
+    convert_parser.add_argument('--state-size', default=46, type=int,
+                                help='size of the observation of one car (default=46)')
+    convert_parser.add_argument('--action-size', default=2, type=int,
+                                help='size of the action of one car (default=2)')
+
+    # distributed training: one learner and any number of rollout workers
+    learner_parser = subparsers.add_parser('learner', help='run the central learner of distributed training',
+                                           parents=[a_parser, t_parser])
+    learner_parser.add_argument('--weights-path', type=str, required=True,
+                                help='path to weights dir')
+    learner_parser.add_argument('--num-episodes', type=int,
+                                help='number of episodes, summed over all workers (default is 1000)')
+    learner_parser.add_argument('--host', default='0.0.0.0', type=str,
+                                help='address to listen on for workers (default=0.0.0.0)')
+    learner_parser.add_argument('--port', default=6000, type=int,
+                                help='port to listen on for workers (default=6000)')
+    learner_parser.add_argument('--sync-every', default=200, type=int,
+                                help='push actor weights to the workers every # learned env steps (default=200)')
+    learner_parser.add_argument('--shared-weights', action='store_true',
+                                help='also publish the actor weights in shared memory, for workers on this host')
+    worker_parser = subparsers.add_parser('worker', help='run a rollout worker of distributed training',
+                                          parents=[a_parser])
+    worker_parser.add_argument('--build', default=None, type=str, required=True,
+                               help='path of the unity build file, to run inside Unity - enter None,'
+                                    ' to run the stand-in environment - enter stand-in')
+    worker_parser.add_argument('--learner-host', default='localhost', type=str,
+                               help='address of the learner (default=localhost)')
+    worker_parser.add_argument('--learner-port', default=6000, type=int,
+                               help='port of the learner (default=6000)')
+    worker_parser.add_argument('--worker-id', default=0, type=int,
+                               help='unity worker id, must be different for every worker on the same host')
+    worker_parser.add_argument('--hparams', type=str,
+                               help='json string or file with the agent constants of the learner that change the'
+                                    ' actors, e.g. {"FRAME_HISTORY": 4} (the same --hparams as the learner)')
+    worker_parser.add_argument('--batch-steps', default=50, type=int,
+                               help='number of env steps sent to the learner in one message (default=50)')
+    worker_parser.add_argument('--show-graphics', action='store_true',
+                               help='add this to show graphics (slows down rollouts)')
+    worker_parser.add_argument('--shared-weights', action='store_true',
+                               help='read the actor weights from the shared memory of a learner on this host'
+                                    ' (learner --shared-weights), instead of receiving them over tcp')
+
+    # latency of handing the actor weights to other processes
+    weights_benchmark_parser = subparsers.add_parser('benchmark-weights', parents=[a_parser],
+                                                     help='time the actor weights broadcast (pickle, tcp payload,'
+                                                          ' shared memory)')
+    weights_benchmark_parser.add_argument('--num-readers', default=2, type=int,
+                                          help='reader processes refreshing while the weights are published'
+                                               ' (default=2)')
+    weights_benchmark_parser.add_argument('--trial-seconds', default=2.0, type=float,
+                                          help='timed seconds of every measurement (default=2)')
+    weights_benchmark_parser.add_argument('--publish-interval', default=0.01, type=float,
+                                          help='seconds between the publications while the readers refresh'
+                                               ' (default=0.01)')
+    weights_benchmark_parser.add_argument('--state-size', default=46, type=int,
+                                          help='size of the observation of one car (default=46)')
+    weights_benchmark_parser.add_argument('--action-size', default=2, type=int,
+                                          help='size of the action of one car (default=2)')
+
+    # long lived pool of environments, leased by the runs with --build env-daemon[:host:port][/name]
+    env_daemon_parser = subparsers.add_parser('env-daemon', help='keep a pool of launched environments for the runs'
+                                                                 ' to lease (--build env-daemon:host:port/name)')
+    env_daemon_parser.add_argument('--build', default=None, type=str, required=True,
+                                   help='path of the unity build file, to run the stand-in environment - enter'
+                                        ' stand-in')
+    env_daemon_parser.add_argument('--pool-size', default=1, type=int,
+                                   help='number of environments, named env0, env1, ... (default=1)')
+    env_daemon_parser.add_argument('--names', type=str, nargs='+',
+                                   help='names of the environments (instead of --pool-size)')
+    env_daemon_parser.add_argument('--host', default='127.0.0.1', type=str,
+                                   help='address to listen on (default=127.0.0.1)')
+    env_daemon_parser.add_argument('--port', default=7000, type=int,
+                                   help='port to listen on (default=7000)')
+    env_daemon_parser.add_argument('--base-worker-id', default=0, type=int,
+                                   help='unity worker id of the first environment, the others follow (default=0)')
+    env_daemon_parser.add_argument('--show-graphics', action='store_true',
+                                   help='add this to show graphics')
+    env_daemon_parser.add_argument('--env-step-timeout', default=60.0, type=float,
+                                   help='a step taking longer than # seconds, a crash or a dead player restart the'
+                                        ' environment (default=60)')
+    env_daemon_parser.add_argument('--env-reset-timeout', default=120.0, type=float,
+                                   help='seconds the launch or a reset of an environment may take (default=120)')
+    env_daemon_parser.add_argument('--max-env-restarts', default=10, type=int,
+                                   help='restarts of an environment before it is removed from the pool'
+                                        ' (default=10)')
     args = parser.parse_args()
-    if args.num_episodes is None:
-        args.num_episodes = 1000 if args.subparser_name == 'train' else 5
+    if getattr(args, 'num_episodes', 0) is None:
+        args.num_episodes = 5 if args.subparser_name == 'test' else 1000
 
-    env_config = {'num_agents': args.num_agents,
-                  'num_obstacles': args.num_obstacles,
+    # (the env-daemon mode has no agent, its runs bring their own env_config)
+    env_config = {'num_agents': getattr(args, 'num_agents', None),
+                  'num_obstacles': getattr(args, 'num_obstacles', None),
                   'setting': 0
                   }
     wrapper_config = vars(args)
-    wrapper_config['agent'] = select_agent(wrapper_config['agent'])
+    if 'agent' in wrapper_config:
+        wrapper_config['agent'] = select_agent(wrapper_config['agent'])
     print('starting {} with arguments:\n{}'.format(args.subparser_name, wrapper_config))
     if args.subparser_name == 'test':
         test_wrapper(env_config, wrapper_config)
+    elif args.subparser_name == 'learner':
+        learner_wrapper(env_config, wrapper_config)
+    elif args.subparser_name == 'worker':
+        worker_wrapper(env_config, wrapper_config)
+    elif args.subparser_name == 'evaluate':
+        evaluate_wrapper(env_config, wrapper_config)
+    elif args.subparser_name == 'serve':
+        serve_wrapper(env_config, wrapper_config)
+    elif args.subparser_name == 'offline':
+        offline_wrapper(env_config, wrapper_config)
+    elif args.subparser_name == 'convert-weights':
+        convert_wrapper(env_config, wrapper_config)
+    elif args.subparser_name == 'ensemble':
+        ensemble_wrapper(env_config, wrapper_config)
+    elif args.subparser_name == 'autotune':
+        autotune_wrapper(env_config, wrapper_config)
+    elif args.subparser_name == 'benchmark-weights':
+        weights_benchmark_wrapper(env_config, wrapper_config)
+    elif args.subparser_name == 'export':
+        export_wrapper(env_config, wrapper_config)
+    elif args.subparser_name == 'distill':
+        distill_wrapper(env_config, wrapper_config)
+    elif args.subparser_name == 'sweep':
+        sweep_wrapper(env_config, wrapper_config)
+    elif args.subparser_name == 'env-daemon':
+        env_daemon_wrapper(env_config, wrapper_config)
     else:
         train_wrapper(env_config, wrapper_config)
 
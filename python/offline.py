@@ -0,0 +1,250 @@
+###################################
+# Learner-only training from a saved replay buffer (no environment).
+# useful as a pure compute benchmark of learn(), and to pretrain on collected data on hosts without the game.
+# with --num-processes N the updates are data parallel over N cpu processes (see distributed/data_parallel.py).
+# --precision-benchmark compares float32 and bfloat16 mixed precision learning (see utils/mixed_precision.py).
+import multiprocessing
+import os
+import random
+import time
+
+import numpy as np
+import torch
+
+from agent import AgentABC
+from utils.checkpoint import save_checkpoint
+from utils.hyperparameters import read_hyperparameters, apply_hyperparameters, get_hyperparameters
+from utils.loss_stats import format_stats
+from utils.mixed_precision import bf16_supported
+
+
+def _make_agent(env_config, wrapper_config, world_size=1):
+    """ create the agent (hyperparameters applied, weights loaded). with several processes each one learns
+    from BATCH_SIZE / world_size experiences per update """
+    agent_type = wrapper_config['agent']
+    hparams = read_hyperparameters(wrapper_config.get('hparams'))
+    apply_hyperparameters(agent_type, hparams)
+    if world_size > 1:
+        batch_size = get_hyperparameters(agent_type, ['BATCH_SIZE'])['BATCH_SIZE']
+        if batch_size % world_size != 0:
+            print('BATCH_SIZE ({}) must be divisible by the number of processes ({})'.format(batch_size, world_size))
+            raise ValueError
+        apply_hyperparameters(agent_type, {'BATCH_SIZE': batch_size // world_size})
+    agent: AgentABC = agent_type(state_size=wrapper_config['state_size'], action_size=wrapper_config['action_size'],
+                                 num_agents=env_config['num_agents'], random_seed=0)
+    if wrapper_config['load_weights']:
+        agent.load_weights(wrapper_config['weights_path'])
+    return agent
+
+
+def _offline_updates(agent: AgentABC, wrapper_config, rank=0, world_size=1, save=True):
+    """
+    run the learning updates. with several processes, only process 0 prints and saves.
+    :return: updates per second
+    """
+    if world_size > 1:
+        from distributed.data_parallel import average_stats
+    # num_updates (int): number of learning updates
+    num_updates = wrapper_config['num_updates']
+    # checkpoint_every (int): save the weights every # updates (0 - only at the end)
+    checkpoint_every = wrapper_config['checkpoint_every'] if save else 0
+    # report_every (int): print updates/sec and loss every # updates
+    report_every = wrapper_config['report_every']
+    weights_path = wrapper_config['weights_path']
+    weights_format = wrapper_config['weights_format']
+
+    start = time.time()
+    report_start = start
+    for i_update in range(1, num_updates + 1):
+        try:
+            agent.update()
+        except ValueError:
+            # random.sample of a batch larger than the buffer
+            print('\nthe replay buffer has fewer samples than the batch size')
+            raise
+        if i_update % report_every == 0 or i_update == num_updates:
+            now = time.time()
+            updates = report_every if i_update % report_every == 0 else i_update % report_every
+            stats = agent.episode_stats() if world_size == 1 else average_stats(agent.episode_stats())
+            if rank == 0:
+                print('\nUpdate {}\tUpdates/sec: {:.1f}\t{}'.format(
+                    i_update, updates / (now - report_start), format_stats(stats)), end="")
+            # reset clears the per episode loss statistics (an offline "episode" is one report window)
+            agent.reset()
+            report_start = time.time()
+        if rank == 0 and checkpoint_every and i_update % checkpoint_every == 0:
+            save_start = time.time()
+            save_checkpoint(agent, weights_path, weights_format, episode=i_update)
+            # the time of the checkpoint is not part of the updates/sec
+            save_seconds = time.time() - save_start
+            start += save_seconds
+            report_start += save_seconds
+    seconds = time.time() - start
+    updates_per_sec = num_updates / seconds
+    if rank == 0:
+        print('\n{} updates in {:.1f} seconds ({:.1f} updates/sec, without saving)'.format(
+            num_updates, seconds, updates_per_sec))
+        if save:
+            save_checkpoint(agent, weights_path, weights_format, episode=num_updates)
+    return updates_per_sec
+
+
+def _offline_process(rank, world_size, init_method, env_config, wrapper_config, save, results):
+    """ process target - one member of the data parallel group """
+    from distributed.data_parallel import init_data_parallel, make_data_parallel, parameters_checksum
+    import torch.distributed as dist
+    init_data_parallel(rank, world_size, init_method)
+    agent = _make_agent(env_config, wrapper_config, world_size)
+    agent.load_mem(wrapper_config['mem_path'])
+    make_data_parallel(agent, rank, world_size)
+    updates_per_sec = _offline_updates(agent, wrapper_config, rank, world_size, save)
+    low, high = parameters_checksum(agent)
+    if rank == 0:
+        if low != high:
+            print('\nwarning: the weights of the processes differ (checksums {} - {})'.format(low, high))
+        results.put(updates_per_sec)
+    dist.destroy_process_group()
+
+
+def _run_data_parallel(env_config, wrapper_config, world_size, save=True):
+    """ run the updates on world_size processes :return: updates per second (full batch updates) """
+    from distributed.data_parallel import free_init_method
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    init_method = free_init_method()
+    processes = [context.Process(target=_offline_process,
+                                 args=(rank, world_size, init_method, env_config, wrapper_config, save, results))
+                 for rank in range(world_size)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    if any(process.exitcode != 0 for process in processes):
+        print('\na data parallel process failed')
+        raise RuntimeError
+    return results.get()
+
+
+def _precision_run(env_config, wrapper_config, mixed_precision):
+    """
+    run the updates from the same start (weights, replay buffer, random generators) in one precision.
+    :return: (updates per second, mean critic loss of every report window)
+    """
+    random.seed(0)
+    np.random.seed(0)
+    torch.manual_seed(0)
+    agent = _make_agent(env_config, wrapper_config)
+    apply_hyperparameters(wrapper_config['agent'], {'MIXED_PRECISION': mixed_precision})
+    agent.load_mem(wrapper_config['mem_path'])
+    num_updates = wrapper_config['num_updates']
+    report_every = wrapper_config['report_every']
+    critic_losses = []
+    elapsed = 0.0
+    for i_update in range(1, num_updates + 1):
+        start = time.perf_counter()
+        agent.update()
+        elapsed += time.perf_counter() - start
+        if i_update % report_every == 0:
+            critic_losses.append(agent.episode_stats()['critic_loss'])
+            agent.reset()
+    return num_updates / elapsed, critic_losses
+
+
+def precision_benchmark(env_config, wrapper_config):
+    """
+    compare float32 and bfloat16 mixed precision learning on the same seed: updates/sec and the critic loss
+    curves (saved to {weights-path}/Precision_Benchmark.csv). nothing else is saved.
+    """
+    agent_type = wrapper_config['agent']
+    if 'MIXED_PRECISION' not in get_hyperparameters(agent_type, ['MIXED_PRECISION']):
+        print('agent {} has no mixed precision mode'.format(agent_type.__module__))
+        raise TypeError
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")     # the device of the agents
+    if not bf16_supported(device):
+        print('\nwarning: the {} has no native bfloat16 support, mixed precision is expected to be slower'.format(
+            device.type))
+    results = {}
+    for name, mixed_precision in [('float32', False), ('bfloat16', True)]:
+        print('\n{}: {} updates'.format(name, wrapper_config['num_updates']), end="")
+        results[name] = _precision_run(env_config, wrapper_config, mixed_precision)
+    (fp32_rate, fp32_losses), (bf16_rate, bf16_losses) = results['float32'], results['bfloat16']
+    print('\n\nprecision\tupdates/sec\tspeedup')
+    print('float32\t{:.1f}\t1.00'.format(fp32_rate))
+    print('bfloat16\t{:.1f}\t{:.2f}'.format(bf16_rate, bf16_rate / fp32_rate))
+    if fp32_losses:
+        relative = np.abs(np.array(bf16_losses) - fp32_losses) / np.maximum(np.abs(fp32_losses), 1e-12)
+        print('critic loss: float32 {:.5g} -> {:.5g}, bfloat16 {:.5g} -> {:.5g} (first -> last report window),'
+              ' largest relative difference {:.3g}'.format(fp32_losses[0], fp32_losses[-1], bf16_losses[0],
+                                                            bf16_losses[-1], relative.max()))
+        weights_path = wrapper_config['weights_path']
+        if not os.path.isdir(weights_path):
+            os.makedirs(weights_path)
+        updates = np.arange(1, len(fp32_losses) + 1) * wrapper_config['report_every']
+        # noinspection PyTypeChecker
+        np.savetxt(os.path.join(weights_path, 'Precision_Benchmark.csv'),
+                   np.column_stack([updates, fp32_losses, bf16_losses]), delimiter=',',
+                   fmt=['%d', '%.6g', '%.6g'], header='update,critic_loss_float32,critic_loss_bfloat16', comments='')
+
+
+def offline_wrapper(env_config, wrapper_config):
+    """
+    run learning updates on a replay buffer saved with --save-mem.
+    :param env_config: dictionary, the environment parameters (num_agents)
+    :param wrapper_config: dictionary of user defined variables.
+    """
+    mem_path = wrapper_config['mem_path']
+    if not os.path.isdir(mem_path):
+        print('mem dir does not exist')
+        raise NotADirectoryError
+    weights_path = wrapper_config['weights_path']
+    if wrapper_config['load_weights'] and not(os.path.isdir(weights_path)):
+        print('weights dir does not exist')
+        raise NotADirectoryError
+    agent_type = wrapper_config['agent']
+    if not issubclass(agent_type, AgentABC):
+        print('invalid agent type')
+        raise TypeError
+    if wrapper_config['report_every'] < 1:
+        print('--report-every must be at least 1')
+        raise ValueError
+    # num_processes (int): number of data parallel learner processes
+    num_processes = wrapper_config.get('num_processes', 1)
+    # scaling_benchmark (list of int): measure the updates/sec with each number of processes (nothing is saved)
+    scaling_benchmark = wrapper_config.get('scaling_benchmark')
+
+    if wrapper_config.get('precision_benchmark'):
+        precision_benchmark(env_config, wrapper_config)
+        return
+
+    if scaling_benchmark:
+        rates = {}
+        for world_size in scaling_benchmark:
+            print('\n\n{} process(es):'.format(world_size))
+            if world_size == 1:
+                from distributed.data_parallel import pin_process, unpin_process
+                # pinned like the processes of the other runs (the cores they share), then released for them
+                previous = pin_process(0, 1)
+                try:
+                    agent = _make_agent(env_config, wrapper_config)
+                    agent.load_mem(mem_path)
+                    rates[world_size] = _offline_updates(agent, wrapper_config, save=False)
+                finally:
+                    unpin_process(previous)
+            else:
+                rates[world_size] = _run_data_parallel(env_config, wrapper_config, world_size, save=False)
+        base = scaling_benchmark[0]
+        print('\n\nprocesses\tupdates/sec\tspeedup\tefficiency')
+        for world_size in scaling_benchmark:
+            speedup = rates[world_size] / rates[base]
+            print('{}\t{:.1f}\t{:.2f}\t{:.2f}'.format(world_size, rates[world_size], speedup,
+                                                     speedup * base / world_size))
+        return
+
+    if num_processes > 1:
+        _run_data_parallel(env_config, wrapper_config, num_processes)
+        return
+    agent = _make_agent(env_config, wrapper_config)
+    load_start = time.time()
+    agent.load_mem(mem_path)
+    print('\nloaded replay buffer in {:.1f} seconds'.format(time.time() - load_start))
+    _offline_updates(agent, wrapper_config)
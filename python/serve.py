@@ -0,0 +1,265 @@
+###################################
+# Local inference server: several game instances share one policy process.
+# requests from all clients are coalesced into batched forward passes of the actor networks.
+import asyncio
+import json
+import os
+import time
+from collections import deque
+
+import numpy as np
+import torch
+
+from agent import AgentABC
+from utils.hyperparameters import read_hyperparameters, apply_hyperparameters, get_hyperparameters
+from utils.numpy_actor import load_numpy_actors, act as numpy_act
+
+MAX_HEADER_SIZE = 64 * 1024
+
+
+class BatchedPolicy:
+    """ the actors of an agent, evaluated on many observations at once """
+    def __init__(self, agent_type, weights_path, state_size, action_size, num_agents, runtime='torch',
+                 max_batch=64, frame_history=1):
+        """
+        :param runtime: 'torch' (the agent's actors) or 'numpy' (the actors evaluated with numpy)
+        :param max_batch: maximal number of requests in one forward pass (numpy buffers)
+        :param frame_history: FRAME_HISTORY of the agent - the server keeps no history, a request holds the last
+        frame_history observations of every car, oldest first
+        """
+        self.runtime = runtime
+        self.max_batch = max_batch
+        self.agent_type = agent_type
+        self.weights_path = weights_path
+        self.state_size = state_size
+        self.action_size = action_size
+        self.num_agents = num_agents
+        # size of the state of a car in a request (the actors see the stacked observations)
+        self.observation_size = state_size * frame_history
+        self.version = 0
+        self.weights_mtime = None
+        self.actors = None
+        self.reload()
+
+    def _latest_mtime(self):
+        mtimes = [os.path.getmtime(os.path.join(root, name))
+                  for root, _, names in os.walk(self.weights_path) for name in names]
+        return max(mtimes) if mtimes else None
+
+    def reload(self):
+        """ load the weights directory into a new agent and switch to its actors """
+        mtime = self._latest_mtime()
+        if self.runtime == 'numpy':
+            # buffers for a full batch of requests (one row per car)
+            self.actors = load_numpy_actors(self.weights_path, self.agent_type, self.state_size, self.action_size,
+                                            self.num_agents, max_batch=self.max_batch * self.num_agents)
+            self.weights_mtime = mtime
+            self.version += 1
+            return
+        agent: AgentABC = self.agent_type(state_size=self.state_size, action_size=self.action_size,
+                                          num_agents=self.num_agents, random_seed=0)
+        agent.load_weights(self.weights_path)
+        actors = agent.actors()
+        for actor in actors:
+            actor.eval()
+        self.actors = actors    # single reference swap, a running forward keeps the old actors
+        self.weights_mtime = mtime
+        self.version += 1
+
+    def changed(self):
+        return self._latest_mtime() != self.weights_mtime
+
+    def act(self, observations):
+        """
+        :param observations: (num_requests, num_agents, observation_size)
+        :return: actions (num_requests, num_agents, action_size)
+        """
+        actors = self.actors
+        if self.runtime == 'numpy':
+            return numpy_act(actors, observations)
+        states = torch.from_numpy(observations)
+        with torch.no_grad():
+            if len(actors) == 1:
+                # one policy for all the cars (ddpg) - a single forward for every observation
+                actions = actors[0](states.view(-1, self.observation_size)).view(*observations.shape[:2], -1)
+            else:
+                # a policy per car (mddpg, maddpg) - one forward per car over all the requests
+                actions = torch.stack([actors[i](states[:, i, :]) for i in range(self.num_agents)], dim=1)
+        return np.clip(actions.numpy(), -1, 1)
+
+
+class PolicyServer:
+    def __init__(self, policy: BatchedPolicy, max_batch, latency_budget):
+        """
+        :param policy: the policy to serve
+        :param max_batch: maximal number of requests in one forward pass
+        :param latency_budget: seconds the first request of a batch may wait for more requests
+        """
+        self.policy = policy
+        self.max_batch = max_batch
+        self.latency_budget = latency_budget
+        self.requests = None
+        self.start_time = time.time()
+        self.latencies = deque(maxlen=10000)
+        self.num_requests = 0
+        self.num_batches = 0
+
+    async def _batcher(self):
+        """ collect requests until the batch is full or the latency budget of its first request is used """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.requests.get()]
+            deadline = batch[0][1] + self.latency_budget
+            while len(batch) < self.max_batch:
+                if not self.requests.empty():
+                    # requests that arrived while the previous batch was running join without waiting
+                    batch.append(self.requests.get_nowait())
+                    continue
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.requests.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            observations = np.stack([observation for observation, _, _ in batch])
+            try:
+                # the forward runs in a thread so the event loop keeps collecting the next batch meanwhile
+                actions = await loop.run_in_executor(None, self.policy.act, observations)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.num_batches += 1
+            for i, (_, _, future) in enumerate(batch):
+                if not future.cancelled():
+                    future.set_result(actions[i])
+
+    async def _reloader(self, interval):
+        """ hot reload - switch to the new weights when the weights directory changes """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            if self.policy.changed():
+                try:
+                    await loop.run_in_executor(None, self.policy.reload)
+                    print('\nloaded weights version {}'.format(self.policy.version))
+                except Exception as e:
+                    # e.g. the files are still being written - try again on the next check
+                    print('\nreloading weights failed: {!r}'.format(e))
+
+    async def _reporter(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            print('\n' + json.dumps(self.metrics()), end="")
+
+    def metrics(self):
+        """ :return: dictionary with throughput and latency (milliseconds) """
+        latencies = np.array(self.latencies) * 1000
+        elapsed = time.time() - self.start_time
+        return {'requests': self.num_requests,
+                'requests_per_sec': self.num_requests / elapsed,
+                'mean_batch_size': self.num_requests / max(1, self.num_batches),
+                'latency_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+                'latency_p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+                'weights_version': self.policy.version}
+
+    async def act(self, observations):
+        """ :param observations: (num_agents, observation_size) of one game instance :return: actions """
+        observations = np.asarray(observations, dtype=np.float32).reshape(self.policy.num_agents,
+                                                                          self.policy.observation_size)
+        arrival = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        await self.requests.put((observations, arrival, future))
+        actions = await future
+        self.latencies.append(time.perf_counter() - arrival)
+        self.num_requests += 1
+        return actions
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        minimal http/1.1 with keep alive:
+            POST /act      body {"observations": [[...], ...]} (one row per car) -> {"actions": [[...], ...]}
+            GET  /metrics  -> throughput and latency metrics
+        """
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                status, close = '200 OK', False
+                try:
+                    lines = head.decode('latin-1').split('\r\n')
+                    method, path = lines[0].split(' ')[:2]
+                    headers = {k.strip().lower(): v.strip() for k, v in
+                               (line.split(':', 1) for line in lines[1:] if ':' in line)}
+                    close = headers.get('connection', '').lower() == 'close'
+                    body = await reader.readexactly(int(headers.get('content-length', 0)))
+                except ValueError as e:
+                    # a malformed request line or content-length: the next request can not be found, answer and close
+                    status, response, close = '400 Bad Request', {'error': repr(e)}, True
+                else:
+                    try:
+                        if method == 'POST' and path == '/act':
+                            actions = await self.act(json.loads(body)['observations'])
+                            response = {'actions': actions.tolist(), 'weights_version': self.policy.version}
+                        elif method == 'GET' and path == '/metrics':
+                            response = self.metrics()
+                        else:
+                            status, response = '404 Not Found', {'error': 'unknown path {}'.format(path)}
+                    except (ValueError, KeyError, TypeError) as e:
+                        # TypeError: a json body that is not an object
+                        status, response = '400 Bad Request', {'error': repr(e)}
+                payload = json.dumps(response).encode()
+                writer.write('HTTP/1.1 {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n'.format(
+                    status, len(payload)).encode() + payload)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # the client went away, also in the middle of a body
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port, reload_interval, metrics_interval):
+        self.requests = asyncio.Queue()
+        server = await asyncio.start_server(self._handle_connection, host, port, limit=MAX_HEADER_SIZE)
+        print('serving {} on {}:{}'.format(self.policy.weights_path, *server.sockets[0].getsockname()[:2]))
+        tasks = [asyncio.ensure_future(self._batcher()), asyncio.ensure_future(self._reloader(reload_interval))]
+        if metrics_interval > 0:
+            tasks.append(asyncio.ensure_future(self._reporter(metrics_interval)))
+        async with server:
+            await server.serve_forever()
+
+
+def serve_wrapper(env_config, wrapper_config):
+    """
+    run the inference server.
+    :param env_config: dictionary, the environment parameters (num_agents)
+    :param wrapper_config: dictionary of user defined variables.
+    """
+    if not hasattr(asyncio, 'run'):
+        print('the serve mode needs python 3.7 or higher (asyncio.run)')
+        raise RuntimeError
+    weights_path = wrapper_config['weights_path']
+    if not os.path.isdir(weights_path):
+        print('--weights-path is not a valid directory')
+        raise NotADirectoryError
+    agent_type = wrapper_config['agent']
+    if not issubclass(agent_type, AgentABC):
+        print('invalid agent type')
+        raise TypeError
+    # hparams: agent constants the weights were trained with that change the networks (e.g. FRAME_HISTORY)
+    apply_hyperparameters(agent_type, read_hyperparameters(wrapper_config.get('hparams')))
+    frame_history = get_hyperparameters(agent_type, ['FRAME_HISTORY']).get('FRAME_HISTORY', 1)
+    policy = BatchedPolicy(agent_type, weights_path, wrapper_config['state_size'], wrapper_config['action_size'],
+                           env_config['num_agents'], runtime=wrapper_config['runtime'],
+                           max_batch=wrapper_config['max_batch'], frame_history=frame_history)
+    server = PolicyServer(policy, wrapper_config['max_batch'], wrapper_config['latency_budget'] / 1000)
+    try:
+        asyncio.run(server.serve(wrapper_config['host'], wrapper_config['port'],
+                                 wrapper_config['reload_interval'], wrapper_config['metrics_interval']))
+    except KeyboardInterrupt:
+        print('\n' + json.dumps(server.metrics()))
@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+import torch
+
+from agent import AgentABC
+from student.student_model import StudentActor
+
+FC1_UNITS = 64          # hidden layers of the student (the ddpg / maddpg actors have 256 and 128)
+FC2_UNITS = 64
+AGENT_CONDITIONED = True    # one fc1 bias per car (else one policy for all the cars)
+
+an_filename = "studentActor_Model.pth"
+device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+
+
+class Agent(AgentABC):
+    """Drives the cars with one student actor, distilled from the actors of a trained agent (see distill.py)."""
+
+    def __init__(self, state_size, action_size, num_agents, random_seed):
+        """
+        Initialize a student Agent object. its actor is trained by distill, not by reinforcement learning - the
+        sizes of the saved actor replace FC1_UNITS, FC2_UNITS and AGENT_CONDITIONED when the weights are loaded.
+            :param state_size (int): dimension of each state
+            :param action_size (int): dimension of each action
+            :param num_agents (int): number of agents (cars) in the environment
+            :param random_seed (int): random seed
+        """
+        super().__init__(state_size, action_size, num_agents, random_seed)
+        self.state_size = state_size
+        self.action_size = action_size
+        self.num_agents = num_agents
+        self.random_seed = random_seed
+        self.actor = None
+        self.agent_index = torch.arange(num_agents, device=device)
+        self.build(FC1_UNITS, FC2_UNITS, num_agents if AGENT_CONDITIONED else 0)
+
+    def build(self, fc1_units, fc2_units, num_conditions):
+        """
+        (re)create the actor.
+        :param fc1_units: nodes of the first hidden layer
+        :param fc2_units: nodes of the second hidden layer
+        :param num_conditions: number of cars the actor is conditioned on (0 - one policy for all the cars)
+        """
+        self.actor = StudentActor(self.state_size, self.action_size, self.random_seed, fc1_units, fc2_units,
+                                  num_conditions).to(device)
+
+    def act(self, state, add_noise=True):
+        """ see abstract class (the student adds no noise, it is not explored with) """
+        state = torch.from_numpy(state).float().to(device)
+        self.actor.eval()
+        with torch.no_grad():
+            actions = self.actor(state, self.agent_index if self.actor.num_conditions > 0 else None)
+        return np.clip(actions.cpu().numpy(), -1, 1)
+
+    def step(self, states, actions, rewards, next_states, dones, valid=None, rollout=0):
+        """ see abstract class """
+        print('the student agent is trained by distill, not by reinforcement learning')
+        raise NotImplementedError
+
+    def reset(self):
+        """ see abstract class """
+        pass
+
+    def actors(self):
+        """ see abstract class """
+        return [self.actor]
+
+    def save_weights(self, directory_path):
+        """ see abstract class (the sizes of the actor are saved with its weights) """
+        super().save_weights(directory_path)
+        torch.save({'fc1_units': self.actor.fc1.out_features, 'fc2_units': self.actor.fc2.out_features,
+                    'num_conditions': self.actor.num_conditions, 'state_dict': self.actor.state_dict()},
+                   os.path.join(directory_path, an_filename))
+
+    def load_weights(self, directory_path):
+        """ see abstract class """
+        super().load_weights(directory_path)
+        saved = torch.load(os.path.join(directory_path, an_filename), map_location=device)
+        if saved['num_conditions'] not in (0, self.num_agents):
+            print('the student was distilled for {} cars, not {}'.format(saved['num_conditions'], self.num_agents))
+            raise ValueError
+        self.build(saved['fc1_units'], saved['fc2_units'], saved['num_conditions'])
+        self.actor.load_state_dict(saved['state_dict'])
+
+    def save_mem(self, directory_path):
+        """ see abstract class """
+        print('the student agent has no replay buffer')
+        raise NotImplementedError
+
+    def load_mem(self, directory_path):
+        """ see abstract class """
+        print('the student agent has no replay buffer')
+        raise NotImplementedError
@@ -0,0 +1,53 @@
+"""
+Neural Network Model of the distilled student actor (see distill.py).
+the layers are those of the ddpg / maddpg actors (fc1 -> relu -> fc2 -> relu -> fc3 -> tanh), with smaller hidden
+layers. a student conditioned on the agent index adds a learned fc1 bias per car, the same as feeding fc1 a one-hot
+index next to the observation, without building the one-hot input.
+"""
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from ddpg.ddpg_model import hidden_init
+
+
+class StudentActor(nn.Module):
+    """Student (Policy) Model."""
+
+    def __init__(self, state_size, action_size, seed, fc1_units=64, fc2_units=64, num_conditions=0):
+        """Initialize parameters and build model.
+        Params
+        ======
+            state_size (int): Dimension of each state
+            action_size (int): Dimension of each action
+            seed (int): Random seed
+            fc1_units (int): Number of nodes in first hidden layer
+            fc2_units (int): Number of nodes in second hidden layer
+            num_conditions (int): Number of agent indices the actor is conditioned on (0 - one policy for every car)
+        """
+        super(StudentActor, self).__init__()
+        self.seed = torch.manual_seed(seed)
+        self.num_conditions = num_conditions
+        self.fc1 = nn.Linear(state_size, fc1_units)
+        self.fc2 = nn.Linear(fc1_units, fc2_units)
+        self.fc3 = nn.Linear(fc2_units, action_size)
+        if num_conditions > 0:
+            self.agent_bias = nn.Parameter(torch.zeros(num_conditions, fc1_units))
+        self.reset_parameters()
+
+    def reset_parameters(self):
+        self.fc1.weight.data.uniform_(*hidden_init(self.fc1))
+        self.fc2.weight.data.uniform_(*hidden_init(self.fc2))
+        self.fc3.weight.data.uniform_(-3e-3, 3e-3)
+
+    def forward(self, state, agent_index=None):
+        """Build an actor (policy) network that maps states (and the index of their car) -> actions."""
+        x = self.fc1(state)
+        if self.num_conditions > 0:
+            if agent_index is None:
+                raise ValueError('the student actor is conditioned on the agent index')
+            x = x + self.agent_bias[agent_index]
+        x = F.relu(x)
+        x = F.relu(self.fc2(x))
+        return torch.tanh(self.fc3(x))
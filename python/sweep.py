@@ -0,0 +1,210 @@
+###################################
+# Hyperparameter sweep: many train_wrapper runs packed onto the available cores,
+# with successive halving to stop runs that fall behind.
+import csv
+import itertools
+import json
+import math
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import time
+
+import numpy as np
+
+from agent import AgentABC
+from train import train_wrapper
+from utils.hyperparameters import read_hyperparameters
+
+
+def make_trials(search_space, search, num_trials, seed=0):
+    """
+    build the hyperparameter sets of the sweep.
+    the search space maps a constant name to a list of values, or to one of
+    {"choice": [values]}, {"uniform": [low, high]}, {"log_uniform": [low, high]} (random search only).
+    :param search_space: dictionary, the search space
+    :param search: 'grid' (every combination of the lists) or 'random' (num_trials random samples)
+    :param num_trials: number of random trials
+    :param seed: random seed of the random search
+    :return: list of dictionaries (constant name -> value)
+    """
+    names = sorted(search_space)
+    if search == 'grid':
+        values = []
+        for name in names:
+            space = search_space[name]
+            if isinstance(space, dict) and 'choice' in space:
+                space = space['choice']
+            if not isinstance(space, list):
+                print('grid search needs a list of values for {}'.format(name))
+                raise ValueError(name)
+            values.append(space)
+        return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+    rng = np.random.RandomState(seed)
+    trials = []
+    for _ in range(num_trials):
+        trial = {}
+        for name in names:
+            space = search_space[name]
+            if isinstance(space, list):
+                trial[name] = space[rng.randint(len(space))]
+            elif 'choice' in space:
+                trial[name] = space['choice'][rng.randint(len(space['choice']))]
+            elif 'uniform' in space:
+                trial[name] = float(rng.uniform(*space['uniform']))
+            elif 'log_uniform' in space:
+                low, high = np.log(space['log_uniform'])
+                trial[name] = float(np.exp(rng.uniform(low, high)))
+            else:
+                print('unknown search space for {}: {}'.format(name, space))
+                raise ValueError(name)
+        trials.append(trial)
+    return trials
+
+
+def _run_trial(params, env_config, wrapper_config, cores, progress):
+    """ process target - runs one train_wrapper on its own cores and reports every episode through a pipe """
+    import torch
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    if not os.path.isdir(wrapper_config['weights_path']):
+        os.makedirs(wrapper_config['weights_path'])
+    sys.stdout = open(os.path.join(wrapper_config['weights_path'], 'train.log'), 'w', buffering=1)
+    # the trial's values go on top of the fixed --hparams of the sweep
+    params = dict(read_hyperparameters(wrapper_config.get('hparams')), **params)
+    wrapper_config = dict(wrapper_config, hparams=json.dumps(params),
+                          episode_callback=lambda i, score, avg: progress.send(('episode', i, float(score),
+                                                                                float(avg))))
+    try:
+        train_wrapper(env_config, wrapper_config)
+        progress.send(('completed',))
+    except Exception as e:
+        print('\ntrial failed: {!r}'.format(e))
+        progress.send(('failed',))
+
+
+def sweep_wrapper(env_config, wrapper_config):
+    """
+    run a hyperparameter sweep.
+    :param env_config: dictionary, used to pass parameters into the environment
+    :param wrapper_config: dictionary of user defined variables (train options + sweep options).
+    """
+    agent_type = wrapper_config['agent']
+    if not issubclass(agent_type, AgentABC):
+        print('invalid agent type')
+        raise TypeError
+    if wrapper_config['halving_rate'] < 2:
+        print('--halving-rate must be at least 2')
+        raise ValueError
+    if wrapper_config['halving_episodes'] < 1:
+        print('--halving-episodes must be at least 1')
+        raise ValueError
+    weights_path = wrapper_config['weights_path']
+    trials = make_trials(read_hyperparameters(wrapper_config['search_space']), wrapper_config['search'],
+                         wrapper_config['num_trials'])
+
+    # pack the runs: every slot owns threads_per_job cores and a unity worker id
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    threads_per_job = wrapper_config['threads_per_job']
+    num_slots = max(1, len(cores) // threads_per_job)
+    if wrapper_config['max_parallel'] is not None:
+        num_slots = min(num_slots, wrapper_config['max_parallel'])
+    slots = [(cores[(i * threads_per_job) % len(cores):][:threads_per_job], wrapper_config['base_worker_id'] + i)
+             for i in range(num_slots)]
+    print('\nrunning {} trials, {} at a time ({} threads each)'.format(len(trials), num_slots, threads_per_job))
+
+    # successive halving: rungs at halving_episodes * halving_rate^k episodes. a run that reaches a rung
+    # continues only if its average score is in the top 1/halving_rate of the runs that reached the rung.
+    halving_episodes = wrapper_config['halving_episodes']
+    halving_rate = wrapper_config['halving_rate']
+    rungs = {}
+
+    results = [{'trial': i, 'status': 'pending', 'episodes': 0, 'average_score': np.nan,
+                'best_average_score': -np.inf, 'seconds': 0.0, 'params': params}
+               for i, params in enumerate(trials)]
+    # every run reports through its own pipe, so killing a run can not break the channel of the others
+    context = multiprocessing.get_context('spawn')
+    pending = list(range(len(trials)))
+    running = {}    # trial id -> (process, pipe, slot, start time)
+    free_slots = list(slots)
+
+    def finish(trial_id, status):
+        process, pipe, slot, start = running.pop(trial_id)
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        pipe.close()
+        results[trial_id]['status'] = status
+        results[trial_id]['seconds'] = time.time() - start
+        free_slots.append(slot)
+        print('\ntrial {} {} after {} episodes\taverage score: {:.3f}\t{}'.format(
+            trial_id, status, results[trial_id]['episodes'], results[trial_id]['average_score'], trials[trial_id]))
+
+    def report(trial_id, i_episode, average_score):
+        result = results[trial_id]
+        result['episodes'] = i_episode
+        result['average_score'] = average_score
+        result['best_average_score'] = max(result['best_average_score'], average_score)
+        rung = 0
+        while halving_episodes * halving_rate ** rung < i_episode:
+            rung += 1
+        if halving_episodes * halving_rate ** rung == i_episode:
+            rung_scores = rungs.setdefault(rung, [])
+            rung_scores.append(average_score)
+            num_leaders = int(math.ceil(len(rung_scores) / halving_rate))
+            if len(rung_scores) >= halving_rate and average_score < sorted(rung_scores, reverse=True)[num_leaders-1]:
+                finish(trial_id, 'stopped')
+
+    while pending or running:
+        while pending and free_slots:
+            trial_id = pending.pop(0)
+            slot_cores, worker_id = free_slots.pop(0)
+            trial_config = dict(wrapper_config, worker_id=worker_id, show_graphics=False,
+                                weights_path=os.path.join(weights_path, 'trial_{}'.format(trial_id)),
+                                mem_path=os.path.join(weights_path, 'trial_{}'.format(trial_id), 'mem'))
+            if wrapper_config.get('record_path') is not None:
+                trial_config['record_path'] = os.path.join(wrapper_config['record_path'], 'trial_{}'.format(trial_id))
+            for key in ['search_space', 'search', 'num_trials', 'threads_per_job', 'max_parallel',
+                        'base_worker_id', 'halving_episodes', 'halving_rate', 'subparser_name']:
+                trial_config.pop(key, None)
+            reader, writer = context.Pipe(duplex=False)
+            process = context.Process(target=_run_trial, args=(trials[trial_id], env_config, trial_config,
+                                                               slot_cores, writer), daemon=True)
+            process.start()
+            writer.close()
+            running[trial_id] = (process, reader, (slot_cores, worker_id), time.time())
+            results[trial_id]['status'] = 'running'
+        pipes = {running[trial_id][1]: trial_id for trial_id in running}
+        for pipe in multiprocessing.connection.wait(list(pipes), timeout=1):
+            trial_id = pipes[pipe]
+            if trial_id not in running:
+                continue    # stopped while handling another pipe
+            try:
+                message = pipe.recv()
+            except EOFError:
+                # the run died without reporting (e.g. killed by the os)
+                finish(trial_id, 'failed')
+                continue
+            if message[0] == 'episode':
+                report(trial_id, message[1], message[3])
+            else:
+                finish(trial_id, message[0])
+
+    # collect the results in one table (best first)
+    results.sort(key=lambda r: r['best_average_score'], reverse=True)
+    names = sorted(set(name for params in trials for name in params))
+    columns = ['trial', 'status', 'episodes', 'average_score', 'best_average_score', 'seconds'] + names
+    if not os.path.isdir(weights_path):
+        os.mkdir(weights_path)
+    with open(os.path.join(weights_path, 'sweep_results.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for r in results:
+            writer.writerow([r[c] for c in columns[:6]] + [r['params'].get(name) for name in names])
+    print('\n\n' + '\t'.join(columns))
+    for r in results:
+        print('\t'.join(['{}'.format(r['trial']), r['status'], '{}'.format(r['episodes']),
+                         '{:.3f}'.format(r['average_score']), '{:.3f}'.format(r['best_average_score']),
+                         '{:.0f}'.format(r['seconds'])] + ['{}'.format(r['params'].get(name)) for name in names]))
@@ -2,8 +2,98 @@
 # Import Required Packages
 import numpy as np
 import os
-from mlagents.envs import UnityEnvironment
+from utils.environment import resolve_build_path, open_environment, step_environment
 from agent import AgentABC
+from utils.trajectory_recorder import TrajectoryRecorder
+from utils.agent_episodes import AgentEpisodes
+from utils.numpy_actor import NumpyAgent, load_numpy_actors
+from utils.hyperparameters import read_hyperparameters, apply_hyperparameters, get_hyperparameters
+
+
+def run_test_episode(env, brain_name, agent: AgentABC, env_config, train_mode=False, action_repeat=1,
+                     recorder: TrajectoryRecorder = None, episode_id=0):
+    """
+    run one episode without exploration noise and without learning.
+    :param env: the environment
+    :param brain_name: name of the brain that controls the cars
+    :param agent: agent to act with
+    :param env_config: dictionary, used to pass parameters into the environment
+    :param train_mode: unity train mode (fast simulation) or not (real time)
+    :param action_repeat: number of env frames every action is held for
+    :param recorder: optional recorder of the steps of the episode
+    :param episode_id: id of the episode in the recording
+    :return: (episode score of each unity agent, number of steps (actions))
+    """
+    # reset the unity environment at the beginning of each episode
+    env_info = env.reset(train_mode=train_mode, config=env_config)[brain_name]
+
+    # get initial state of the unity environment
+    states = env_info.vector_observations
+
+    # reset the agent for new episode
+    agent.reset()
+    agent.restart()
+
+    # set the initial episode scores to zero for each unity agent.
+    scores = np.zeros(len(env_info.agents))
+
+    # Run the episode loop;
+    # At each loop step take an action as a function of the current state observations
+    # If environment episode is done, exit loop...
+    # Otherwise repeat until done == true
+    steps = 0
+    while True:
+        steps += 1
+        # determine actions for the unity agents from current sate
+        actions = agent.act(states, add_noise=False)
+
+        # send the actions to the unity agents in the environment (held for action_repeat frames) and receive
+        # the next states, the rewards summed over the frames and whether the episode has finished for each agent
+        next_states, rewards, dones, _ = step_environment(env, brain_name, actions, action_repeat)
+        if recorder is not None:
+            recorder.record(episode_id, states, actions, rewards, dones)
+
+        # set new states to current states for determining next actions
+        states = next_states
+
+        # Update episode score for each unity agent
+        scores += rewards
+
+        # If any unity agent indicates that the episode is done,
+        # then exit episode loop, to begin new episode
+        if np.any(dones):
+            break
+    return scores, steps
+
+
+def run_continuous_test(env, brain_name, agent: AgentABC, env_config, num_car_episodes, train_mode=False,
+                        action_repeat=1, recorder: TrajectoryRecorder = None):
+    """
+    run the cars without exploration noise and without learning, and without resetting the environment when a
+    car is done (the done car starts over on its own while the others keep driving).
+    :param num_car_episodes: number of car episodes to run
+    (other parameters as run_test_episode, every car episode is recorded with an episode id of its own)
+    :return: list of (car, episode score, number of steps) of the finished car episodes
+    """
+    env_info = env.reset(train_mode=train_mode, config=env_config)[brain_name]
+    states = env_info.vector_observations
+    agent.reset()
+    agent.restart()
+    agent_episodes = AgentEpisodes(len(env_info.agents))
+    # cars done on the previous step (their observation is the terminal state of the episode)
+    starting = np.zeros(len(env_info.agents), dtype=bool)
+    while len(agent_episodes.finished) < num_car_episodes:
+        actions = agent.act(states, add_noise=False)
+        # the next observation of the cars that acted on their terminal state starts their new episode
+        agent.restart(starting)
+        next_states, rewards, dones, _ = step_environment(env, brain_name, actions, action_repeat)
+        if recorder is not None:
+            recorder.record(agent_episodes.episode_ids, states, actions, rewards, dones)
+        states = next_states
+        starting = np.asarray(dones, dtype=bool)
+        for car, score, steps in agent_episodes.add(rewards, dones):
+            print('\nCar {}\tEpisode Score: {:.2f}\tNumber Of Steps {}'.format(car, score, steps), end="")
+    return agent_episodes.finished[:num_car_episodes]
 
 
 def test_wrapper(env_config, wrapper_config):
@@ -14,10 +104,7 @@ def test_wrapper(env_config, wrapper_config):
     num_episodes = wrapper_config['num_episodes']
 
     # build_path: path to the build of the unity environment.
-    build = None if wrapper_config['build'] == 'None' else wrapper_config['build']
-    if (build is not None) and (not os.path.isfile(build)):
-        print('--build is not a valid path')
-        raise FileNotFoundError
+    build = resolve_build_path(wrapper_config['build'])
 
     # weights_path: path to the directory containing the weights (same directory to save them)
     weights_path = wrapper_config['weights_path']
@@ -25,16 +112,38 @@ def test_wrapper(env_config, wrapper_config):
         print('--weights-path is not a valid directory')
         raise NotADirectoryError
 
+    # action_repeat (int): number of env frames every action is held for
+    action_repeat = wrapper_config.get('action_repeat', 1)
+    if action_repeat < 1:
+        print('--action-repeat must be at least 1')
+        raise ValueError
+
+    # continuous (bool): never reset the environment, a done car starts over on its own (num_episodes * num_agents
+    # car episodes are run)
+    continuous = wrapper_config.get('continuous', False)
+
+    # record_path: directory to record the steps of the episodes in (observations, actions, rewards, dones)
+    record_path = wrapper_config.get('record_path')
+
+    # runtime: 'torch' (the agent's networks) or 'numpy' (the actors evaluated with numpy, see utils/numpy_actor.py)
+    runtime = wrapper_config.get('runtime', 'torch')
+
     # agent_type (DDPG | MDDPG | MADDPG)
     agent_type = wrapper_config['agent']
     if not issubclass(agent_type, AgentABC):
         print('invalid agent type')
         raise TypeError
 
+    # hparams: agent constants the weights were trained with that change the networks (e.g. FRAME_HISTORY)
+    apply_hyperparameters(agent_type, read_hyperparameters(wrapper_config.get('hparams')))
+    if runtime == 'numpy' and get_hyperparameters(agent_type, ['FRAME_HISTORY']).get('FRAME_HISTORY', 1) > 1:
+        print('the numpy runtime does not keep an observation history (FRAME_HISTORY)')
+        raise ValueError
+
     """
     Start the Unity Environment
     """
-    env = UnityEnvironment(file_name=build)
+    env = open_environment(build, no_graphics=False)
 
     """
     Get The Unity Environment Brain
@@ -84,58 +193,42 @@ def test_wrapper(env_config, wrapper_config):
     determined above.
     TODO - agent type check, add type hints to abstract class.
     """
-    agent: AgentABC = agent_type(state_size=state_size,
-                                 action_size=action_size[0], num_agents=num_agents, random_seed=0)
-
-    # Load trained model weights
-    agent.load_weights(weights_path)
+    if runtime == 'numpy':
+        # only the actors, the array file is read when it is up to date with the weights
+        agent = NumpyAgent(load_numpy_actors(weights_path, agent_type, state_size, action_size[0], num_agents))
+    else:
+        agent: AgentABC = agent_type(state_size=state_size,
+                                     action_size=action_size[0], num_agents=num_agents, random_seed=0)
+
+        # Load trained model weights
+        agent.load_weights(weights_path)
+    recorder = None
+    if record_path is not None:
+        recorder = TrajectoryRecorder(record_path, state_size, action_size[0])
     """
     Run test for number of episodes
     """
-    # loop from num_episodes
-    for i_episode in range(1, num_episodes+1):
-
-        # reset the unity environment at the beginning of each episode
-        # set train mode to false
-        env_info = env.reset(train_mode=False, config=env_config)[brain_name]
-
-        # get initial state of the unity environment
-        states = env_info.vector_observations
-
-        # reset the training agent for new episode
-        agent.reset()
-
-        # set the initial episode scores to zero for each unity agent.
-        scores = np.zeros(num_agents)
-
-        # Run the episode loop;
-        # At each loop step take an action as a function of the current state observations
-        # If environment episode is done, exit loop...
-        # Otherwise repeat until done == true
-        while True:
-            # determine actions for the unity agents from current sate
-            actions = agent.act(states, add_noise=False)
-
-            # send the actions to the unity agents in the environment and receive resultant environment information
-            env_info = env.step(actions)[brain_name]
-
-            next_states = env_info.vector_observations   # get the next states for each unity agent in the environment
-            rewards = env_info.rewards                   # get the rewards for each unity agent in the environment
-            dones = env_info.local_done           # see if episode has finished for each unity agent in the environment
-
-            # set new states to current states for determining next actions
-            states = next_states
-
-            # Update episode score for each unity agent
-            scores += rewards
-
-            # If any unity agent indicates that the episode is done,
-            # then exit episode loop, to begin new episode
-            if np.any(dones):
-                break
-
-        # Print current average score
-        print('\nEpisode {}\tAverage Score: {:.2f}'.format(i_episode, np.mean(scores), end=""))
+    try:
+        if continuous:
+            finished = run_continuous_test(env, brain_name, agent, env_config, num_episodes * num_agents,
+                                           train_mode=False, action_repeat=action_repeat, recorder=recorder)
+            print('\nAverage Score: {:.2f}\tAverage Number Of Steps {:.1f}'.format(
+                np.mean([score for _, score, _ in finished]), np.mean([steps for _, _, steps in finished])), end="")
+            num_episodes = 0
+
+        # loop from num_episodes
+        for i_episode in range(1, num_episodes+1):
+            # set train mode to false
+            scores, steps = run_test_episode(env, brain_name, agent, env_config, train_mode=False,
+                                             action_repeat=action_repeat, recorder=recorder, episode_id=i_episode)
+
+            # Print current average score
+            print('\nEpisode {}\tAverage Score: {:.2f}'.format(i_episode, np.mean(scores)), end="")
+            if action_repeat > 1:
+                print('\tAction Repeat {}\tNumber Of Steps {}'.format(action_repeat, steps), end="")
+    finally:
+        if recorder is not None:
+            recorder.close()
 
     """
     Everything is Finished -> Close the Environment.
@@ -2,8 +2,19 @@
 # Import Required Packages
 import numpy as np
 from agent import AgentABC
-from mlagents.envs import UnityEnvironment
+from utils.environment import resolve_build_path, open_environment, step_environment
+from utils.hyperparameters import read_hyperparameters, apply_hyperparameters
+from utils.checkpoint import save_checkpoint, save_training_state, has_training_state, load_training_state
+from utils.memory_budget import MemoryAccount, fit_memory_budget, parse_size
+from utils.loss_stats import format_stats
+from utils.demonstrations import load_demonstrations
+from utils.background_evaluator import BackgroundEvaluator
+from utils.trajectory_recorder import TrajectoryRecorder
+from utils.agent_episodes import AgentEpisodes
+from utils.env_watchdog import SupervisedEnvironment, EnvironmentRestarted, EnvironmentFailed
 import os
+import csv
+import time
 
 
 def train_wrapper(env_config, wrapper_config):
@@ -40,12 +51,22 @@ def train_wrapper(env_config, wrapper_config):
         print('mem dir does not exist')
         raise NotADirectoryError
 
-    # build_path: path to the build of the unity environment.
-    build_path = None if wrapper_config['build'] == 'None' else wrapper_config['build']
-    if (build_path is not None) and (not os.path.isfile(build_path)):
-        print('--build is not a valid path')
+    # checkpoint_every (int): save the full training state with the replay buffers (in mem_path) every # episodes
+    # and at the end, so an interrupted run can be resumed (0 - off)
+    checkpoint_every = wrapper_config.get('checkpoint_every', 0)
+    if checkpoint_every > 0 and mem_path is None:
+        print('--checkpoint-every saves the training state in --mem-path, which is missing')
+        raise ValueError
+    # resume (bool): continue the training saved in mem_path (weights, optimizers, noise, random generators,
+    # replay buffers, episode and scores) from its next episode
+    resume = wrapper_config.get('resume', False)
+    if resume and not has_training_state(mem_path):
+        print('there is no training state in --mem-path to resume from')
         raise FileNotFoundError
 
+    # build_path: path to the build of the unity environment.
+    build_path = resolve_build_path(wrapper_config['build'])
+
     # no_graphics (bool): whether or not to start the environment without graphics (default = True in training)
     no_graphics_in = not wrapper_config['show_graphics']
 
@@ -55,6 +76,16 @@ def train_wrapper(env_config, wrapper_config):
         print('invalid agent type')
         raise TypeError
 
+    # hparams: overrides of the agent's hyperparameters (json string or file, e.g. {"BATCH_SIZE": 256})
+    hparams = read_hyperparameters(wrapper_config.get('hparams'))
+    apply_hyperparameters(agent_type, hparams)
+
+    # worker_id (int): port offset of the unity environment (every environment on the same host needs its own)
+    worker_id = wrapper_config.get('worker_id', 0)
+
+    # episode_callback: optional function(i_episode, episode_score, average_score) called after every episode
+    episode_callback = wrapper_config.get('episode_callback')
+
     # print_Agent_loss (bool): whether or not to print the agent's loss (mse for critic) after every episode
     print_agent_loss = wrapper_config['print_agent_loss']
 
@@ -64,13 +95,59 @@ def train_wrapper(env_config, wrapper_config):
     # save_best_weights (bool): save also the best weights of the session (by average score)
     save_best_weights = wrapper_config['save_best_weights']
 
+    # weights_format (files | bundle): layout of the saved weights (bundle = one file with every network)
+    weights_format = wrapper_config.get('weights_format', 'files')
+
+    # memory_budget (str): e.g. 4G - the replay buffers are sized so the agent fits it (None - no budget)
+    memory_budget = wrapper_config.get('memory_budget')
+
+    # print_memory_usage (bool): print the memory used by the agent after every episode
+    print_memory_usage = wrapper_config.get('print_memory_usage', False)
+
+    # action_repeat (int): number of env frames every action is held for (one stored transition per action)
+    action_repeat = wrapper_config.get('action_repeat', 1)
+    if action_repeat < 1:
+        print('--action-repeat must be at least 1')
+        raise ValueError
+
+    # eval_every (int): evaluate a snapshot of the agent without noise every # episodes, in a background process
+    # with its own environment (0 - no evaluation). the evaluation scores then select the best weights
+    eval_every = wrapper_config.get('eval_every', 0)
+    # eval_episodes (int): number of episodes of every evaluation
+    eval_episodes = wrapper_config.get('eval_episodes', 5)
+    # eval_worker_id (int): port offset of the evaluation environment (default is worker_id + 1)
+    eval_worker_id = wrapper_config.get('eval_worker_id')
+    if eval_worker_id is None:
+        eval_worker_id = worker_id + 1
+
+    # continuous (bool): never reset the environment between episodes - a done car is reset on its own while the
+    # other cars keep driving. a (training) episode then ends once num_agents car episodes have finished
+    continuous = wrapper_config.get('continuous', False)
+
+    # env_step_timeout (float): supervise the environment - it runs in a child process, a step taking longer than
+    # this (seconds), a crash or a dead player restart it on a fresh worker id and the training goes on
+    # (None - no supervision)
+    env_step_timeout = wrapper_config.get('env_step_timeout')
+    # env_reset_timeout (float): seconds the launch or a reset of a supervised environment may take
+    env_reset_timeout = wrapper_config.get('env_reset_timeout', 120.0)
+    # max_env_restarts (int): restarts of a supervised environment before the run gives up
+    max_env_restarts = wrapper_config.get('max_env_restarts', 10)
+
+    # record_path: directory to record the steps of the episodes in (observations, actions, rewards, dones)
+    record_path = wrapper_config.get('record_path')
+
     # episode_scores (float): list to record the scores obtained from each episode
     episode_scores = []
 
     """
     Start the Unity Environment
     """
-    env = UnityEnvironment(file_name=build_path, no_graphics=no_graphics_in)
+    if env_step_timeout is not None:
+        env = SupervisedEnvironment(build_path, no_graphics=no_graphics_in, worker_id=worker_id,
+                                    step_timeout=env_step_timeout, reset_timeout=env_reset_timeout,
+                                    max_restarts=max_env_restarts)
+    else:
+        env = open_environment(build_path, no_graphics=no_graphics_in, worker_id=worker_id)
 
     """
     Get The Unity Environment Brain
@@ -125,8 +202,18 @@ def train_wrapper(env_config, wrapper_config):
     # Load trained model weights
     if load_weights:
         agent.load_weights(weights_path)
-    if load_mem:
+    # size the replay buffers before any experience is stored (also before loading the memory)
+    if memory_budget is not None:
+        memory_account = fit_memory_budget(agent, parse_size(memory_budget))
+    else:
+        memory_account = MemoryAccount(agent)
+    if load_mem or resume:
         agent.load_mem(mem_path)
+    # demo_path: recorded demonstrations (.demo) to start the replay buffer with, instead of random exploration
+    if wrapper_config.get('demo_path') is not None:
+        num_transitions = load_demonstrations(agent, wrapper_config['demo_path'], state_size, action_size[0],
+                                              num_agents)
+        print('\nadded {} demonstration transitions to the replay buffer'.format(num_transitions))
 
     """
     ###################################
@@ -149,88 +236,241 @@ def train_wrapper(env_config, wrapper_config):
     """
 
     best_score = -np.inf    # used to determine the best average score so far (for saving best_weights)
-    # loop from num_episodes
-    for i_episode in range(1, num_episodes+1):
-        # reset the unity environment at the beginning of each episode
-        env_info = env.reset(train_mode=True, config=env_config)[brain_name]
-
-        # get initial state of the unity environment
-        states = env_info.vector_observations
-
-        # reset the training agent for new episode
-        agent.reset()
-
-        # set the initial episode score to zero.
-        agent_scores = np.zeros(num_agents)
-
-        # Run the episode training loop;
-        # At each loop step take an action as a function of the current state observations
-        # Based on the resultant environmental state (next_state) and reward received update the agent ('step' method)
-        # If environment episode is done, exit loop...
-        # Otherwise repeat until done == true
-        steps = 0
-        while True:
-            steps = steps+1
-            # determine actions for the unity agents from current sate
-            actions = agent.act(states)
-
-            # send the actions to the unity agents in the environment and receive resultant environment information
-            env_info = env.step(actions)[brain_name]
-
-            next_states = env_info.vector_observations   # get the next states for each unity agent in the environment
-            rewards = env_info.rewards                   # get the rewards for each unity agent in the environment
-            dones = env_info.local_done           # see if episode has finished for each unity agent in the environment
-
-            # Send (S, A, R, S') info to the training agent for replay buffer (memory) and network updates
-            agent.step(states, actions, rewards, next_states, dones)
-
-            # set new states to current states for determining next actions
-            states = next_states
-
-            # Update episode score for each unity agent
-            agent_scores += rewards
-
-            # If any unity agent indicates that the episode is done,
-            # then exit episode loop, to begin new episode
-            if np.any(dones):
-                break
 
-        # Add episode score to Scores and...
-        # Calculate mean score over last 100 episodes
-        # Mean score is calculated over current episodes until i_episode > 100
-        episode_scores.append(np.mean(agent_scores))
-        average_score = np.mean(episode_scores[i_episode-min(i_episode, scores_average_window):i_episode+1])
-
-        # Print current and average score, number of steps in episode.
-        print('\nEpisode {}\tEpisode Score: {:.3f}\tAverage Score: {:.3f}\tNumber Of Steps{}'.format(
-            i_episode, episode_scores[i_episode-1], average_score, steps), end="")
-        if print_agent_loss:
-            # print agent's loss (useful for babysitting the training)
-            print('\t episode loss: {}'.format(agent.debug_loss))
-
-        if save_log:
-            # Save the recorded Scores data (in weights path)
+    evaluator = None
+    evaluation_scores = []  # (episode, mean score, std) of every evaluation
+    if eval_every > 0:
+        evaluator = BackgroundEvaluator(build_path, agent, (state_size, action_size[0], num_agents), env_config,
+                                        hparams, eval_worker_id, eval_episodes, memory_account)
+
+    def handle_evaluations(results):
+        """ log the finished evaluations, and save the best evaluated snapshot """
+        nonlocal best_score
+        for eval_episode, eval_score, eval_std in ((r[0], r[1], r[2]) for r in results):
+            evaluation_scores.append((eval_episode, eval_score, eval_std))
+            print('\nEvaluation of episode {}\tScore: {:.3f} (std {:.3f}, {} episodes)'.format(
+                eval_episode, eval_score, eval_std, eval_episodes), end="")
+        if save_log and results:
             if not (os.path.isdir(weights_path)):
                 os.mkdir(weights_path)
-            scores_filename = "Agent_Scores.csv"
             # noinspection PyTypeChecker
-            np.savetxt(os.path.join(weights_path, scores_filename), episode_scores, delimiter=",")
-
-        # Save trained  Actor and Critic network weights after each episode
-        agent.save_weights(weights_path)
+            np.savetxt(os.path.join(weights_path, "Evaluation_Scores.csv"), evaluation_scores, delimiter=",",
+                       fmt=['%d', '%.5f', '%.5f'], header="episode,score,std", comments="")
         if save_best_weights:
-            if best_score < average_score:
-                best_score = average_score
-                agent.save_weights(weights_path+'_best')
+            for eval_episode, eval_score, _, snapshot in results:
+                if best_score < eval_score:
+                    best_score = eval_score
+                    evaluator.save(snapshot, weights_path+'_best', weights_format, eval_episode)
+
+    recorder = None
+    if record_path is not None:
+        recorder = TrajectoryRecorder(record_path, state_size, action_size[0])
+
+    # the episodes of every car (score and steps), in continuous mode
+    agent_episodes = AgentEpisodes(num_agents)
+
+    # restarts of a supervised environment: (episode, worker id of the failed environment, reason)
+    env_restarts = []
+    env_restarted = False
+    logged_restarts = 0     # restarts of the environment of this run already in env_restarts
+
+    first_episode = 1
+    if resume:
+        trainer_state = load_training_state(agent, mem_path)
+        first_episode = trainer_state['episode'] + 1
+        episode_scores = trainer_state['episode_scores']
+        best_score = trainer_state['best_score']
+        evaluation_scores += trainer_state['evaluation_scores']
+        agent_episodes.finished = trainer_state['car_episodes']
+        env_restarts = trainer_state['env_restarts']
+        print('\nresuming after episode {}'.format(trainer_state['episode']))
+
+    def save_training_checkpoint(last_episode):
+        """ save the replay buffers and then the training state that belongs to them """
+        agent.save_mem(mem_path)
+        save_training_state(agent, mem_path, {'episode': last_episode,
+                                              'episode_scores': episode_scores[:last_episode],
+                                              'best_score': best_score,
+                                              'evaluation_scores': evaluation_scores,
+                                              'car_episodes': agent_episodes.finished,
+                                              'env_restarts': env_restarts})
+
+    def stop_on_environment_failure():
+        """ the environment cannot be restarted any more - keep the replay buffer before the run stops """
+        print('\nsaving the replay buffer before stopping')
+        if checkpoint_every > 0:
+            # a resumed run starts over the failed episode
+            save_training_checkpoint(i_episode - 1)
+        elif mem_path is not None:
+            agent.save_mem(mem_path)
 
-        if save_mem and (i_episode % 50) == 0:
+    try:
+        # loop from num_episodes
+        i_episode = first_episode - 1
+        for i_episode in range(first_episode, num_episodes+1):
+            if not continuous or i_episode == first_episode or env_restarted:
+                # reset the unity environment at the beginning of each episode
+                try:
+                    env_info = env.reset(train_mode=True, config=env_config)[brain_name]
+                except EnvironmentFailed:
+                    stop_on_environment_failure()
+                    raise
+                if env_restarted:
+                    # the episodes of the cars in the failed environment are lost
+                    agent_episodes.abandon()
+                env_restarted = False
+
+                # get initial state of the unity environment
+                states = env_info.vector_observations
+                # every car starts a new episode (in continuous mode, only the cars that start over by themselves
+                # do later - step() restarts them)
+                agent.restart()
+                # cars that start over on the next step (continuous mode) - none after a reset
+                starting = np.zeros(num_agents, dtype=bool)
+
+            # reset the training agent for new episode
+            agent.reset()
+
+            # set the initial episode score to zero.
+            agent_scores = np.zeros(num_agents)
+            # car episodes finished during this episode (continuous mode)
+            finished_episodes = []
+
+            # Run the episode training loop;
+            # At each loop step take an action as a function of the current state observations
+            # Based on the resultant environmental state (next_state) and reward received update the agent
+            # ('step' method)
+            # If environment episode is done, exit loop...
+            # Otherwise repeat until done == true
+            steps = 0
+            frames = 0
+            episode_start = time.time()
+            while True:
+                steps = steps+1
+                # determine actions for the unity agents from current sate
+                actions = agent.act(states)
+
+                # send the actions to the unity agents in the environment (held for action_repeat frames) and
+                # receive the next states, the rewards summed over the frames and whether the episode has finished
+                # for each agent
+                try:
+                    next_states, rewards, dones, num_frames = step_environment(env, brain_name, actions, action_repeat)
+                except EnvironmentRestarted:
+                    # a fresh environment replaced the failed one: the episode ends here, without its last step
+                    env_restarted = True
+                    break
+                except EnvironmentFailed:
+                    stop_on_environment_failure()
+                    raise
+                frames += num_frames
+                if recorder is not None:
+                    recorder.record(i_episode, states, actions, rewards, dones)
+
+                # Send (S, A, R, S') info to the training agent for replay buffer (memory) and network updates
+                # in continuous mode, the cars done on the previous step were reset before this step: their transition
+                # starts from the terminal state of their previous episode, it is not stored
+                agent.step(states, actions, rewards, next_states, dones, valid=None if not continuous else ~starting)
+                starting = np.asarray(dones, dtype=bool)
+
+                # set new states to current states for determining next actions
+                states = next_states
+
+                # Update episode score for each unity agent
+                agent_scores += rewards
+
+                if continuous:
+                    # the done cars start over by themselves, the episode ends after num_agents car episodes
+                    finished_episodes += agent_episodes.add(rewards, dones)
+                    if len(finished_episodes) >= num_agents:
+                        break
+                # If any unity agent indicates that the episode is done,
+                # then exit episode loop, to begin new episode
+                elif np.any(dones):
+                    break
+
+            # Add episode score to Scores and...
+            # Calculate mean score over last 100 episodes
+            # Mean score is calculated over current episodes until i_episode > 100
+            if continuous and finished_episodes:
+                episode_scores.append(np.mean([score for _, score, _ in finished_episodes]))
+            else:
+                episode_scores.append(np.mean(agent_scores))
+            average_score = np.mean(episode_scores[i_episode-min(i_episode, scores_average_window):i_episode+1])
+
+            # Print current and average score, number of steps in episode.
+            print('\nEpisode {}\tEpisode Score: {:.3f}\tAverage Score: {:.3f}\tNumber Of Steps{}'.format(
+                i_episode, episode_scores[i_episode-1], average_score, steps), end="")
+            if action_repeat > 1:
+                print('\tAction Repeat {}\tFrames {}\tFrames/sec {:.1f}'.format(
+                    action_repeat, frames, frames / (time.time() - episode_start)), end="")
+            if continuous and finished_episodes:
+                print('\tCar Episodes {}\tMean Car Episode Steps {:.1f}'.format(
+                    len(finished_episodes), np.mean([length for _, _, length in finished_episodes])), end="")
+            if env_step_timeout is not None:
+                env_restarts += [(i_episode, failed_worker_id, reason)
+                                 for failed_worker_id, reason in env.restart_log[logged_restarts:]]
+                logged_restarts = len(env.restart_log)
+                if env_restarts:
+                    print('\tEnv Restarts {}'.format(len(env_restarts)), end="")
+            if print_agent_loss:
+                # print agent's loss (useful for babysitting the training)
+                print('\t' + format_stats(agent.episode_stats()))
+
+            if print_memory_usage:
+                print('\t memory: {}'.format(memory_account.report()))
+
+            if episode_callback is not None:
+                episode_callback(i_episode, episode_scores[i_episode-1], average_score)
+
+            if save_log:
+                # Save the recorded Scores data (in weights path)
+                if not (os.path.isdir(weights_path)):
+                    os.mkdir(weights_path)
+                scores_filename = "Agent_Scores.csv"
+                # noinspection PyTypeChecker
+                np.savetxt(os.path.join(weights_path, scores_filename), episode_scores, delimiter=",")
+                if continuous:
+                    # noinspection PyTypeChecker
+                    np.savetxt(os.path.join(weights_path, "Car_Episodes.csv"),
+                               np.reshape(agent_episodes.finished, (-1, 3)), delimiter=",",
+                               fmt=['%d', '%.5f', '%d'], header="car,score,steps", comments="")
+                if env_restarts:
+                    with open(os.path.join(weights_path, "Environment_Restarts.csv"), 'w', newline='') as f:
+                        writer = csv.writer(f)
+                        writer.writerow(['episode', 'worker_id', 'reason'])
+                        writer.writerows(env_restarts)
+
+            # Save trained  Actor and Critic network weights after each episode
+            save_checkpoint(agent, weights_path, weights_format, episode=i_episode)
+            if evaluator is not None:
+                # hand over a snapshot (the evaluator runs in its own process), and collect the finished evaluations
+                if i_episode % eval_every == 0:
+                    evaluator.submit(i_episode)
+                handle_evaluations(evaluator.poll())
+            elif save_best_weights:
+                if best_score < average_score:
+                    best_score = average_score
+                    save_checkpoint(agent, weights_path+'_best', weights_format, episode=i_episode)
+
+            if checkpoint_every > 0 and (i_episode % checkpoint_every) == 0:
+                save_training_checkpoint(i_episode)
+            elif save_mem and (i_episode % 50) == 0:
+                agent.save_mem(mem_path)
+            # Check to see if the task is solved (i.e,. average_score > solved_score over 100 episodes).
+            # If yes, save the network weights and scores and end training.
+            if i_episode > scores_average_window*2 and average_score >= solved_score:
+                print('\nEnvironment solved in {:d} episodes!\tAverage Score: {:.3f}'.format(i_episode, average_score))
+                break
+        if checkpoint_every > 0:
+            save_training_checkpoint(i_episode)
+        elif mem_path is not None:
             agent.save_mem(mem_path)
-        # Check to see if the task is solved (i.e,. average_score > solved_score over 100 episodes).
-        # If yes, save the network weights and scores and end training.
-        if i_episode > scores_average_window*2 and average_score >= solved_score:
-            print('\nEnvironment solved in {:d} episodes!\tAverage Score: {:.3f}'.format(i_episode, average_score))
-            break
-    agent.save_mem(mem_path)
+        if evaluator is not None:
+            handle_evaluations(evaluator.close())
+    finally:
+        # the chunks recorded so far stay readable when the training stops early
+        if recorder is not None:
+            recorder.close()
 
     """
     ###################################
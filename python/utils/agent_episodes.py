@@ -0,0 +1,46 @@
+"""
+bookkeeping of the episodes of every car, for continuous rollouts.
+in a continuous rollout the environment is not reset when a car is done - the done car is reset by the
+environment on its next step (unity agents reset themselves when they are done, and so does the stand-in),
+while the other cars keep driving. every car then has its own sequence of episodes.
+"""
+
+import numpy as np
+
+
+class AgentEpisodes:
+    def __init__(self, num_agents):
+        """ :param num_agents: number of cars """
+        self.scores = np.zeros(num_agents)     # score of the ongoing episode of every car
+        self.lengths = np.zeros(num_agents, dtype=int)     # steps of the ongoing episode of every car
+        self.finished = []      # (car, score, steps) of every finished episode, in order
+        # id of the ongoing episode of every car, the episodes are numbered in the order they start
+        self.episode_ids = np.arange(num_agents)
+        self.next_id = num_agents
+
+    def add(self, rewards, dones):
+        """
+        add one step of all the cars.
+        :param rewards: rewards of the step (num_agents,)
+        :param dones: whether the episode of each car ended with the step (num_agents,)
+        :return: (car, score, steps) of the episodes finished by the step
+        """
+        self.scores += rewards
+        self.lengths += 1
+        finished = [(int(car), float(self.scores[car]), int(self.lengths[car])) for car in np.flatnonzero(dones)]
+        self.scores[np.asarray(dones, dtype=bool)] = 0
+        self.lengths[np.asarray(dones, dtype=bool)] = 0
+        self._start(np.asarray(dones, dtype=bool))
+        self.finished += finished
+        return finished
+
+    def _start(self, cars):
+        """ the cars (boolean mask) start new episodes """
+        self.episode_ids[cars] = self.next_id + np.arange(np.count_nonzero(cars))
+        self.next_id += int(np.count_nonzero(cars))
+
+    def abandon(self):
+        """ drop the ongoing episodes (e.g. the environment was restarted) """
+        self.scores[:] = 0
+        self.lengths[:] = 0
+        self._start(np.ones(len(self.scores), dtype=bool))
@@ -0,0 +1,185 @@
+"""
+periodic evaluation of the policy while training, in a separate process with its own environment.
+the training loop hands over a snapshot of the actors and keeps going; the evaluator runs noise-free episodes
+with it and answers with the score. the training loop collects the answers when it is between episodes.
+"""
+
+import multiprocessing
+
+import numpy as np
+
+from agent import AgentABC
+from distributed.protocol import pack_actor_weights, unpack_actor_weights
+from utils.memory_budget import MemoryAccount
+from utils.checkpoint import save_checkpoint, random_states, set_random_states
+from utils.hyperparameters import apply_hyperparameters
+
+CLOSE_TIMEOUT = 600     # seconds close() waits for an evaluation (or for the evaluator to stop) before giving up
+
+
+def _evaluator_process(build_path, agent_type, state_size, action_size, num_agents, env_config, hparams, worker_id,
+                       num_episodes, pipe):
+    """ process target - receives (episode, actor weights), answers (episode, mean score, std of the scores) """
+    import torch
+    from test import run_test_episode
+    from utils.environment import open_environment
+    # a spawned process starts with the default constants - the agent needs the ones of the training agent
+    apply_hyperparameters(agent_type, hparams)
+    # keep the cores for the training process
+    torch.set_num_threads(1)
+    env = open_environment(build_path, worker_id=worker_id, seed=worker_id)
+    brain_name = env.brain_names[0]
+    agent: AgentABC = agent_type(state_size=state_size, action_size=action_size, num_agents=num_agents,
+                                 random_seed=0)
+    while True:
+        try:
+            message = pipe.recv()
+        except EOFError:
+            # the training process is gone
+            break
+        if message is None:
+            break
+        i_episode, weights = message
+        unpack_actor_weights(agent.actors(), weights)
+        scores = [np.mean(run_test_episode(env, brain_name, agent, env_config, train_mode=True)[0])
+                  for _ in range(num_episodes)]
+        pipe.send((i_episode, float(np.mean(scores)), float(np.std(scores))))
+    env.close()
+
+
+def _snapshot(agent: AgentABC):
+    """ :return: copy of every network of the agent (local and target state dicts, on the cpu), bytes """
+    snapshot = {name: ({k: v.detach().cpu().clone() for k, v in local.state_dict().items()},
+                       {k: v.detach().cpu().clone() for k, v in target.state_dict().items()})
+                for name, (local, target) in agent.networks().items()}
+    num_bytes = sum(t.numel() * t.element_size() for local, target in snapshot.values()
+                    for t in list(local.values()) + list(target.values()))
+    return snapshot, num_bytes
+
+
+class BackgroundEvaluator:
+    def __init__(self, build_path, agent: AgentABC, sizes, env_config, hparams, worker_id, num_episodes,
+                 memory_account: MemoryAccount):
+        """
+        :param build_path: build of the evaluation environment
+        :param agent: the training agent
+        :param sizes: (state_size, action_size, num_agents) of the agent
+        :param env_config: dictionary, used to pass parameters into the environment
+        :param hparams: dictionary, the hyperparameter overrides of the training agent (e.g. FRAME_HISTORY)
+        :param worker_id: unity worker id of the evaluation environment (must differ from the training one)
+        :param num_episodes: number of noise-free episodes of every evaluation
+        :param memory_account: the snapshots waiting for their evaluation are accounted here
+        """
+        self.agent = agent
+        self.sizes = sizes
+        self.memory_account = memory_account
+        # holds a snapshot for saving it. creating an agent seeds the random generators - they are restored, so the
+        # training (and a resumed training) draws the same numbers as without evaluations
+        states = random_states()
+        self.shadow_agent = type(agent)(state_size=sizes[0], action_size=sizes[1], num_agents=sizes[2],
+                                        random_seed=0)
+        set_random_states(states)
+        self.failed = False     # the evaluator died - no more evaluations
+        self.snapshots = {}     # episode -> networks snapshot, until its evaluation is back
+        self.actor_weights = {}     # episode -> the actors of the snapshot, packed for the evaluator
+        self.in_flight = None   # episode being evaluated
+        self.waiting = None     # newest episode waiting for the evaluator (older waiting snapshots are dropped)
+        context = multiprocessing.get_context('spawn')
+        self.pipe, child_pipe = context.Pipe()
+        self.process = context.Process(target=_evaluator_process, daemon=True,
+                                       args=(build_path, type(agent), *sizes, env_config, hparams, worker_id,
+                                             num_episodes, child_pipe))
+        self.process.start()
+        # only the child holds its end, so the pipe reports the end of the child (EOFError)
+        child_pipe.close()
+
+    def _send(self, i_episode):
+        # the evaluator only reads when it is idle, so only one snapshot is sent at a time (send never blocks)
+        self.in_flight = i_episode
+        try:
+            self.pipe.send((i_episode, self.actor_weights[i_episode]))
+        except ConnectionError as e:
+            self._fail(e)
+
+    def submit(self, i_episode):
+        """ snapshot the agent after episode i_episode and evaluate it as soon as the evaluator is free """
+        if self.failed:
+            return
+        self.snapshots[i_episode], num_bytes = _snapshot(self.agent)
+        self.actor_weights[i_episode] = pack_actor_weights(self.agent.actors())
+        self.memory_account.add_pending('evaluation_{}'.format(i_episode),
+                                        num_bytes + self.actor_weights[i_episode].nbytes)
+        if self.in_flight is None:
+            self._send(i_episode)
+            return
+        if self.waiting is not None:
+            self._release(self.waiting)
+        self.waiting = i_episode
+
+    def _release(self, i_episode):
+        self.snapshots.pop(i_episode, None)
+        self.actor_weights.pop(i_episode, None)
+        self.memory_account.remove_pending('evaluation_{}'.format(i_episode))
+
+    def _fail(self, error):
+        """ the evaluator died: log it, drop the waiting snapshots and go on training without evaluations """
+        print('\nthe background evaluator failed ({!r}), evaluation is disabled'.format(error))
+        self.failed = True
+        for i_episode in [e for e in (self.in_flight, self.waiting) if e is not None]:
+            self._release(i_episode)
+        self.in_flight = None
+        self.waiting = None
+
+    def _receive(self):
+        """ :return: the next evaluation (as poll), or None if the evaluator died """
+        try:
+            i_episode, mean, std = self.pipe.recv()
+        except (EOFError, ConnectionError) as e:
+            self._fail(e)
+            return None
+        self.in_flight = None
+        waiting, self.waiting = self.waiting, None
+        if waiting is not None:
+            self._send(waiting)
+        snapshot = self.snapshots[i_episode]
+        self._release(i_episode)
+        return i_episode, mean, std, snapshot
+
+    def save(self, snapshot, directory_path, weights_format, i_episode):
+        """ save a networks snapshot returned with an evaluation (e.g. as the best weights) """
+        for name, (local, target) in self.shadow_agent.networks().items():
+            local.load_state_dict(snapshot[name][0])
+            target.load_state_dict(snapshot[name][1])
+        save_checkpoint(self.shadow_agent, directory_path, weights_format, episode=i_episode)
+
+    def poll(self):
+        """ :return: the finished evaluations (episode, mean score, std, networks snapshot), without waiting """
+        results = []
+        while self.in_flight is not None and self.pipe.poll():
+            result = self._receive()
+            if result is not None:
+                results.append(result)
+        return results
+
+    def close(self):
+        """ wait for the submitted evaluations and stop the evaluator :return: their results (as poll) """
+        results = []
+        while self.in_flight is not None:
+            if not self.pipe.poll(CLOSE_TIMEOUT):
+                # e.g. its environment hangs - the run ends without the evaluations still pending
+                self._fail(TimeoutError('no evaluation within {} seconds'.format(CLOSE_TIMEOUT)))
+                self.process.terminate()
+                break
+            result = self._receive()
+            if result is not None:
+                results.append(result)
+        if not self.failed:
+            try:
+                self.pipe.send(None)
+            except ConnectionError:
+                pass
+        self.process.join(CLOSE_TIMEOUT)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        return results
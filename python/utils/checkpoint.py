@@ -0,0 +1,189 @@
+"""
+consolidated checkpoint: one file per save holding every network of the agent, with metadata.
+the classic layout (one file per network, sub-directories for mddpg) is still read and written by the
+agents' load_weights / save_weights. load_weights reads the bundle instead when the directory contains one, so
+save_weights removes the bundle of the directory (the files are then the newest weights).
+
+training state: everything a resumed training needs besides the replay buffers - local and target networks,
+optimizers, the agent's counters and noise, the random generators and the trainer's own state (episode, scores).
+it is saved in the replay buffer dir, next to the replay buffers it belongs to.
+"""
+
+import os
+import random
+
+import numpy as np
+import torch
+
+BUNDLE_FILENAME = "checkpoint.pth"
+BUNDLE_FORMAT = 1
+TRAINING_STATE_FILENAME = "training_state.pth"
+TRAINING_STATE_FORMAT = 1
+
+
+def random_states():
+    """ :return: the states of the python, numpy, torch and cuda random generators """
+    return {'python': random.getstate(),
+            'numpy': np.random.get_state(),
+            'torch': torch.get_rng_state(),
+            'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None}
+
+
+def set_random_states(states):
+    """ restore the random generators from random_states() """
+    random.setstate(states['python'])
+    np.random.set_state(states['numpy'])
+    torch.set_rng_state(states['torch'])
+    if states['cuda'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(states['cuda'])
+
+
+def save_bundle(agent, directory_path, episode=None):
+    """
+    save every local network of the agent in one file.
+    :param agent: the agent (AgentABC)
+    :param directory_path: weights directory, the bundle is saved as BUNDLE_FILENAME inside it
+    :param episode: episode of the save (metadata only)
+    """
+    if not os.path.isdir(directory_path):
+        os.makedirs(directory_path)
+    bundle = {'format': BUNDLE_FORMAT,
+              'agent': type(agent).__module__,
+              'state_size': agent.state_size,
+              'action_size': agent.action_size,
+              'num_agents': agent.num_agents,
+              'episode': episode,
+              'networks': {name: local.state_dict() for name, (local, _) in agent.networks().items()}}
+    # write next to the bundle and rename, so a reader (e.g. the policy server) never sees half a file
+    tmp_path = os.path.join(directory_path, BUNDLE_FILENAME + '.tmp')
+    torch.save(bundle, tmp_path)
+    os.replace(tmp_path, os.path.join(directory_path, BUNDLE_FILENAME))
+
+
+def read_bundle(path, map_location=None, mmap=False):
+    """
+    :param path: bundle file, or weights directory containing one
+    :param map_location: torch.load map_location
+    :param mmap: memory map the file instead of reading it (the tensors are paged in when first used)
+    :return: the bundle dictionary (metadata + 'networks')
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, BUNDLE_FILENAME)
+    return torch.load(path, map_location=map_location, mmap=mmap)
+
+
+def has_bundle(directory_path):
+    return os.path.isfile(os.path.join(directory_path, BUNDLE_FILENAME))
+
+
+def remove_bundle(directory_path):
+    """ remove the bundle of a weights directory (called when the agent saves its weights as files) """
+    if has_bundle(directory_path):
+        os.remove(os.path.join(directory_path, BUNDLE_FILENAME))
+
+
+def load_bundle(agent, directory_path, map_location=None, mmap=False):
+    """
+    load a bundle into the agent. every tensor is read once and copied into both the local and the target network.
+    :return: the bundle metadata (without the networks)
+    """
+    bundle = read_bundle(directory_path, map_location=map_location, mmap=mmap)
+    _check_metadata(bundle, agent, 'checkpoint')
+    networks = bundle.pop('networks')
+    for name, (local, target) in agent.networks().items():
+        local.load_state_dict(networks[name])
+        target.load_state_dict(networks[name])
+    return bundle
+
+
+def _check_metadata(saved, agent, what):
+    """ the saved agent type and sizes must be those of the agent """
+    for key in ['agent', 'state_size', 'action_size', 'num_agents']:
+        expected = type(agent).__module__ if key == 'agent' else getattr(agent, key)
+        if saved[key] != expected:
+            print('{} {} is {} but the agent has {}'.format(what, key, saved[key], expected))
+            raise ValueError(key)
+
+
+def save_training_state(agent, directory_path, trainer_state):
+    """
+    save the full state of a training (the replay buffers are saved by agent.save_mem, in the same dir).
+    :param agent: the agent (AgentABC)
+    :param directory_path: replay buffer dir, the state is saved as TRAINING_STATE_FILENAME inside it
+    :param trainer_state: picklable dictionary of the trainer (episode, scores, ...)
+    """
+    if not os.path.isdir(directory_path):
+        os.makedirs(directory_path)
+    state = {'format': TRAINING_STATE_FORMAT,
+             'agent': type(agent).__module__,
+             'state_size': agent.state_size,
+             'action_size': agent.action_size,
+             'num_agents': agent.num_agents,
+             'networks': {name: (local.state_dict(), target.state_dict())
+                          for name, (local, target) in agent.networks().items()},
+             'optimizers': {name: optimizer.state_dict() for name, optimizer in agent.optimizers().items()},
+             'agent_state': agent.training_state(),
+             'replay_sizes': [len(buffer) for buffer in agent.replay_buffers()],
+             'random': random_states(),
+             'trainer': trainer_state}
+    tmp_path = os.path.join(directory_path, TRAINING_STATE_FILENAME + '.tmp')
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, os.path.join(directory_path, TRAINING_STATE_FILENAME))
+
+
+def has_training_state(directory_path):
+    return directory_path is not None and os.path.isfile(os.path.join(directory_path, TRAINING_STATE_FILENAME))
+
+
+def load_training_state(agent, directory_path, map_location=None):
+    """
+    restore the state saved by save_training_state into the agent (load its replay buffers first, with load_mem)
+    and the random generators.
+    :return: the trainer state
+    """
+    # the file holds numpy and python objects besides tensors (our own file)
+    state = torch.load(os.path.join(directory_path, TRAINING_STATE_FILENAME), map_location=map_location,
+                       weights_only=False)
+    _check_metadata(state, agent, 'training state')
+    for name, (local, target) in agent.networks().items():
+        local.load_state_dict(state['networks'][name][0])
+        target.load_state_dict(state['networks'][name][1])
+    for name, optimizer in agent.optimizers().items():
+        optimizer.load_state_dict(state['optimizers'][name])
+    agent.load_training_state(state['agent_state'])
+    replay_sizes = [len(buffer) for buffer in agent.replay_buffers()]
+    if replay_sizes != state['replay_sizes']:
+        # e.g. the replay buffers were saved again after the training state
+        print('warning: the replay buffers have {} experiences, the training state was saved with {}'.format(
+            replay_sizes, state['replay_sizes']))
+    set_random_states(state['random'])
+    return state['trainer']
+
+
+def save_checkpoint(agent, directory_path, weights_format='files', episode=None):
+    """
+    save the agent's weights in the selected format.
+    :param weights_format: 'files' (the agent's own save_weights layout) or 'bundle' (one file)
+    """
+    if weights_format == 'bundle':
+        save_bundle(agent, directory_path, episode=episode)
+    else:
+        agent.save_weights(directory_path)
+
+
+def convert_wrapper(env_config, wrapper_config):
+    """
+    convert a weights directory in the classic layout (e.g. example_weights) into a bundle.
+    :param env_config: dictionary, the environment parameters (num_agents)
+    :param wrapper_config: dictionary of user defined variables.
+    """
+    weights_path = wrapper_config['weights_path']
+    if not os.path.isdir(weights_path):
+        print('--weights-path is not a valid directory')
+        raise NotADirectoryError
+    agent = wrapper_config['agent'](state_size=wrapper_config['state_size'], action_size=wrapper_config['action_size'],
+                                    num_agents=env_config['num_agents'], random_seed=0)
+    agent.load_weights(weights_path)
+    output_path = wrapper_config['output_path'] or weights_path
+    save_bundle(agent, output_path)
+    print('saved {}'.format(os.path.join(output_path, BUNDLE_FILENAME)))
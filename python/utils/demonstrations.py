@@ -0,0 +1,254 @@
+"""
+ML-Agents demonstration files (.demo, recorded in Unity with the DemonstrationRecorder component).
+file layout (see UnityEnvs/Assets/ML-Agents/Scripts/DemonstrationStore.cs):
+    DemonstrationMetaProto   (length delimited, at offset 0)
+    BrainParametersProto     (length delimited, at offset META_DATA_BYTES + 1)
+    AgentInfoProto * number_steps (length delimited)
+the file is streamed message by message and the protobuf messages are decoded here directly (no protobuf /
+mlagents dependency), the repeated float fields straight into numpy arrays. the steps are then converted into
+(s, a, r, s', done) arrays that pre-fill the replay buffers.
+"""
+
+import os
+import struct
+
+import numpy as np
+
+from agent import AgentABC
+
+META_DATA_BYTES = 32    # DemonstrationStore.MetaDataBytes
+API_VERSION = 1         # DemonstrationMetaData.ApiVersion
+DEMO_EXTENSION = '.demo'
+
+# protobuf wire types
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+_FIXED32 = 5
+
+
+def _read_varint(buffer, pos):
+    """ :return: (value, position after the varint) """
+    result = 0
+    shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(buffer, pos, end):
+    """ iterate over the fields of a message: (field number, wire type, value or (start, end) of the bytes) """
+    while pos < end:
+        key, pos = _read_varint(buffer, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == _VARINT:
+            value, pos = _read_varint(buffer, pos)
+        elif wire_type == _FIXED32:
+            value, pos = (pos, pos + 4), pos + 4
+        elif wire_type == _FIXED64:
+            value, pos = (pos, pos + 8), pos + 8
+        elif wire_type == _LENGTH_DELIMITED:
+            length, pos = _read_varint(buffer, pos)
+            value, pos = (pos, pos + length), pos + length
+        else:
+            print('unsupported protobuf wire type {}'.format(wire_type))
+            raise ValueError(wire_type)
+        yield field, wire_type, value
+
+
+def _floats(buffer, wire_type, value):
+    """ repeated float field - packed (one block) or not packed (one float) """
+    start, end = value
+    if wire_type == _LENGTH_DELIMITED:
+        return np.frombuffer(buffer, dtype='<f4', count=(end - start) // 4, offset=start)
+    return np.frombuffer(buffer, dtype='<f4', count=1, offset=start)
+
+
+def _read_message(f):
+    """ :return: the bytes of the next length delimited message of the file """
+    length = 0
+    shift = 0
+    while True:
+        byte = f.read(1)
+        if not byte:
+            print('unexpected end of the demonstration file')
+            raise EOFError
+        length |= (byte[0] & 0x7f) << shift
+        if not byte[0] & 0x80:
+            break
+        shift += 7
+    message = f.read(length)
+    if len(message) != length:
+        print('unexpected end of the demonstration file')
+        raise EOFError
+    return message
+
+
+def _parse_meta(buffer, start, end):
+    meta = {'api_version': 0, 'demonstration_name': '', 'number_steps': 0, 'number_episodes': 0, 'mean_reward': 0.0}
+    for field, wire_type, value in _fields(buffer, start, end):
+        if field == 1:
+            meta['api_version'] = value
+        elif field == 2:
+            meta['demonstration_name'] = bytes(buffer[value[0]:value[1]]).decode('utf-8')
+        elif field == 3:
+            meta['number_steps'] = value
+        elif field == 4:
+            meta['number_episodes'] = value
+        elif field == 5:
+            meta['mean_reward'] = struct.unpack_from('<f', buffer, value[0])[0]
+    return meta
+
+
+def _parse_brain_parameters(buffer, start, end):
+    brain = {'vector_observation_size': 0, 'num_stacked_vector_observations': 1, 'vector_action_size': [],
+             'brain_name': ''}
+    for field, wire_type, value in _fields(buffer, start, end):
+        if field == 1:
+            brain['vector_observation_size'] = value
+        elif field == 2:
+            brain['num_stacked_vector_observations'] = value
+        elif field == 3:
+            if wire_type == _LENGTH_DELIMITED:
+                pos, packed_end = value
+                while pos < packed_end:
+                    size, pos = _read_varint(buffer, pos)
+                    brain['vector_action_size'].append(size)
+            else:
+                brain['vector_action_size'].append(value)
+        elif field == 7:
+            brain['brain_name'] = bytes(buffer[value[0]:value[1]]).decode('utf-8')
+    return brain
+
+
+def read_demonstration(path):
+    """
+    decode a .demo file.
+    :param path: path of the file
+    :return: (meta data dictionary, brain parameters dictionary,
+              dictionary agent id -> dictionary of arrays 'observations' (steps, observation size),
+              'actions' (steps, action size) - the action stored with the step is the action that led to it,
+              'rewards' (steps,), 'dones' (steps,))
+    """
+    with open(path, 'rb') as f:
+        message = _read_message(f)
+        meta = _parse_meta(message, 0, len(message))
+        if meta['api_version'] != API_VERSION:
+            print('{}: unsupported demonstration api version {}'.format(path, meta['api_version']))
+            raise ValueError(meta['api_version'])
+        f.seek(META_DATA_BYTES + 1)
+        message = _read_message(f)
+        brain = _parse_brain_parameters(message, 0, len(message))
+        observation_size = brain['vector_observation_size'] * brain['num_stacked_vector_observations']
+        action_size = sum(brain['vector_action_size'])
+
+        # every step goes into preallocated arrays, grouped by agent id afterwards
+        num_steps = meta['number_steps']
+        observations = np.zeros((num_steps, observation_size), dtype=np.float32)
+        actions = np.zeros((num_steps, action_size), dtype=np.float32)
+        rewards = np.zeros(num_steps, dtype=np.float32)
+        dones = np.zeros(num_steps, dtype=bool)
+        ids = np.zeros(num_steps, dtype=np.int64)
+        for i in range(num_steps):
+            message = _read_message(f)
+            for field, wire_type, value in _fields(message, 0, len(message)):
+                if field == 1:
+                    floats = _floats(message, wire_type, value)
+                    observations[i, :len(floats)] = floats
+                elif field == 4:
+                    floats = _floats(message, wire_type, value)
+                    actions[i, :len(floats)] = floats
+                elif field == 7:
+                    rewards[i] = struct.unpack_from('<f', message, value[0])[0]
+                elif field == 8:
+                    dones[i] = bool(value)
+                elif field == 10:
+                    ids[i] = value
+
+    agents = {}
+    for agent_id in np.unique(ids):
+        mask = ids == agent_id
+        agents[int(agent_id)] = {'observations': observations[mask], 'actions': actions[mask],
+                                 'rewards': rewards[mask], 'dones': dones[mask]}
+    return meta, brain, agents
+
+
+def demonstration_transitions(steps):
+    """
+    convert the recorded steps of one agent into transitions.
+    transition t: s = observation t, a / r / s' / done = action, reward, observation and done of step t+1.
+    there is no transition from the last step of an episode (the next step belongs to a new episode).
+    :param steps: dictionary of arrays of one agent (returned by read_demonstration)
+    :return: (states, actions, rewards, next_states, dones) arrays, one row per transition
+    """
+    valid = ~steps['dones'][:-1]
+    return (steps['observations'][:-1][valid], steps['actions'][1:][valid], steps['rewards'][1:][valid],
+            steps['observations'][1:][valid], steps['dones'][1:][valid])
+
+
+def demonstration_files(path):
+    """ :return: the .demo files of a file or directory path (sorted) """
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(DEMO_EXTENSION))
+    if os.path.isfile(path):
+        return [path]
+    print('{} is not a demonstration file or directory'.format(path))
+    raise FileNotFoundError(path)
+
+
+def _aligned_steps(recorded):
+    """
+    :param recorded: dictionaries of arrays, the recorded steps of every car (returned by read_demonstration)
+    :return: the steps stacked by time (arrays (steps, num cars, ...)), or None if the cars cannot be aligned
+    """
+    # the cars of one recording session have the same number of steps and end their episodes at the same steps.
+    # anything else (other sessions, cars that start over on their own) has no common time step
+    dones = recorded[0]['dones']
+    if any(len(steps['dones']) != len(dones) or not np.array_equal(steps['dones'], dones) for steps in recorded):
+        return None
+    return {key: np.stack([steps[key] for steps in recorded], axis=1) for key in recorded[0]}
+
+
+def load_demonstrations(agent: AgentABC, path, state_size, action_size, num_agents):
+    """
+    pre-fill the replay buffers of an agent with the transitions of demonstration files.
+    every recorded car is a stream of transitions. when there are exactly num_agents cars recorded together (the
+    same number of steps, and the same episode ends), they are aligned by episode and step: row t holds step t of
+    every car, as maddpg needs. otherwise all the streams are pooled and cut into num_agents columns (fine for
+    ddpg / mddpg, whose cars learn separately - maddpg refuses them).
+    :param agent: the agent
+    :param path: a .demo file or a directory of .demo files
+    :return: number of transitions added
+    """
+    recorded = []
+    for demo_path in demonstration_files(path):
+        meta, brain, agents = read_demonstration(demo_path)
+        if brain['vector_observation_size'] * brain['num_stacked_vector_observations'] != state_size \
+                or sum(brain['vector_action_size']) != action_size:
+            print('{}: the recorded observation / action sizes do not match the agent'.format(demo_path))
+            raise ValueError(demo_path)
+        recorded += list(agents.values())
+    if not recorded:
+        print('no demonstrations found in {}'.format(path))
+        raise FileNotFoundError(path)
+
+    stacked = _aligned_steps(recorded) if len(recorded) == num_agents else None
+    aligned = stacked is not None
+    if aligned:
+        # the joint transitions of the steps t -> t+1, as in demonstration_transitions (the cars end their episodes
+        # together, the dones of the first car stand for all)
+        valid = ~stacked['dones'][:-1, 0]
+        arrays = [stacked['observations'][:-1][valid], stacked['actions'][1:][valid], stacked['rewards'][1:][valid],
+                  stacked['observations'][1:][valid], stacked['dones'][1:][valid]]
+        length = len(arrays[0])
+    else:
+        streams = [demonstration_transitions(steps) for steps in recorded]
+        pooled = [np.concatenate([stream[k] for stream in streams]) for k in range(5)]
+        length = len(pooled[0]) // num_agents
+        arrays = [a[:length * num_agents].reshape(num_agents, length, *a.shape[1:]).swapaxes(0, 1) for a in pooled]
+    agent.add_experiences(*arrays, aligned=aligned)
+    return length * num_agents
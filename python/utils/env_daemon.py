@@ -0,0 +1,313 @@
+"""
+environment daemon: a long lived process that keeps a pool of launched environments, so runs do not pay the start
+of the unity player (and its handshake) every time.
+a run leases an environment by name (or any free one) with --build env-daemon[:host:port][/name], uses it through
+the usual api (reset with its own env_config, step) and returns it to the pool on close - or when its connection
+drops. every environment of the pool is supervised (utils/env_watchdog.py): a player that hangs or crashes is
+restarted inside the daemon, the run sees EnvironmentRestarted as with a supervised environment of its own.
+the wire format is the frame format of distributed/protocol.py: json for the control messages, raw arrays for the
+steps.
+"""
+
+import json
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+from distributed.protocol import send_frame, recv_frame
+from utils.environment import resolve_build_path
+from utils.env_watchdog import SupervisedEnvironment, EnvironmentRestarted, EnvironmentFailed, describe_brains, \
+    brains_from_description
+from utils.stand_in_env import BrainInfo
+
+# message types
+LEASE = 1       # run -> daemon: {name} of the environment, null for any free one
+LEASED = 2      # daemon -> run: {name, worker_id, brains} of the leased environment
+QUEUED = 3      # daemon -> run: every (matching) environment is leased, the lease waits for one to be returned
+RESET = 4       # run -> daemon: {train_mode, config}
+STEP = 5        # run -> daemon: float32 actions
+INFOS = 6       # daemon -> run: the brain infos of a reset or a step
+RELEASE = 7     # run -> daemon: return the environment to the pool
+ERROR = 8       # daemon -> run: {kind, message}
+
+BRAINS_HEADER = struct.Struct('!H')     # number of brains
+BRAIN_HEADER = struct.Struct('!HII')    # length of the brain name, number of agents, observation size
+
+
+def pack_brain_infos(infos):
+    """ pack the brain infos of a reset or a step (observations, rewards, dones and agent ids of every brain) """
+    parts = [BRAINS_HEADER.pack(len(infos))]
+    for name, info in infos.items():
+        observations = np.asarray(info.vector_observations, dtype=np.float32)
+        encoded_name = name.encode()
+        parts += [BRAIN_HEADER.pack(len(encoded_name), len(observations), observations.shape[1]), encoded_name,
+                  np.ascontiguousarray(observations).tobytes(),
+                  np.asarray(info.rewards, dtype=np.float32).tobytes(),
+                  np.asarray(info.local_done, dtype=np.uint8).tobytes(),
+                  np.asarray(info.agents, dtype=np.int32).tobytes()]
+    return b''.join(parts)
+
+
+def unpack_brain_infos(payload):
+    """ inverse of pack_brain_infos """
+    infos = {}
+    (num_brains,) = BRAINS_HEADER.unpack_from(payload)
+    offset = BRAINS_HEADER.size
+    for _ in range(num_brains):
+        name_length, num_agents, observation_size = BRAIN_HEADER.unpack_from(payload, offset)
+        offset += BRAIN_HEADER.size
+        name = bytes(payload[offset:offset + name_length]).decode()
+        offset += name_length
+        arrays = []
+        for count, dtype in [(num_agents * observation_size, np.float32), (num_agents, np.float32),
+                             (num_agents, np.uint8), (num_agents, np.int32)]:
+            arrays.append(np.frombuffer(payload, dtype=dtype, count=count, offset=offset))
+            offset += count * np.dtype(dtype).itemsize
+        observations, rewards, dones, agents = arrays
+        infos[name] = BrainInfo(observations.reshape(num_agents, observation_size), rewards.tolist(),
+                                dones.astype(bool).tolist(), agents.tolist())
+    return infos
+
+
+def _send_json(sock, msg_type, message):
+    send_frame(sock, msg_type, json.dumps(message).encode())
+
+
+class RemoteEnvironment:
+    def __init__(self, host, port, name=None):
+        """
+        lease an environment of a daemon (same api as the environment: brain_names, brains, reset, step, close).
+        waits while every matching environment is leased by other runs.
+        :param host: address of the daemon
+        :param port: port of the daemon
+        :param name: name of the environment to lease, None for any free one
+        """
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        _send_json(self.sock, LEASE, {'name': name})
+        while True:
+            msg_type, payload = recv_frame(self.sock)
+            if msg_type == QUEUED:
+                print('every environment of the daemon on {}:{} is leased, waiting for one'.format(host, port))
+                continue
+            if msg_type == ERROR:
+                self._raise(payload)
+            break
+        lease = json.loads(payload)
+        self.name = lease['name']
+        self.worker_id = lease['worker_id']
+        self.brain_names, self.brains = brains_from_description(lease['brains'])
+        print('leased environment {} of the daemon on {}:{}'.format(self.name, host, port))
+
+    @staticmethod
+    def _raise(payload):
+        """ raise the error the daemon answered with """
+        error = json.loads(payload)
+        if error['kind'] == 'restarted':
+            raise EnvironmentRestarted(error['message'])
+        print(error['message'])
+        if error['kind'] == 'failed':
+            raise EnvironmentFailed(error['message'])
+        if error['kind'] == 'unknown':
+            raise KeyError(error['message'])
+        raise RuntimeError(error['message'])
+
+    def _request(self, msg_type, payload):
+        send_frame(self.sock, msg_type, payload)
+        msg_type, payload = recv_frame(self.sock)
+        if msg_type == ERROR:
+            self._raise(payload)
+        return unpack_brain_infos(payload)
+
+    def reset(self, train_mode=True, config=None):
+        """ reset the leased environment with the env_config of the run """
+        return self._request(RESET, json.dumps({'train_mode': train_mode, 'config': config}).encode())
+
+    def step(self, vector_action=None):
+        """ step the leased environment """
+        return self._request(STEP, np.ascontiguousarray(vector_action, dtype=np.float32).tobytes())
+
+    def close(self):
+        """ return the environment to the pool of the daemon """
+        if self.sock is None:
+            return
+        try:
+            send_frame(self.sock, RELEASE)
+        except OSError:
+            pass
+        self.sock.close()
+        self.sock = None
+
+
+class _PooledEnvironment:
+    def __init__(self, name, env, launch_seconds):
+        self.name = name
+        self.env = env
+        self.launch_seconds = launch_seconds    # what every lease saves
+        self.lessee = None      # address of the run that leased it
+        self.leases = 0
+        self.failed = False
+
+
+class EnvironmentDaemon:
+    def __init__(self, build_path, names, base_worker_id=0, no_graphics=True, step_timeout=60.0,
+                 reset_timeout=120.0, max_restarts=10):
+        """
+        launch the pool of environments (every one supervised, in its own process).
+        :param build_path: path returned by resolve_build_path
+        :param names: name of every environment of the pool
+        :param base_worker_id: worker id of the first environment, the others follow (a restarted environment
+        moves on by RESTART_WORKER_ID_STEP, see utils/env_watchdog.py)
+        :param no_graphics: whether or not to start the environments without graphics
+        :param step_timeout: seconds a step may take
+        :param reset_timeout: seconds the launch of an environment or a reset may take
+        :param max_restarts: restarts of an environment before it is removed from the pool
+        """
+        self.condition = threading.Condition()
+        self.pool = {}
+        for i, name in enumerate(names):
+            start = time.time()
+            env = SupervisedEnvironment(build_path, no_graphics=no_graphics, worker_id=base_worker_id + i,
+                                        seed=base_worker_id + i, step_timeout=step_timeout,
+                                        reset_timeout=reset_timeout, max_restarts=max_restarts)
+            self.pool[name] = _PooledEnvironment(name, env, time.time() - start)
+            print('launched environment {} (worker id {}) in {:.1f} seconds'.format(
+                name, env.worker_id, self.pool[name].launch_seconds))
+
+    def _lease(self, name, lessee, queued):
+        """
+        :param name: name of the environment, None for any free one
+        :param lessee: address of the run
+        :param queued: called once if the lease has to wait
+        :return: the leased _PooledEnvironment
+        """
+        with self.condition:
+            if name is not None and (name not in self.pool or self.pool[name].failed):
+                raise KeyError(name)
+            waiting = False
+            while True:
+                candidates = [self.pool[name]] if name is not None else list(self.pool.values())
+                free = [pooled for pooled in candidates if pooled.lessee is None and not pooled.failed]
+                if free:
+                    break
+                if not any(not pooled.failed for pooled in candidates):
+                    raise KeyError(name)
+                if not waiting:
+                    queued()
+                    waiting = True
+                self.condition.wait()
+            # the least used one, so the pool wears evenly
+            pooled = min(free, key=lambda p: p.leases)
+            pooled.lessee = lessee
+            pooled.leases += 1
+            return pooled
+
+    def _release(self, pooled):
+        with self.condition:
+            pooled.lessee = None
+            self.condition.notify_all()
+
+    def _call(self, pooled, method, *args):
+        """ :return: the reply frame (message type, payload) to a reset or a step of the leased environment """
+        try:
+            return INFOS, pack_brain_infos(method(*args))
+        except EnvironmentRestarted as e:
+            print(' - the episode of {} is lost'.format(pooled.lessee))
+            return ERROR, json.dumps({'kind': 'restarted', 'message': str(e)}).encode()
+        except EnvironmentFailed as e:
+            with self.condition:
+                pooled.failed = True
+                self.condition.notify_all()
+            print('environment {} failed too often, removed from the pool'.format(pooled.name))
+            return ERROR, json.dumps({'kind': 'failed', 'message': 'environment {} of the daemon failed: {}'.format(
+                pooled.name, e)}).encode()
+
+    def _serve_connection(self, sock, address):
+        """ connection thread - one run, from its lease to its release """
+        lessee = '{}:{}'.format(*address[:2])
+        pooled = None
+        steps = 0
+        start = time.time()
+        try:
+            while True:
+                msg_type, payload = recv_frame(sock)
+                if msg_type == RELEASE:
+                    break
+                if msg_type == LEASE and pooled is None:
+                    try:
+                        pooled = self._lease(json.loads(payload)['name'], lessee,
+                                             lambda: send_frame(sock, QUEUED))
+                    except KeyError as e:
+                        _send_json(sock, ERROR, {'kind': 'unknown', 'message': 'the daemon has no environment {}'
+                                                                               ' (it has: {})'.format(
+                                                                                   e.args[0], ', '.join(self.pool))})
+                        continue
+                    print('leased {} to {} (lease {}, {:.1f} seconds of launch saved)'.format(
+                        pooled.name, lessee, pooled.leases, pooled.launch_seconds))
+                    _send_json(sock, LEASED, {'name': pooled.name, 'worker_id': pooled.env.worker_id,
+                                              'brains': describe_brains(pooled.env)})
+                elif pooled is None or pooled.failed:
+                    _send_json(sock, ERROR, {'kind': 'error', 'message': 'no environment is leased'})
+                elif msg_type == RESET:
+                    request = json.loads(payload)
+                    send_frame(sock, *self._call(pooled, pooled.env.reset, request['train_mode'],
+                                                 request['config']))
+                elif msg_type == STEP:
+                    steps += 1
+                    send_frame(sock, *self._call(pooled, pooled.env.step, np.frombuffer(payload, dtype=np.float32)))
+                else:
+                    _send_json(sock, ERROR, {'kind': 'error', 'message': 'unexpected message {}'.format(msg_type)})
+        except (ConnectionError, OSError):
+            pass    # the run ended without a release (or was killed) - the environment goes back all the same
+        sock.close()
+        if pooled is not None:
+            print('{} returned {} after {} steps in {:.1f} seconds'.format(lessee, pooled.name, steps,
+                                                                         time.time() - start))
+            self._release(pooled)
+
+    def serve(self, host, port):
+        """ accept runs until interrupted """
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host, port))
+        server.listen()
+        print('environment daemon listening on {}:{} with {}'.format(*server.getsockname()[:2],
+                                                                       ', '.join(self.pool)))
+        try:
+            while True:
+                sock, address = server.accept()
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                threading.Thread(target=self._serve_connection, args=(sock, address), daemon=True).start()
+        finally:
+            server.close()
+
+    def close(self):
+        for pooled in self.pool.values():
+            pooled.env.close()
+
+
+def env_daemon_wrapper(env_config, wrapper_config):
+    """
+    run the environment daemon.
+    :param env_config: dictionary, not used (every run resets its environment with its own env_config)
+    :param wrapper_config: dictionary of user defined variables.
+    """
+    build_path = resolve_build_path(wrapper_config['build'])
+    names = wrapper_config.get('names') or ['env{}'.format(i) for i in range(wrapper_config['pool_size'])]
+    if len(set(names)) != len(names):
+        print('the environment names must be unique')
+        raise ValueError
+    daemon = EnvironmentDaemon(build_path, names, base_worker_id=wrapper_config['base_worker_id'],
+                               no_graphics=not wrapper_config['show_graphics'],
+                               step_timeout=wrapper_config['env_step_timeout'],
+                               reset_timeout=wrapper_config['env_reset_timeout'],
+                               max_restarts=wrapper_config['max_env_restarts'])
+    try:
+        daemon.serve(wrapper_config['host'], wrapper_config['port'])
+    except KeyboardInterrupt:
+        print('\nstopping the environment daemon')
+    finally:
+        daemon.close()
@@ -0,0 +1,191 @@
+"""
+supervision of the environment: the environment runs in a child process (with the unity player it launches), and
+every reset / step has a timeout. when the player hangs, crashes or its process dies, the child is killed together
+with the player and a fresh environment is launched on a new worker id (port) - the training process, with the
+agent and its replay buffer, keeps running.
+a failed reset is retried on the fresh environment. a failed step raises EnvironmentRestarted (the episode that
+was running is lost, the caller starts a new one).
+"""
+
+import multiprocessing
+import os
+import signal
+import time
+
+from utils.stand_in_env import BrainInfo, BrainParameters
+
+RESTART_WORKER_ID_STEP = 100    # the n-th restarted environment uses worker id + n * RESTART_WORKER_ID_STEP
+
+
+class EnvironmentRestarted(RuntimeError):
+    """ the environment failed during a step and was replaced by a fresh one (which needs a reset) """
+
+
+class EnvironmentFailed(RuntimeError):
+    """ the environment kept failing, more restarts than allowed """
+
+
+def describe_brains(env):
+    """ :return: {brain name: (observation size, action sizes)} of the environment, to send to another process """
+    return {name: (env.brains[name].vector_observation_space_size, list(env.brains[name].vector_action_space_size))
+            for name in env.brain_names}
+
+
+def brains_from_description(description):
+    """ :return: (brain_names, brains) of an environment from its describe_brains """
+    brains = {}
+    for name, (state_size, action_sizes) in description.items():
+        brains[name] = BrainParameters(state_size, action_sizes[0])
+        brains[name].brain_name = name
+        brains[name].vector_action_space_size = list(action_sizes)
+    return list(description), brains
+
+
+def _environment_process(build_path, no_graphics, worker_id, seed, pipe):
+    """ process target - runs the environment, answers ('ok', result) or ('error', message) to every command """
+    from utils.environment import open_environment
+    if hasattr(os, 'setsid'):
+        os.setsid()     # the player launched by the environment joins the process group, killed with it
+        # terminated with the training process (daemon process): take the player along
+        signal.signal(signal.SIGTERM, lambda signum, frame: os.killpg(0, signal.SIGKILL))
+    try:
+        env = open_environment(build_path, no_graphics=no_graphics, worker_id=worker_id, seed=seed)
+        pipe.send(('ok', describe_brains(env)))
+    except Exception as e:
+        pipe.send(('error', repr(e)))
+        return
+    while True:
+        command, args = pipe.recv()
+        if command == 'close':
+            env.close()
+            return
+        try:
+            infos = env.reset(**args) if command == 'reset' else env.step(args)
+            # only the fields the wrappers use cross the pipe
+            pipe.send(('ok', {name: (info.vector_observations, info.rewards, info.local_done, info.agents)
+                              for name, info in infos.items()}))
+        except Exception as e:
+            # the environment is not usable any more (as after a crash of the player)
+            pipe.send(('error', repr(e)))
+            return
+
+
+class SupervisedEnvironment:
+    def __init__(self, build_path, no_graphics=True, worker_id=0, seed=0, step_timeout=60.0, reset_timeout=120.0,
+                 max_restarts=10):
+        """
+        start an environment in a supervised child process (same api as the environment: brain_names, brains,
+        reset, step, close).
+        :param build_path: path returned by resolve_build_path
+        :param no_graphics: whether or not to start the environment without graphics
+        :param worker_id: worker id of the first environment
+        :param seed: random seed (stand-in environment only)
+        :param step_timeout: seconds a step may take
+        :param reset_timeout: seconds the launch of the environment or a reset may take
+        :param max_restarts: restarts of the environment before giving up (EnvironmentFailed)
+        """
+        self.build_path = build_path
+        self.no_graphics = no_graphics
+        self.first_worker_id = worker_id
+        self.seed = seed
+        self.step_timeout = step_timeout
+        self.reset_timeout = reset_timeout
+        self.max_restarts = max_restarts
+        self.context = multiprocessing.get_context('spawn')
+        self.restarts = 0
+        self.restart_log = []   # (worker id of the failed environment, reason) of every restart
+        self.process = None
+        self.pipe = None
+        self.worker_id = None
+        self.brain_names = None
+        self.brains = None
+        self._launch()
+
+    def _kill(self):
+        """ kill the child process and the player it launched """
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            try:
+                if hasattr(os, 'killpg'):
+                    os.killpg(self.process.pid, signal.SIGKILL)
+                else:
+                    self.process.kill()
+            except (ProcessLookupError, PermissionError):
+                self.process.kill()
+        self.process.join()
+        self.pipe.close()
+        self.process = None
+
+    def _request(self, command, args, timeout):
+        """ :return: (True, result) or (False, reason of the failure) """
+        try:
+            if command is not None:
+                self.pipe.send((command, args))
+            if not self.pipe.poll(timeout):
+                return False, '{} timed out after {:g} seconds'.format(command or 'launch', timeout)
+            status, result = self.pipe.recv()
+        except (EOFError, OSError):
+            return False, 'the environment process died'
+        if status != 'ok':
+            return False, result
+        return True, result
+
+    def _launch(self):
+        """ start a fresh environment, on a new worker id after a restart (a failed launch is a restart too) """
+        self.worker_id = self.first_worker_id + self.restarts * RESTART_WORKER_ID_STEP
+        self.pipe, child_pipe = self.context.Pipe()
+        self.process = self.context.Process(target=_environment_process, daemon=True,
+                                            args=(self.build_path, self.no_graphics, self.worker_id, self.seed,
+                                                  child_pipe))
+        self.process.start()
+        child_pipe.close()
+        ok, result = self._request(None, None, self.reset_timeout)
+        if not ok:
+            self._restart(result)
+            return
+        self.brain_names, self.brains = brains_from_description(result)
+
+    def _restart(self, reason):
+        """ replace the failed environment (its process is killed) """
+        self._kill()
+        self.restarts += 1
+        self.restart_log.append((self.worker_id, reason))
+        print('\nenvironment (worker id {}) failed: {} - restart {} of {}'.format(
+            self.worker_id, reason, self.restarts, self.max_restarts), end="")
+        if self.restarts > self.max_restarts:
+            print('\nthe environment failed too often, giving up')
+            raise EnvironmentFailed(reason)
+        # give the operating system a moment to release the player (and its port)
+        time.sleep(1)
+        self._launch()
+
+    @staticmethod
+    def _brain_infos(result):
+        return {name: BrainInfo(*fields) for name, fields in result.items()}
+
+    def reset(self, train_mode=True, config=None):
+        """ reset the environment (a failed reset restarts the environment and is retried) """
+        while True:
+            ok, result = self._request('reset', {'train_mode': train_mode, 'config': config}, self.reset_timeout)
+            if ok:
+                return self._brain_infos(result)
+            self._restart(result)
+
+    def step(self, vector_action=None):
+        """ step the environment (a failed step restarts the environment and raises EnvironmentRestarted) """
+        ok, result = self._request('step', vector_action, self.step_timeout)
+        if ok:
+            return self._brain_infos(result)
+        self._restart(result)
+        raise EnvironmentRestarted(result)
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.pipe.send(('close', None))
+            self.process.join(self.reset_timeout)
+        except OSError:
+            pass
+        self._kill()
@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+
+from utils.stand_in_env import StandInEnvironment
+
+STAND_IN_BUILD = 'stand-in'     # --build value that selects the stand-in environment
+# the stand-in can inject faults: --build stand-in:hang=0.001,crash=0.001 (probabilities per step)
+STAND_IN_FAULTS = ['hang', 'crash']
+# --build env-daemon[:host:port][/name] leases an environment of a running daemon (see utils/env_daemon.py)
+ENV_DAEMON_BUILD = 'env-daemon'
+ENV_DAEMON_HOST = '127.0.0.1'
+ENV_DAEMON_PORT = 7000
+
+
+def stand_in_faults(build_path):
+    """ :return: the fault probabilities of a stand-in build (e.g. stand-in:hang=0.001), None if not a stand-in """
+    if build_path is None or not (build_path == STAND_IN_BUILD or build_path.startswith(STAND_IN_BUILD + ':')):
+        return None
+    faults = {}
+    for item in filter(None, build_path[len(STAND_IN_BUILD) + 1:].split(',')):
+        name, _, value = item.partition('=')
+        if name not in STAND_IN_FAULTS:
+            print('unknown stand-in fault {} (known: {})'.format(name, ', '.join(STAND_IN_FAULTS)))
+            raise ValueError(name)
+        faults[name] = float(value)
+    return faults
+
+
+def env_daemon_address(build_path):
+    """ :return: (host, port, name or None) of an env-daemon build, None if not an env-daemon build """
+    if build_path is None or not (build_path == ENV_DAEMON_BUILD or build_path.startswith(ENV_DAEMON_BUILD + ':')
+                                  or build_path.startswith(ENV_DAEMON_BUILD + '/')):
+        return None
+    address, _, name = build_path[len(ENV_DAEMON_BUILD):].partition('/')
+    address = address[1:]  # without the ':' after env-daemon
+    host, _, port = address.rpartition(':') if ':' in address else (address, None, None)
+    try:
+        port = int(port) if port else ENV_DAEMON_PORT
+    except ValueError:
+        print('invalid env-daemon port {} (--build env-daemon:host:port/name)'.format(port))
+        raise
+    return host or ENV_DAEMON_HOST, port, name or None
+
+
+def resolve_build_path(build):
+    """
+    check the --build argument.
+    :param build: path of the unity build, 'None' to run inside Unity or 'stand-in' for the stand-in environment
+    (optionally with faults, see STAND_IN_FAULTS) or env-daemon[:host:port][/name] for an environment of a daemon
+    :return: the build path to pass on to open_environment
+    """
+    build_path = None if build == 'None' else build
+    if (build_path is not None) and (stand_in_faults(build_path) is None) and \
+            (env_daemon_address(build_path) is None) and (not os.path.isfile(build_path)):
+        print('--build is not a valid path')
+        raise FileNotFoundError
+    return build_path
+
+
+def open_environment(build_path, no_graphics=True, worker_id=0, seed=0):
+    """
+    start an environment.
+    :param build_path: path returned by resolve_build_path
+    :param no_graphics: whether or not to start the environment without graphics
+    :param worker_id: offset of the communication port, every environment on the same host needs its own
+    :param seed: random seed (stand-in environment only)
+    (the daemon launched its environments with its own no_graphics, worker ids and seeds)
+    :return: UnityEnvironment (or StandInEnvironment, or RemoteEnvironment leased from a daemon)
+    """
+    address = env_daemon_address(build_path)
+    if address is not None:
+        from utils.env_daemon import RemoteEnvironment
+        return RemoteEnvironment(*address)
+    faults = stand_in_faults(build_path)
+    if faults is not None:
+        return StandInEnvironment(worker_id=worker_id, seed=seed, **faults)
+    from mlagents.envs import UnityEnvironment
+    return UnityEnvironment(file_name=build_path, no_graphics=no_graphics, worker_id=worker_id)
+
+
+def step_environment(env, brain_name, actions, action_repeat=1):
+    """
+    send the same actions to the environment for action_repeat frames (frame skip).
+    the repeat stops early at the frame where any car is done, so a transition never crosses the end of an episode.
+    :param env: the environment
+    :param brain_name: name of the brain that controls the cars
+    :param actions: actions of the cars
+    :param action_repeat: number of frames to hold the actions for
+    :return: (next states, rewards summed over the frames, dones, number of frames stepped)
+    """
+    rewards = 0
+    for frame in range(1, action_repeat + 1):
+        env_info = env.step(actions)[brain_name]
+        rewards = rewards + np.asarray(env_info.rewards)
+        if np.any(env_info.local_done):
+            break
+    return env_info.vector_observations, rewards.tolist(), env_info.local_done, frame
@@ -0,0 +1,260 @@
+"""
+observation history: the state of a car is its last k observations, oldest first (the first observation of an
+episode is repeated in front until the episode has k of its own).
+FrameHistoryBuffer is a replay buffer that keeps every observation once and builds the stacked states of a sampled
+batch by index arithmetic. FrameWindow gives act() the same stacked state of the current step.
+"""
+
+import pickle
+
+import numpy as np
+import torch
+
+from utils.replay_buffer import device
+
+
+class FrameHistoryBuffer:
+    def __init__(self, action_size, buffer_size, batch_size, seed, observation_size, num_streams, history):
+        """
+        replay buffer of stacked states, with the api of ReplayBuffer (add, add_batch, sample, len, save, load).
+        every car writes its own stream of rows: one row per observation, with the action, reward and done taken
+        from it. the next state of the transition of row t is the history of row t+1 of the same stream. a row
+        that ends an episode (its observation is a last next state) has no transition of its own.
+        :param action_size: dimension of each action
+        :param buffer_size: maximum number of rows (over all the streams)
+        :param batch_size: size of each training batch
+        :param seed: random seed of the sampling
+        :param observation_size: dimension of one observation (the stacked state has history times as many)
+        :param num_streams: number of cars writing into the buffer (the stream of an experience is its car, more
+        streams are added for the cars of other rollouts - see add_streams)
+        :param history: number of observations in a state (k)
+        """
+        self.action_size = action_size
+        self.batch_size = batch_size
+        self.observation_size = observation_size
+        self.num_streams = num_streams
+        self.num_cars = num_streams
+        self.history = history
+        self.random = np.random.RandomState(seed)
+        self._allocate(max(1, buffer_size // num_streams))
+
+    def _allocate(self, stream_capacity):
+        self.stream_capacity = stream_capacity
+        shape = (self.num_streams, stream_capacity)
+        self.observations = np.zeros(shape + (self.observation_size,), dtype=np.float32)
+        self.actions = np.zeros(shape + (self.action_size,), dtype=np.float32)
+        self.rewards = np.zeros(shape, dtype=np.float32)
+        self.dones = np.zeros(shape, dtype=bool)
+        self.valid = np.zeros(shape, dtype=bool)            # the row has a transition
+        self.episode_steps = np.zeros(shape, dtype=np.int64)    # index of the row in its episode
+        self.heads = np.zeros(self.num_streams, dtype=np.int64)     # next row to write, per stream
+        self.sizes = np.zeros(self.num_streams, dtype=np.int64)     # rows written, per stream
+        self.open = np.zeros(self.num_streams, dtype=bool)  # the newest row of the stream may be continued
+        self.num_valid = 0
+
+    def _append(self, stream, observation, episode_step):
+        """ write a row without a transition (yet), overwriting the oldest row of the stream when full """
+        row = self.heads[stream]
+        self.num_valid -= int(self.valid[stream, row])
+        self.observations[stream, row] = observation
+        self.valid[stream, row] = False
+        self.episode_steps[stream, row] = episode_step
+        self.heads[stream] = (row + 1) % self.stream_capacity
+        self.sizes[stream] = min(self.sizes[stream] + 1, self.stream_capacity)
+        return row
+
+    def add(self, state, action, reward, next_state, done, stream=0):
+        """ add a new experience (of one car, state and next_state are single observations) to memory """
+        last = (self.heads[stream] - 1) % self.stream_capacity
+        if self.open[stream] and np.array_equal(self.observations[stream, last], np.asarray(state, np.float32)):
+            # the state is the next state of the previous experience of the stream, stored already
+            row = last
+        else:
+            # a new episode (the newest row, if any, stays the last state of its episode)
+            row = self._append(stream, state, 0)
+        self.actions[stream, row] = action
+        self.rewards[stream, row] = reward
+        self.dones[stream, row] = done
+        self.valid[stream, row] = True
+        self.num_valid += 1
+        self._append(stream, next_state, self.episode_steps[stream, row] + 1)
+        self.open[stream] = not done
+
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        """ add many experiences, row i is an experience of car i % num_cars (rows ordered by step, then car) """
+        for i in range(len(states)):
+            self.add(states[i], actions[i], rewards[i], next_states[i], dones[i], stream=i % self.num_cars)
+
+    def _stacked(self, streams, rows):
+        """ :return: the stacked states of the rows (len(rows), history * observation_size) """
+        # k-1 ... 0 observations back, but not before the first observation of the episode
+        back = np.minimum(np.arange(self.history - 1, -1, -1), self.episode_steps[streams, rows][:, None])
+        history_rows = (rows[:, None] - back) % self.stream_capacity
+        return self.observations[streams[:, None], history_rows].reshape(len(rows), -1)
+
+    def _sampleable(self, streams, rows):
+        """ the rows have a transition, and the history of their state is still in the buffer """
+        oldest = np.where(self.sizes[streams] < self.stream_capacity, 0, self.heads[streams])
+        position = (rows - oldest) % self.stream_capacity
+        return self.valid[streams, rows] & (position >= np.minimum(self.history - 1,
+                                                                   self.episode_steps[streams, rows]))
+
+    def sample(self):
+        """ randomly sample a batch of experiences from memory """
+        streams = np.empty(0, dtype=np.int64)
+        rows = np.empty(0, dtype=np.int64)
+        while len(rows) < self.batch_size:
+            # rows without a transition are drawn again (a small fraction: episode ends, the newest rows)
+            candidate_streams = self.random.randint(self.num_streams, size=self.batch_size)
+            candidate_rows = (self.random.random_sample(self.batch_size) *
+                              self.sizes[candidate_streams]).astype(np.int64)
+            keep = self._sampleable(candidate_streams, candidate_rows)
+            streams = np.concatenate([streams, candidate_streams[keep]])
+            rows = np.concatenate([rows, candidate_rows[keep]])
+        streams, rows = streams[:self.batch_size], rows[:self.batch_size]
+        next_rows = (rows + 1) % self.stream_capacity
+
+        states = torch.from_numpy(self._stacked(streams, rows)).to(device)
+        actions = torch.from_numpy(self.actions[streams, rows]).to(device)
+        rewards = torch.from_numpy(self.rewards[streams, rows]).to(device)
+        next_states = torch.from_numpy(self._stacked(streams, next_rows)).to(device)
+        dones = torch.from_numpy(self.dones[streams, rows].astype(np.float32)).to(device)
+        return states, actions, rewards, next_states, dones
+
+    def _transitions(self):
+        """ :return: (streams, rows) of every sampleable row """
+        streams, rows = np.nonzero(self.valid)
+        keep = self._sampleable(streams, rows)
+        return streams[keep], rows[keep]
+
+    def states(self):
+        """ :return: the stacked states of the stored experiences """
+        return self._stacked(*self._transitions())
+
+    def shard(self, rank, world_size):
+        """ keep every world_size-th experience, from the rank-th on (data parallel learning) """
+        streams, rows = np.nonzero(self.valid)
+        drop = np.arange(len(rows)) % world_size != rank
+        self.valid[streams[drop], rows[drop]] = False
+        self.num_valid = int(self.valid.sum())
+
+    @property
+    def capacity(self):
+        """ maximal number of experiences kept """
+        return self.num_streams * self.stream_capacity
+
+    def set_capacity(self, buffer_size):
+        """ change the maximal number of experiences (the oldest ones are dropped if needed) """
+        self._resize(self.num_streams, max(1, buffer_size // self.num_streams))
+
+    def add_streams(self, num_streams):
+        """ grow to num_streams streams (e.g. the cars of another rollout worker), sharing the same capacity """
+        if num_streams > self.num_streams:
+            self._resize(num_streams, max(1, self.capacity // num_streams))
+
+    def _resize(self, num_streams, stream_capacity):
+        """ reallocate the streams, keeping the newest rows of every stream (the added streams are empty) """
+        old = {name: getattr(self, name) for name in ['observations', 'actions', 'rewards', 'dones', 'valid',
+                                                       'episode_steps']}
+        heads, sizes, old_capacity, stream_open = self.heads, self.sizes, self.stream_capacity, self.open
+        old_streams = self.num_streams
+        self.num_streams = num_streams
+        self._allocate(stream_capacity)
+        for stream in range(old_streams):
+            # the newest rows of the stream, oldest first
+            count = min(sizes[stream], self.stream_capacity)
+            rows = (heads[stream] - count + np.arange(count)) % old_capacity
+            for name, array in old.items():
+                getattr(self, name)[stream, :count] = array[stream, rows]
+            self.heads[stream] = count % self.stream_capacity
+            self.sizes[stream] = count
+        self.open[:old_streams] = stream_open
+        self.num_valid = int(self.valid.sum())
+
+    def bytes_per_experience(self):
+        """ memory of one row """
+        return sum(array[0, 0].nbytes for array in [self.observations, self.actions, self.rewards, self.dones,
+                                                     self.valid, self.episode_steps])
+
+    def bytes_used(self):
+        """ memory of the written rows (the arrays are allocated for the full capacity, and paged in when used) """
+        return int(self.sizes.sum()) * self.bytes_per_experience()
+
+    def __len__(self):
+        """ number of stored experiences """
+        return self.num_valid
+
+    def save(self, filename):
+        """ save pickled replay buffer (only the written part of the arrays) """
+        filled = int(self.sizes.max())
+        state = {name: getattr(self, name)[:, :filled] for name in ['observations', 'actions', 'rewards', 'dones',
+                                                                     'valid', 'episode_steps']}
+        state.update({'action_size': self.action_size, 'observation_size': self.observation_size,
+                      'num_streams': self.num_streams, 'history': self.history,
+                      'stream_capacity': self.stream_capacity, 'heads': self.heads, 'sizes': self.sizes,
+                      'open': self.open, 'random': self.random.get_state()})
+        with open(filename, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load(self, filename):
+        """ load pickled replay buffer """
+        with open(filename, 'rb') as f:
+            state = pickle.load(f)
+        for name in ['action_size', 'observation_size', 'num_streams', 'history']:
+            if name == 'num_streams' and state[name] > self.num_streams and state[name] % self.num_streams == 0:
+                # the streams of more rollouts (distributed training)
+                continue
+            if state[name] != getattr(self, name):
+                print('the replay buffer has {} {} but the agent has {}'.format(name, state[name],
+                                                                               getattr(self, name)))
+                raise ValueError(name)
+        capacity = self.capacity
+        self.num_streams = state['num_streams']
+        self._allocate(state['stream_capacity'])
+        filled = state['observations'].shape[1]
+        for name in ['observations', 'actions', 'rewards', 'dones', 'valid', 'episode_steps']:
+            getattr(self, name)[:, :filled] = state[name]
+        self.heads, self.sizes, self.open = state['heads'], state['sizes'], state['open']
+        self.num_valid = int(self.valid.sum())
+        self.random.set_state(state['random'])
+        if capacity != self.capacity:
+            # e.g. made smaller by a memory budget
+            self.set_capacity(capacity)
+
+
+class FrameWindow:
+    def __init__(self, num_agents, observation_size, history):
+        """
+        the last observations of every car, for act().
+        every observation is written twice, at p and p + k of a 2k ring, so the last k observations are always the
+        contiguous slice [p+1, p+k] - a view, nothing is concatenated or copied per step.
+        :param num_agents: number of cars
+        :param observation_size: dimension of one observation
+        :param history: number of observations in a state (k)
+        """
+        self.history = history
+        self.frames = np.zeros((num_agents, 2 * history, observation_size), dtype=np.float32)
+        self.position = 0
+        self.starting = np.ones(num_agents, dtype=bool)    # the next observation of the car starts an episode
+
+    def push(self, observations):
+        """
+        :param observations: current observation of every car (num_agents, observation_size)
+        :return: stacked states (num_agents, history * observation_size), a view valid until the next push
+        """
+        p = self.position
+        self.frames[:, p] = observations
+        self.frames[:, p + self.history] = observations
+        if self.starting.any():
+            # the first observation of an episode fills the whole window
+            self.frames[self.starting] = np.asarray(observations, dtype=np.float32)[self.starting][:, None]
+            self.starting[:] = False
+        self.position = (p + 1) % self.history
+        return self.frames[:, p + 1:p + 1 + self.history].reshape(len(self.frames), -1)
+
+    def restart(self, cars=None):
+        """ the next observation of the cars (a boolean mask, all the cars if None) starts a new episode """
+        if cars is None:
+            self.starting[:] = True
+        else:
+            self.starting |= np.asarray(cars, dtype=bool)
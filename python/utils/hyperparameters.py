@@ -0,0 +1,70 @@
+"""
+the hyperparameters of the agents are module level constants (BATCH_SIZE, LR_ACTOR, ...).
+this module overrides them at run time, so a run can be configured without editing the agent files.
+besides the agent constants, TORCH_THREADS sets the number of intra-op threads of torch for the run.
+"""
+
+import json
+import os
+import sys
+
+import torch
+
+from agent import AgentABC
+
+TORCH_THREADS = 'TORCH_THREADS'     # run setting, not an agent constant
+
+
+def _agent_modules(agent_type):
+    """ the module of the agent and the modules of the agents it is built from (e.g. mddpg -> ddpg) """
+    module = sys.modules[agent_type.__module__]
+    modules = [module]
+    for obj in vars(module).values():
+        if isinstance(obj, type) and issubclass(obj, AgentABC) and obj is not agent_type \
+                and obj.__module__ != agent_type.__module__:
+            modules += [m for m in _agent_modules(obj) if m not in modules]
+    return modules
+
+
+def read_hyperparameters(hparams):
+    """
+    :param hparams: json string, or path of a json file, mapping constant names to values (or None)
+    :return: dictionary of overrides
+    """
+    if hparams is None:
+        return {}
+    if os.path.isfile(hparams):
+        with open(hparams) as f:
+            return json.load(f)
+    return json.loads(hparams)
+
+
+def get_hyperparameters(agent_type, names):
+    """ :return: the current values of the given constants for the agent type """
+    values = {}
+    for module in reversed(_agent_modules(agent_type)):
+        values.update({name: getattr(module, name) for name in names if hasattr(module, name)})
+    return values
+
+
+def apply_hyperparameters(agent_type, overrides):
+    """
+    set module level constants of the agent type (must be called before the agent is created).
+    :param agent_type: class of the agent
+    :param overrides: dictionary of constant name -> value
+    """
+    modules = _agent_modules(agent_type)
+    for name, value in overrides.items():
+        if name == TORCH_THREADS:
+            torch.set_num_threads(int(value))
+            continue
+        targets = [m for m in modules if hasattr(m, name)]
+        if not targets:
+            print('unknown hyperparameter {} for agent {}'.format(name, agent_type.__module__))
+            raise KeyError(name)
+        for module in targets:
+            # sizes and counts stay ints when given as e.g. 1e5
+            if isinstance(getattr(module, name), int) and not isinstance(getattr(module, name), bool) \
+                    and float(value).is_integer():
+                value = int(value)
+            setattr(module, name, value)
@@ -0,0 +1,50 @@
+"""
+running loss statistics that stay on the device.
+learn() adds its losses as tensors (no .cpu() / .numpy(), so no device sync per update), and the means are
+only computed when they are asked for (end of episode, --print-agent-loss).
+"""
+
+import torch
+
+
+class RunningStats:
+    def __init__(self):
+        self.sums = {}      # name -> 0-dim tensor on the device of the values
+        self.counts = {}    # name -> number of values
+
+    def add(self, name, value: torch.Tensor):
+        """ accumulate a scalar tensor (detached, in place) """
+        value = value.detach().double()
+        if name in self.sums:
+            self.sums[name].add_(value)
+            self.counts[name] += 1
+        else:
+            self.sums[name] = value.clone()
+            self.counts[name] = 1
+
+    def reset(self):
+        self.sums = {}
+        self.counts = {}
+
+    def means(self):
+        """ :return: dictionary name -> mean (python floats, this is where the device sync happens) """
+        return {name: self.sums[name].item() / self.counts[name] for name in self.sums}
+
+    @staticmethod
+    def combine(stats):
+        """ :return: RunningStats with the sums and counts of several RunningStats (e.g. the agents of mddpg) """
+        combined = RunningStats()
+        for s in stats:
+            for name in s.sums:
+                if name in combined.sums:
+                    combined.sums[name] = combined.sums[name] + s.sums[name].to(combined.sums[name].device)
+                    combined.counts[name] += s.counts[name]
+                else:
+                    combined.sums[name] = s.sums[name].clone()
+                    combined.counts[name] = s.counts[name]
+        return combined
+
+
+def format_stats(stats):
+    """ :param stats: dictionary returned by agent.episode_stats() :return: one line for the training logs """
+    return '\t'.join('{}: {:.5f}'.format(name, stats[name]) for name in sorted(stats))
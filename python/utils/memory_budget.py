@@ -0,0 +1,114 @@
+"""
+memory accounting of an agent (replay buffers, networks, optimizer state, pending checkpoint snapshots),
+and sizing of the replay buffers to fit a memory budget before the run starts.
+"""
+
+import numpy as np
+
+
+MIN_CAPACITY_BATCHES = 10   # a replay buffer smaller than 10 batches is considered too small to train
+UNITS = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+
+
+def parse_size(text):
+    """ '512M', '4G', '1.5G' or a plain number of bytes -> bytes """
+    text = str(text).strip().upper().rstrip('B')
+    if text and text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(float(text))
+
+
+def format_size(num_bytes):
+    return '{:.1f}MB'.format(num_bytes / 2 ** 20)
+
+
+def _tensors_bytes(tensors):
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def network_bytes(agent):
+    """ parameters and buffers of every local and target network """
+    return sum(_tensors_bytes(list(module.parameters()) + list(module.buffers()))
+               for pair in agent.networks().values() for module in pair)
+
+
+def optimizer_bytes(agent):
+    """ optimizer state. before the first update adam has no state yet, so it is estimated (2 moments per param) """
+    total = 0
+    for optimizer in agent.optimizers().values():
+        if optimizer.state:
+            total += sum(_tensors_bytes([v for v in state.values() if hasattr(v, 'numel')])
+                         for state in optimizer.state.values())
+        else:
+            total += 2 * _tensors_bytes([p for group in optimizer.param_groups for p in group['params']])
+    return total
+
+
+class MemoryAccount:
+    """ live memory accounting of one agent """
+    def __init__(self, agent):
+        self.agent = agent
+        self.pending = {}   # name -> bytes of snapshots that are copied but not written yet
+
+    def add_pending(self, name, num_bytes):
+        self.pending[name] = num_bytes
+
+    def remove_pending(self, name):
+        self.pending.pop(name, None)
+
+    def usage(self):
+        """ :return: dictionary of bytes per category (and the total) """
+        usage = {'replay_buffers': sum(buffer.bytes_used() for buffer in self.agent.replay_buffers()),
+                 'networks': network_bytes(self.agent),
+                 'optimizers': optimizer_bytes(self.agent),
+                 'pending_snapshots': sum(self.pending.values())}
+        usage['total'] = sum(usage.values())
+        return usage
+
+    def report(self):
+        return '\t'.join('{}: {}'.format(k, format_size(v)) for k, v in self.usage().items())
+
+
+def transition_bytes(agent_type, state_size, action_size, num_agents):
+    """
+    bytes of one experience in each replay buffer of the agent type.
+    measured on a probe agent that stores a single transition (the agents store experiences in different shapes).
+    """
+    probe = agent_type(state_size=state_size, action_size=action_size, num_agents=num_agents, random_seed=0)
+    states = np.zeros((num_agents, state_size))
+    actions = np.zeros((num_agents, action_size))
+    probe.step(states, actions, [0.0] * num_agents, np.zeros((num_agents, state_size)), [False] * num_agents)
+    return [buffer.bytes_per_experience() for buffer in probe.replay_buffers()]
+
+
+def fit_memory_budget(agent, budget):
+    """
+    size the replay buffers of the agent so that buffers + networks + optimizers (+ one snapshot of the networks
+    for checkpoints) fit the budget. buffers that already fit keep their capacity.
+    :param agent: the agent, before training
+    :param budget: bytes
+    :return: MemoryAccount of the agent
+    """
+    account = MemoryAccount(agent)
+    buffers = agent.replay_buffers()
+    per_transition = transition_bytes(type(agent), agent.state_size, agent.action_size, agent.num_agents)
+    fixed = network_bytes(agent) + optimizer_bytes(agent) + network_bytes(agent) // 2  # + snapshot of the locals
+    available = budget - fixed
+    needed = sum(buffer.capacity * size for buffer, size in zip(buffers, per_transition))
+    print('\nmemory budget {}: networks + optimizers + snapshot {}, replay buffers need {}'.format(
+        format_size(budget), format_size(fixed), format_size(needed)))
+    if needed <= available:
+        return account
+    # shrink all the buffers by the same factor
+    factor = available / needed
+    capacities = [int(buffer.capacity * factor) for buffer in buffers]
+    minimum = MIN_CAPACITY_BATCHES * buffers[0].batch_size
+    if min(capacities) < minimum:
+        print('memory budget is too small: replay buffers would keep {} experiences, at least {} are needed'.format(
+            min(capacities), minimum))
+        raise MemoryError
+    print('warning: replay buffers do not fit the budget, reducing capacity from {} to {} experiences'.format(
+        buffers[0].capacity, capacities[0]))
+    for buffer, capacity in zip(buffers, capacities):
+        buffer.set_capacity(capacity)
+    return account
@@ -0,0 +1,30 @@
+"""
+bfloat16 mixed precision for learn(): the forward passes (and so their backward) run in bfloat16 under autocast,
+while the weights, the gradients, the optimizer state and the soft updates of the target networks stay float32.
+the losses are computed in float32. it is enabled by the MIXED_PRECISION constant of the agents.
+"""
+
+import contextlib
+
+import torch
+
+
+def learn_autocast(device, enabled):
+    """
+    :param device: torch device of the networks
+    :param enabled: whether to run in bfloat16 (a no-op context when False)
+    :return: the autocast context for the forward passes of learn()
+    """
+    if not enabled:
+        return contextlib.nullcontext()
+    if not hasattr(torch, 'autocast'):
+        print('MIXED_PRECISION needs torch 1.10 or higher (torch.autocast), found torch {}'.format(torch.__version__))
+        raise ImportError
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+
+
+def bf16_supported(device):
+    """ :return: whether the device computes bfloat16 natively (without it autocast is slower than float32) """
+    if device.type == 'cuda':
+        return torch.cuda.is_bf16_supported()
+    return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
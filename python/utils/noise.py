@@ -32,3 +32,11 @@ class OUNoise:
         dx = self.theta * (self.mu - x) + self.sigma * np.random.standard_normal(self.size)
         self.state = x + dx
         return self.state
+
+    def state_dict(self):
+        """ the changing part of the process (its state and decayed sigma), for resuming a training """
+        return {'state': copy.copy(self.state), 'sigma': self.sigma}
+
+    def load_state_dict(self, state_dict):
+        self.state = copy.copy(state_dict['state'])
+        self.sigma = state_dict['sigma']
@@ -0,0 +1,155 @@
+"""
+actors evaluated with numpy only, for testing and serving without pytorch in the loop.
+the actors (fc1 -> relu -> fc2 -> relu -> fc3 -> tanh, the same for every agent type) are read from an array file
+(NUMPY_ACTORS_FILENAME, written by export --format numpy, loadable without importing torch) or converted from the
+weights of the agent (.pth files or bundle). the forward runs in preallocated float32 buffers, which at the small
+batches of a game (one row per car) is much cheaper than the dispatch of the pytorch layers.
+this module does not import torch.
+"""
+
+import os
+
+import numpy as np
+
+NUMPY_ACTORS_FILENAME = "actors.npz"
+ACTOR_LAYERS = ['fc1', 'fc2', 'fc3']    # linear layers of an actor, in order (ddpg_model / maddpg_model)
+
+
+class NumpyActor:
+    def __init__(self, layers, max_batch=64):
+        """
+        :param layers: (weight (out, in), bias (out,)) of every linear layer, in order
+        :param max_batch: rows of the preallocated buffers (they grow when a larger batch comes)
+        """
+        # transposed and contiguous, so a layer is one matmul into its buffer
+        self.weights = [np.ascontiguousarray(np.asarray(weight, dtype=np.float32).T) for weight, _ in layers]
+        self.biases = [np.asarray(bias, dtype=np.float32) for _, bias in layers]
+        self.state_size = self.weights[0].shape[0]
+        self.action_size = self.weights[-1].shape[1]
+        self.buffers = None
+        self._allocate(max_batch)
+
+    def _allocate(self, max_batch):
+        self.buffers = [np.empty((max_batch, weight.shape[1]), dtype=np.float32) for weight in self.weights]
+
+    def __call__(self, states):
+        """
+        the forward of the actor (not thread safe - the buffers are shared between calls).
+        :param states: (batch, state_size)
+        :return: actions (batch, action_size), a new array
+        """
+        x = np.asarray(states, dtype=np.float32).reshape(-1, self.state_size)
+        if len(x) > len(self.buffers[0]):
+            self._allocate(len(x))
+        last = len(self.weights) - 1
+        for i, (weight, bias, buffer) in enumerate(zip(self.weights, self.biases, self.buffers)):
+            out = buffer[:len(x)]
+            np.matmul(x, weight, out=out)
+            out += bias
+            if i < last:
+                np.maximum(out, 0, out=out)     # relu
+            else:
+                np.tanh(out, out=out)
+            x = out
+        return x.copy()
+
+
+def actor_layers(state_dict):
+    """ :param state_dict: state dict of an actor (tensors or arrays) :return: layers for NumpyActor """
+    def array(value):
+        return value.detach().cpu().numpy() if hasattr(value, 'detach') else np.asarray(value)
+    others = sorted(set(state_dict) - {layer + suffix for layer in ACTOR_LAYERS for suffix in ['.weight', '.bias']})
+    if others:
+        # e.g. the per car bias of a student conditioned on the agent index
+        print('the numpy runtime does not evaluate the actor parameters {}'.format(', '.join(others)))
+        raise ValueError(others)
+    return [(array(state_dict[layer + '.weight']), array(state_dict[layer + '.bias'])) for layer in ACTOR_LAYERS]
+
+
+def save_numpy_actors(actors, directory_path):
+    """
+    write the actors to an array file.
+    :param actors: the agent's actors (agent.actors())
+    :param directory_path: directory of the file (NUMPY_ACTORS_FILENAME)
+    :return: path of the file
+    """
+    if not os.path.isdir(directory_path):
+        os.makedirs(directory_path)
+    arrays = {}
+    for i, actor in enumerate(actors):
+        for layer, (weight, bias) in zip(ACTOR_LAYERS, actor_layers(actor.state_dict())):
+            arrays['{}/{}.weight'.format(i, layer)] = weight.astype(np.float32)
+            arrays['{}/{}.bias'.format(i, layer)] = bias.astype(np.float32)
+    path = os.path.join(directory_path, NUMPY_ACTORS_FILENAME)
+    # written next to the file and renamed, a reader never sees half a file
+    tmp_path = os.path.join(directory_path, 'tmp_' + NUMPY_ACTORS_FILENAME)
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_numpy_actors(path, max_batch=64):
+    """ :param path: array file, or directory containing one :return: list of NumpyActor """
+    if os.path.isdir(path):
+        path = os.path.join(path, NUMPY_ACTORS_FILENAME)
+    with np.load(path) as arrays:
+        num_actors = len({name.split('/')[0] for name in arrays.files})
+        return [NumpyActor([(arrays['{}/{}.weight'.format(i, layer)], arrays['{}/{}.bias'.format(i, layer)])
+                            for layer in ACTOR_LAYERS], max_batch) for i in range(num_actors)]
+
+
+def _newer_weights(directory_path):
+    """
+    :return: whether a weights file of the dir was written after the array file (every name with .pth in it, maddpg
+    saves e.g. maddpgActor_Model.pth_0)
+    """
+    array_mtime = os.path.getmtime(os.path.join(directory_path, NUMPY_ACTORS_FILENAME))
+    return any(os.path.getmtime(os.path.join(root, name)) > array_mtime
+               for root, _, names in os.walk(directory_path) for name in names
+               if '.pth' in name)
+
+
+def load_numpy_actors(weights_path, agent_type, state_size, action_size, num_agents, max_batch=64):
+    """
+    the actors of a weights dir, from its array file when it is up to date (no torch needed), otherwise converted
+    from the agent's weights.
+    :param weights_path: weights dir
+    :param agent_type: agent class, to read the .pth weights
+    :return: list of NumpyActor (one for all the cars, or one per car)
+    """
+    if os.path.isfile(os.path.join(weights_path, NUMPY_ACTORS_FILENAME)) and not _newer_weights(weights_path):
+        return read_numpy_actors(weights_path, max_batch)
+    agent = agent_type(state_size=state_size, action_size=action_size, num_agents=num_agents, random_seed=0)
+    agent.load_weights(weights_path)
+    return [NumpyActor(actor_layers(actor.state_dict()), max_batch) for actor in agent.actors()]
+
+
+def act(actors, states):
+    """
+    :param actors: list of NumpyActor - one for all the cars, or one per car
+    :param states: (..., num_agents, state_size)
+    :return: actions (..., num_agents, action_size) clipped to [-1, 1]
+    """
+    states = np.asarray(states, dtype=np.float32)
+    if len(actors) == 1:
+        actions = actors[0](states.reshape(-1, states.shape[-1])).reshape(*states.shape[:-1], -1)
+    else:
+        actions = np.stack([actors[i](states[..., i, :]).reshape(*states.shape[:-2], -1)
+                            for i in range(len(actors))], axis=-2)
+    return np.clip(actions, -1, 1)
+
+
+class NumpyAgent:
+    """ the acting part of an agent (act, reset), for test runs with the numpy actors """
+    def __init__(self, actors):
+        self.actors = actors
+
+    def act(self, states, add_noise=False):
+        """ :param states: (num_agents, state_size) :return: actions (num_agents, action_size), no noise """
+        return act(self.actors, states)
+
+    def reset(self):
+        pass
+
+    def restart(self, cars=None):
+        pass
@@ -10,6 +10,8 @@ import random
 from collections import namedtuple, deque
 import pickle
 import copy
+import itertools
+import sys
 
 # Determine if CPU or GPU computation should be used
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
@@ -17,6 +19,18 @@ device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 Experience = namedtuple("Experience", field_names=["state", "action", "reward", "next_state", "done"])
 
 
+def experience_bytes(experience):
+    """ approximate memory of one stored experience, including the python objects around the arrays """
+    def size(obj):
+        if isinstance(obj, np.ndarray):
+            return sys.getsizeof(obj) + (0 if obj.flags.owndata else obj.nbytes)
+        if isinstance(obj, (tuple, list)):
+            return sys.getsizeof(obj) + sum(size(o) for o in obj)
+        return sys.getsizeof(obj)
+    # + the deque slot pointing at the experience
+    return size(experience) + 8
+
+
 class ReplayBuffer:
     """Fixed-size buffer to store experience tuples."""
 
@@ -36,6 +50,10 @@ class ReplayBuffer:
         """Add a new experience to memory."""
         e = Experience(state, action, reward, next_state, done)
         self.memory.append(e)
+
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        """ add many experiences at once (row i of every array is one experience) """
+        self.memory.extend(map(Experience, states, actions, rewards, next_states, dones))
     
     def sample(self):
         """Randomly sample a batch of experiences from memory."""
@@ -49,6 +67,33 @@ class ReplayBuffer:
 
         return states, actions, rewards, next_states, dones
 
+    @property
+    def capacity(self):
+        """ maximal number of experiences kept """
+        return self.memory.maxlen
+
+    def set_capacity(self, buffer_size):
+        """ change the maximal number of experiences (the oldest ones are dropped if needed) """
+        self.memory = deque(self.memory, maxlen=buffer_size)
+
+    def bytes_per_experience(self):
+        """ approximate memory of one stored experience (there must be one) """
+        return experience_bytes(self.memory[0])
+
+    def states(self):
+        """ :return: the states of the stored experiences """
+        return np.array([e.state for e in self.memory])
+
+    def shard(self, rank, world_size):
+        """ keep every world_size-th experience, from the rank-th on (data parallel learning) """
+        self.memory = deque(itertools.islice(self.memory, rank, None, world_size), maxlen=self.capacity)
+
+    def bytes_used(self):
+        """ approximate memory used by the stored experiences (all experiences have the same shapes) """
+        if len(self.memory) == 0:
+            return 0
+        return len(self.memory) * experience_bytes(self.memory[0])
+
     def __len__(self):
         """Return the current size of internal memory."""
         return len(self.memory)
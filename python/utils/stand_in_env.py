@@ -0,0 +1,107 @@
+"""
+Stand-in for the Unity race environment.
+it exposes the same (small) part of the mlagents 0.7 UnityEnvironment api that train / test use
+(brain_names, brains, reset, step, close), so everything that runs against the game can also run
+on machines without the Unity build - e.g. to check a distributed setup on localhost.
+the dynamics are a toy version of the race: each car drives along a 1D track, ray casts are
+noisy distances to the next obstacle, and the car is done when it crashes or reaches max_steps.
+it can also inject faults of the player (hangs and crashes), to exercise the environment watchdog.
+"""
+
+import threading
+
+import numpy as np
+
+BRAIN_NAME = 'StandInBrain'
+STATE_SIZE = 46         # same observation size as the race game (ray casts + velocity + direction)
+ACTION_SIZE = 2         # steer left/right, brake/drive
+MAX_STEPS = 300         # steps until a car is done on its own
+
+
+class BrainParameters:
+    """ the part of mlagents BrainParameters used by the wrappers """
+    def __init__(self, state_size, action_size):
+        self.brain_name = BRAIN_NAME
+        self.vector_observation_space_size = state_size
+        self.vector_action_space_size = [action_size]
+
+
+class BrainInfo:
+    """ the part of mlagents BrainInfo used by the wrappers """
+    def __init__(self, vector_observations, rewards, local_done, agents):
+        self.vector_observations = vector_observations
+        self.rewards = rewards
+        self.local_done = local_done
+        self.agents = agents
+
+
+class StandInCrash(RuntimeError):
+    """ a crash of the player, injected by the stand-in """
+
+
+class StandInEnvironment:
+    def __init__(self, worker_id=0, seed=0, max_steps=MAX_STEPS, hang=0.0, crash=0.0):
+        """
+        :param worker_id: same meaning as in UnityEnvironment (only used to vary the seed here)
+        :param seed: random seed of the simulation
+        :param max_steps: number of steps after which a car is done
+        :param hang: probability that a step never returns (injected fault)
+        :param crash: probability that a step raises StandInCrash (injected fault)
+        """
+        self.worker_id = worker_id
+        self.max_steps = max_steps
+        self.rng = np.random.RandomState(seed + worker_id)
+        self.hang = hang
+        self.crash = crash
+        self.fault_rng = np.random.RandomState(seed + worker_id + 1)    # the faults do not change the dynamics
+        self.brain_names = [BRAIN_NAME]
+        self.brains = {BRAIN_NAME: BrainParameters(STATE_SIZE, ACTION_SIZE)}
+        self.num_agents = 1
+        self.num_obstacles = 4
+        self.position = None
+        self.velocity = None
+        self.steps = None
+        self.done = None
+
+    def reset(self, train_mode=True, config=None):
+        """ reset all cars. config is the env_config dict (num_agents, num_obstacles) """
+        if config is not None:
+            self.num_agents = int(config.get('num_agents', self.num_agents))
+            self.num_obstacles = int(config.get('num_obstacles', self.num_obstacles))
+        self.position = np.zeros(self.num_agents)
+        self.velocity = np.zeros(self.num_agents)
+        self.steps = np.zeros(self.num_agents, dtype=int)
+        self.done = np.zeros(self.num_agents, dtype=bool)
+        return {BRAIN_NAME: self._brain_info(np.zeros(self.num_agents))}
+
+    def step(self, vector_action=None):
+        """ apply one action per car (steer, drive) and advance the simulation by one step """
+        if self.hang or self.crash:
+            fault = self.fault_rng.random_sample()
+            if fault < self.hang:
+                threading.Event().wait()    # never returns, like a frozen player
+            if fault < self.hang + self.crash:
+                raise StandInCrash('the stand-in player crashed (injected fault)')
+        actions = np.asarray(vector_action, dtype=np.float64).reshape(self.num_agents, ACTION_SIZE)
+        actions = np.clip(actions, -1, 1)
+        # reset cars that were done on the previous step (unity does the same for done agents)
+        self.position[self.done] = 0
+        self.velocity[self.done] = 0
+        self.steps[self.done] = 0
+        self.velocity = np.clip(0.9 * self.velocity + 0.1 * actions[:, 1], -1, 1)
+        self.position += self.velocity
+        self.steps += 1
+        # steering hard at speed makes crashes (and more obstacles) more likely
+        crash_prob = 0.002 * (1 + self.num_obstacles) * (0.2 + np.abs(actions[:, 0]) * np.abs(self.velocity))
+        crashed = self.rng.random_sample(self.num_agents) < crash_prob
+        rewards = self.velocity * 0.1 - crashed * 1.0
+        self.done = crashed | (self.steps >= self.max_steps)
+        return {BRAIN_NAME: self._brain_info(rewards)}
+
+    def close(self):
+        pass
+
+    def _brain_info(self, rewards):
+        rays = self.rng.random_sample((self.num_agents, STATE_SIZE - 2))
+        obs = np.concatenate([rays, self.velocity[:, None], np.cos(self.position)[:, None]], axis=1)
+        return BrainInfo(obs, list(rewards), list(self.done), list(range(self.num_agents)))
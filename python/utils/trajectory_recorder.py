@@ -0,0 +1,193 @@
+"""
+recording of the steps of training / test episodes, for later analysis and replay.
+a recording is a directory of chunk files, every chunk is a compressed .npz with one array per column:
+    observations (rows, state_size), actions (rows, action_size), rewards, dones, agent_ids, episode_ids, steps
+one row per car per env step. chunks are written by a background thread when they are full, so memory is bounded
+by two chunks. index.json lists the chunks with their episode range, so a reader can load one chunk at a time. it is
+rewritten after every chunk, so a run that stops early keeps a readable recording of its written chunks.
+an episode is either one episode of all the cars, or (continuous runs) one episode of a single car - then the rows of
+several episodes are interleaved. a run appended to a recording numbers its episodes after the recorded ones.
+"""
+
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+INDEX_FILENAME = 'index.json'
+CHUNK_ROWS = 16384  # rows per chunk file
+COLUMNS = ['observations', 'actions', 'rewards', 'dones', 'agent_ids', 'episode_ids', 'steps']
+
+
+class TrajectoryRecorder:
+    def __init__(self, directory_path, state_size, action_size, chunk_rows=CHUNK_ROWS):
+        """
+        :param directory_path: directory of the recording (created if needed, existing chunks are kept)
+        :param state_size: size of the observation of one car
+        :param action_size: size of the action of one car
+        :param chunk_rows: rows per chunk file
+        """
+        if not os.path.isdir(directory_path):
+            os.makedirs(directory_path)
+        self.directory_path = directory_path
+        self.chunk_rows = chunk_rows
+        if os.path.isfile(os.path.join(directory_path, INDEX_FILENAME)):
+            self.index = TrajectoryReader(directory_path).index
+            if (self.index['state_size'], self.index['action_size']) != (state_size, action_size):
+                print('{} holds a recording with other observation / action sizes'.format(directory_path))
+                raise ValueError(directory_path)
+        else:
+            self.index = {'state_size': state_size, 'action_size': action_size, 'chunks': []}
+        self.shapes = {'observations': (state_size,), 'actions': (action_size,)}
+        self.dtypes = {'observations': np.float32, 'actions': np.float32, 'rewards': np.float32, 'dones': bool,
+                       'agent_ids': np.int16, 'episode_ids': np.int32, 'steps': np.int32}
+        self.chunk = self._new_chunk()
+        self.rows = 0
+        self.num_chunks = len(self.index['chunks'])     # chunks handed to the writer (the index lists the written)
+        self.error = None   # exception of the writer thread, raised in the training loop
+        self.episode_step = {}  # current episode id -> its next step number
+        # the episode ids of an appended run continue after the recorded ones
+        self.episode_offset = max([chunk['last_episode'] + 1 for chunk in self.index['chunks']], default=0)
+        # one chunk can wait while another is written (bounded memory, the training loop rarely waits)
+        self.chunks_to_write = queue.Queue(maxsize=1)
+        self.writer = threading.Thread(target=self._write_chunks, daemon=True)
+        self.writer.start()
+
+    def _new_chunk(self):
+        return {name: np.zeros((self.chunk_rows,) + self.shapes.get(name, ()), dtype=self.dtypes[name])
+                for name in COLUMNS}
+
+    def _write_index(self):
+        # written next to the index and renamed, a reader never sees half an index
+        tmp_path = os.path.join(self.directory_path, INDEX_FILENAME + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp_path, os.path.join(self.directory_path, INDEX_FILENAME))
+
+    def _write_chunks(self):
+        """ writer thread - compresses and writes the full chunks, then lists them in the index """
+        while True:
+            item = self.chunks_to_write.get()
+            if item is None:
+                return
+            if self.error is not None:
+                # keep taking the chunks, so the training loop never blocks on a dead writer
+                continue
+            entry, columns = item
+            try:
+                np.savez_compressed(os.path.join(self.directory_path, entry['filename']), **columns)
+                self.index['chunks'].append(entry)
+                self._write_index()
+            except Exception as e:
+                self.error = e
+
+    def _check_writer(self):
+        if self.error is not None:
+            print('writing the recording to {} failed: {!r}'.format(self.directory_path, self.error))
+            raise self.error
+
+    def _flush(self):
+        self._check_writer()
+        if self.rows == 0:
+            return
+        columns = {name: column[:self.rows] for name, column in self.chunk.items()}
+        entry = {'filename': 'chunk_{:06d}.npz'.format(self.num_chunks), 'rows': self.rows,
+                 'first_episode': int(columns['episode_ids'].min()), 'last_episode': int(columns['episode_ids'].max())}
+        self.num_chunks += 1
+        self.chunks_to_write.put((entry, columns))
+        self.chunk = self._new_chunk()
+        self.rows = 0
+
+    def record(self, episode_id, observations, actions, rewards, dones):
+        """
+        record one env step of all the cars.
+        :param episode_id: id of the episode, or the id of the episode of every car (num_agents,) - continuous runs
+        :param observations: observations the actions were taken on (num_agents, state_size)
+        :param actions: (num_agents, action_size)
+        :param rewards: rewards received for the actions (num_agents,)
+        :param dones: whether the episode is done after the actions (num_agents,)
+        """
+        num_agents = len(observations)
+        episode_ids = np.broadcast_to(np.asarray(episode_id) + self.episode_offset, (num_agents,))
+        steps = [self.episode_step.get(int(e), 0) for e in episode_ids]
+        self.episode_step = {int(e): step + 1 for e, step in zip(episode_ids, steps)}
+        if self.rows + num_agents > self.chunk_rows:
+            self._flush()
+        rows = slice(self.rows, self.rows + num_agents)
+        self.chunk['observations'][rows] = np.reshape(observations, (num_agents, -1))
+        self.chunk['actions'][rows] = np.reshape(actions, (num_agents, -1))
+        self.chunk['rewards'][rows] = rewards
+        self.chunk['dones'][rows] = dones
+        self.chunk['agent_ids'][rows] = np.arange(num_agents)
+        self.chunk['episode_ids'][rows] = episode_ids
+        self.chunk['steps'][rows] = steps
+        self.rows += num_agents
+
+    def close(self):
+        """ write the last chunk and the index """
+        self._flush()
+        self.chunks_to_write.put(None)
+        self.writer.join()
+        self._check_writer()
+        self._write_index()
+
+
+class TrajectoryReader:
+    def __init__(self, directory_path):
+        index_path = os.path.join(directory_path, INDEX_FILENAME)
+        if not os.path.isfile(index_path):
+            print('{} is not a trajectory recording'.format(directory_path))
+            raise FileNotFoundError(index_path)
+        self.directory_path = directory_path
+        with open(index_path) as f:
+            self.index = json.load(f)
+
+    def chunks(self, columns=None, first_episode=None, last_episode=None):
+        """
+        iterate over the chunks, loading one at a time.
+        :param columns: names of the columns to load (default all), the other columns are not decompressed
+        :param first_episode: skip the chunks that end before this episode
+        :param last_episode: skip the chunks that start after this episode
+        :return: generator of dictionaries column name -> array
+        """
+        for chunk in self.index['chunks']:
+            if first_episode is not None and chunk['last_episode'] < first_episode:
+                continue
+            if last_episode is not None and chunk['first_episode'] > last_episode:
+                continue
+            with np.load(os.path.join(self.directory_path, chunk['filename'])) as data:
+                yield {name: data[name] for name in (columns or COLUMNS)}
+
+    def episodes(self, columns=None):
+        """
+        iterate over the episodes lazily (an episode can span several chunks, only the rows of the unfinished episodes
+        are held). an episode is finished when each of its cars is done or has rows of another episode, or when the
+        recording ends.
+        :param columns: names of the columns to load (default all)
+        :return: generator of (episode id, dictionary column name -> array with the rows of the episode)
+        """
+        columns = list(columns or COLUMNS)
+        load = list(dict.fromkeys(columns + ['episode_ids', 'agent_ids', 'dones']))
+        pending = {}    # episode id -> parts of its rows, one per chunk
+        current = {}    # car -> episode id of its newest row, None when that row is done
+        for chunk in self.chunks(load):
+            ids = chunk['episode_ids']
+            order = np.argsort(ids, kind='stable')
+            episode_ids, starts = np.unique(ids[order], return_index=True)
+            for episode_id, start, end in zip(episode_ids, starts, np.r_[starts[1:], len(ids)]):
+                rows = order[start:end]
+                pending.setdefault(int(episode_id), []).append({name: chunk[name][rows] for name in columns})
+            # the newest row of every car (the last one of the chunk)
+            cars, last = np.unique(chunk['agent_ids'][::-1], return_index=True)
+            last = len(ids) - 1 - last
+            current.update(zip(cars.tolist(), np.where(chunk['dones'][last], None, ids[last]).tolist()))
+            for episode_id in sorted(set(pending) - set(current.values())):
+                yield episode_id, self._join(pending.pop(episode_id), columns)
+        for episode_id in sorted(pending):
+            yield episode_id, self._join(pending[episode_id], columns)
+
+    @staticmethod
+    def _join(parts, columns):
+        return {name: np.concatenate([part[name] for part in parts]) for name in columns}